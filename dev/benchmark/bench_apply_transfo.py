@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Benchmark of spinalcordtoolbox.warping.apply_transforms.
+#
+# Warps several volumes with the same warping field and affine transformation, to measure the
+# cost of the first call (composition of the transformations) and of the following calls
+# (cached sampling points). If isct_antsApplyTransforms is in the PATH, the same volumes are
+# warped with it and the outputs are compared.
+#
+# Usage: python bench_apply_transfo.py [size] [n_volumes]
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+from __future__ import print_function, absolute_import
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+import numpy as np
+import nibabel
+
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox import warping
+
+
+def which(program):
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        if os.path.isfile(os.path.join(path, program)):
+            return os.path.join(path, program)
+
+
+def main(size=128, n_volumes=5):
+    path_tmp = tempfile.mkdtemp()
+    rs = np.random.RandomState(0)
+    shape = (size, size, size // 2)
+    affine = np.diag([0.8, 0.8, 1.5, 1.])
+    hdr = nibabel.Nifti1Image(np.zeros(shape), affine).header
+
+    # smooth random displacement field, in mm
+    warp = np.zeros(shape + (1, 3), dtype=np.float32)
+    x, y, z = np.mgrid[0:shape[0], 0:shape[1], 0:shape[2]]
+    warp[..., 0, 0] = 2 * np.sin(z / 10.)
+    warp[..., 0, 1] = 1.5 * np.cos(x / 15.)
+    warp[..., 0, 2] = np.sin(y / 20.)
+    im_warp = Image(warp, hdr=hdr.copy())
+    im_warp.header.set_intent('vector', (), '')
+    fname_warp = os.path.join(path_tmp, 'warp.nii.gz')
+    im_warp.save(fname_warp)
+    fname_affine = os.path.join(path_tmp, 'affine.txt')
+    with open(fname_affine, 'w') as f:
+        f.write("#Insight Transform File V1.0\n#Transform 0\nTransform: AffineTransform_double_3_3\n"
+                "Parameters: 0.99 -0.05 0 0.05 0.99 0 0 0 1 1.5 -2 0.5\nFixedParameters: 10 20 30\n")
+    list_warp = [fname_warp, fname_affine]
+
+    im_dest = Image(np.zeros(shape, dtype=np.float32), hdr=hdr.copy())
+    fname_dest = os.path.join(path_tmp, 'dest.nii')
+    im_dest.save(fname_dest)
+    fname_src = []
+    for i in range(n_volumes):
+        fname_src.append(os.path.join(path_tmp, 'src_{}.nii'.format(i)))
+        Image(rs.rand(*shape).astype(np.float32), hdr=hdr.copy()).save(fname_src[-1])
+
+    for interp in ['linear', 'spline']:
+        warping.clear_cache()
+        times = []
+        for i in range(n_volumes):
+            t0 = time.time()
+            im_out = warping.apply_transforms(Image(fname_src[i]), im_dest, list_warp, interp=interp)
+            times.append(time.time() - t0)
+            im_out.save(os.path.join(path_tmp, 'native_{}_{}.nii'.format(interp, i)))
+        print("native {}: first volume {:.2f}s, next volumes {:.2f}s each".format(
+            interp, times[0], np.mean(times[1:]) if n_volumes > 1 else float('nan')))
+
+        if which('isct_antsApplyTransforms'):
+            t0 = time.time()
+            for i in range(n_volumes):
+                fname_out = os.path.join(path_tmp, 'ants_{}_{}.nii'.format(interp, i))
+                subprocess.check_call(['isct_antsApplyTransforms', '-d', '3', '-i', fname_src[i], '-o', fname_out,
+                                       '-t', fname_affine, fname_warp, '-r', fname_dest,
+                                       '-n', {'linear': 'Linear', 'spline': 'BSpline[3]'}[interp]])
+            print("isct_antsApplyTransforms {}: {:.2f}s per volume".format(interp, (time.time() - t0) / n_volumes))
+            diff = np.abs(Image(fname_out).data - im_out.data)
+            print("  max abs difference with native: {:.2e}, mean: {:.2e}".format(diff.max(), diff.mean()))
+
+    shutil.rmtree(path_tmp)
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Benchmark of the construction of spinalcordtoolbox.types.Centerline.
+#
+# Compares the array-backed construction against the former per-point construction (loops
+# for the lengths, list comprehensions for the coordinate systems and plane parameters), and
+# reports the largest difference between both.
+#
+# Usage: python bench_centerline.py [n_points] [n_repeats]
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+from __future__ import print_function, absolute_import
+
+import sys
+import time
+
+import numpy as np
+from numpy.linalg import norm, inv
+
+from spinalcordtoolbox.types import Centerline
+
+
+def construct_per_point(points, derivatives):
+    """Reference implementation: former construction of Centerline, one point at a time"""
+    points = np.array(list(zip(points[:, 0], points[:, 1], points[:, 2])))
+    derivatives = np.array(list(zip(derivatives[:, 0], derivatives[:, 1], derivatives[:, 2])))
+    n = len(points)
+    length, progressive_length, incremental_length = 0.0, [0.0], [0.0]
+    progressive_length_inverse, incremental_length_inverse = [0.0], [0.0]
+    for i in range(0, n - 1):
+        distance = np.sqrt((points[i][0] - points[i + 1][0]) ** 2 +
+                           (points[i][1] - points[i + 1][1]) ** 2 +
+                           (points[i][2] - points[i + 1][2]) ** 2)
+        length += distance
+        progressive_length.append(distance)
+        incremental_length.append(incremental_length[-1] + distance)
+    for i in range(n - 1, 0, -1):
+        distance = np.sqrt((points[i][0] - points[i - 1][0]) ** 2 +
+                           (points[i][1] - points[i - 1][1]) ** 2 +
+                           (points[i][2] - points[i - 1][2]) ** 2)
+        progressive_length_inverse.append(distance)
+        incremental_length_inverse.append(incremental_length_inverse[-1] + distance)
+
+    coordinate_system = []
+    for index in range(n):
+        z_prime_axis = derivatives[index]
+        z_prime_axis /= norm(z_prime_axis)
+        y_axis = np.array([0, 1, 0])
+        y_prime_axis = (y_axis - np.dot(y_axis, z_prime_axis) * z_prime_axis)
+        y_prime_axis /= norm(y_prime_axis)
+        x_prime_axis = np.cross(y_prime_axis, z_prime_axis)
+        x_prime_axis /= norm(x_prime_axis)
+        matrix_base = np.array([[x_prime_axis[0], y_prime_axis[0], z_prime_axis[0]],
+                                [x_prime_axis[1], y_prime_axis[1], z_prime_axis[1]],
+                                [x_prime_axis[2], y_prime_axis[2], z_prime_axis[2]]])
+        coordinate_system.append((matrix_base, inv(matrix_base)))
+    plans_parameters = []
+    for index in range(n):
+        a, b, c = derivatives[index]
+        plans_parameters.append([a, b, c, - (a * points[index][0] + b * points[index][1] + c * points[index][2])])
+
+    return {'length': length,
+            'incremental_length': incremental_length,
+            'incremental_length_inverse': incremental_length_inverse,
+            'matrices': np.stack([item[0] for item in coordinate_system]),
+            'inverse_matrices': np.stack([item[1] for item in coordinate_system]),
+            'plans_parameters': np.array(plans_parameters)}
+
+
+def main(n_points=3000, n_repeats=10):
+    z = np.linspace(-300, 0, n_points)
+    points = np.stack((10 * np.sin(z / 50.), 5 * np.cos(z / 80.), z), axis=1)
+    derivatives = np.stack((np.gradient(points[:, 0], z), np.gradient(points[:, 1], z), np.ones(n_points)), axis=1)
+
+    t0 = time.time()
+    for _ in range(n_repeats):
+        ref = construct_per_point(points, derivatives)
+    t1 = time.time()
+    for _ in range(n_repeats):
+        centerline = Centerline(points[:, 0], points[:, 1], points[:, 2],
+                                derivatives[:, 0], derivatives[:, 1], derivatives[:, 2])
+    t2 = time.time()
+    print("per-point: {:.2f} ms per centerline of {} points".format((t1 - t0) * 1000 / n_repeats, n_points))
+    print("vectorized (including KD-tree): {:.2f} ms per centerline".format((t2 - t1) * 1000 / n_repeats))
+
+    for key in sorted(ref):
+        diff = np.max(np.abs(np.asarray(getattr(centerline, key)) - np.asarray(ref[key])))
+        print("  {}: max abs difference {:.2e}".format(key, diff))
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Benchmark of msct_register.register2d_centermassrot (algo=centermassrot).
+#
+# Compares the batched estimation (moments, PCA and orientation histograms of all slices at
+# once, warping fields built with array operations) against the former loop, which used one
+# sklearn PCA, one orientation histogram and per-voxel list comprehensions for each slice, and
+# reports the largest difference between the warping fields of both.
+#
+# Usage: python bench_centermassrot.py [nz] [size]
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+from __future__ import print_function, absolute_import
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from math import cos, sin
+
+import numpy as np
+from scipy import ndimage
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+
+from msct_register import Paramreg, register2d_centermassrot, compute_pca, angle_between, find_angle_hog
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.testing.create_test_data import dummy_segmentation
+
+
+def centermassrot_per_slice(im_src, im_dest, im_src_im, im_dest_im, rot_method, filter_size=5,
+                            pca_eigenratio_th=1.6, th_max_angle=40):
+    """Reference implementation: former loop of register2d_centermassrot, returns the warping fields"""
+    nx, ny, nz, nt, px, py, pz, pt = im_dest.dim
+    data_src, data_dest = im_src.data, im_dest.data
+    pca_src, pca_dest = [None] * nz, [None] * nz
+    centermass_src, centermass_dest = np.zeros([nz, 2]), np.zeros([nz, 2])
+    angle_src_dest = np.zeros(nz)
+    z_nonzero = []
+    th_max_angle *= np.pi / 180
+    for iz in range(nz):
+        try:
+            _, pca_src[iz], centermass_src[iz, :] = compute_pca(data_src[:, :, iz])
+            _, pca_dest[iz], centermass_dest[iz, :] = compute_pca(data_dest[:, :, iz])
+            if rot_method in ['hog', 'pcahog']:
+                angle_src_hog, _ = find_angle_hog(im_src_im.data[:, :, iz], centermass_src[iz, :], px, py,
+                                                  angle_range=th_max_angle)
+                angle_dest_hog, _ = find_angle_hog(im_dest_im.data[:, :, iz], centermass_dest[iz, :], px, py,
+                                                   angle_range=th_max_angle)
+                if rot_method == 'hog':
+                    angle_src, angle_dest = -angle_src_hog, angle_dest_hog
+            if rot_method in ['pca', 'pcahog']:
+                eigenv_src = pca_src[iz].components_.T[0][0], pca_src[iz].components_.T[1][0]
+                eigenv_dest = pca_dest[iz].components_.T[0][0], pca_dest[iz].components_.T[1][0]
+                if eigenv_src[0] <= 0:
+                    eigenv_src = tuple([i * (-1) for i in eigenv_src])
+                if eigenv_dest[0] <= 0:
+                    eigenv_dest = tuple([i * (-1) for i in eigenv_dest])
+                angle_src = angle_between(eigenv_src, [1, 0])
+                angle_dest = angle_between([1, 0], eigenv_dest)
+                ratio_src = pca_src[iz].explained_variance_ratio_[0] / pca_src[iz].explained_variance_ratio_[1]
+                ratio_dest = pca_dest[iz].explained_variance_ratio_[0] / pca_dest[iz].explained_variance_ratio_[1]
+                if ratio_src < pca_eigenratio_th or angle_src > th_max_angle or angle_src < -th_max_angle:
+                    angle_src = 0 if rot_method == 'pca' else -angle_src_hog
+                if ratio_dest < pca_eigenratio_th or angle_dest > th_max_angle or angle_dest < -th_max_angle:
+                    angle_dest = 0 if rot_method == 'pca' else angle_dest_hog
+            angle_src_dest[iz] = angle_src + angle_dest
+            z_nonzero.append(iz)
+        except ValueError:
+            pass
+    angle_src_dest[z_nonzero] = ndimage.filters.gaussian_filter1d(angle_src_dest[z_nonzero], filter_size)
+
+    warp_x, warp_y = np.zeros(data_dest.shape), np.zeros(data_dest.shape)
+    warp_inv_x, warp_inv_y = np.zeros(data_src.shape), np.zeros(data_src.shape)
+    for iz in z_nonzero:
+        row, col = np.indices((nx, ny))
+        coord_init_pix = np.array([row.ravel(), col.ravel(), np.array(np.ones(len(row.ravel())) * iz)]).T
+        coord_init_phy = np.array(im_src.transfo_pix2phys(coord_init_pix))
+        centermass_src_phy = im_src.transfo_pix2phys([[centermass_src[iz, 0], centermass_src[iz, 1], iz]])[0]
+        centermass_dest_phy = im_src.transfo_pix2phys([[centermass_dest[iz, 0], centermass_dest[iz, 1], iz]])[0]
+        R = np.matrix(((cos(angle_src_dest[iz]), sin(angle_src_dest[iz])),
+                       (-sin(angle_src_dest[iz]), cos(angle_src_dest[iz]))))
+        R3d = np.eye(3)
+        R3d[0:2, 0:2] = R
+        coord_forward_phy = np.array(np.dot((coord_init_phy - centermass_dest_phy), R3d) + centermass_src_phy)
+        coord_inverse_phy = np.array(np.dot((coord_init_phy - centermass_src_phy), R3d.T) + centermass_dest_phy)
+        warp_x[:, :, iz] = np.array([coord_forward_phy[i, 0] - coord_init_phy[i, 0]
+                                     for i in range(nx * ny)]).reshape((nx, ny))
+        warp_y[:, :, iz] = np.array([coord_forward_phy[i, 1] - coord_init_phy[i, 1]
+                                     for i in range(nx * ny)]).reshape((nx, ny))
+        warp_inv_x[:, :, iz] = np.array([coord_inverse_phy[i, 0] - coord_init_phy[i, 0]
+                                         for i in range(nx * ny)]).reshape((nx, ny))
+        warp_inv_y[:, :, iz] = np.array([coord_inverse_phy[i, 1] - coord_init_phy[i, 1]
+                                         for i in range(nx * ny)]).reshape((nx, ny))
+    return warp_x, warp_y, warp_inv_x, warp_inv_y
+
+
+def main(nz=400, size=100):
+    path_tmp = tempfile.mkdtemp()
+    curdir = os.getcwd()
+    os.chdir(path_tmp)
+    rs = np.random.RandomState(0)
+    # oblique (in the axial plane) source segmentation and straight destination segmentation, with an image
+    im_src = dummy_segmentation(size_arr=(size, size, nz), pixdim=(1, 1, 1), shape='ellipse', radius_RL=10.0,
+                                radius_AP=5.0, angle_IS=15)
+    im_dest = dummy_segmentation(size_arr=(size, size, nz), pixdim=(1, 1, 1), shape='ellipse', radius_RL=9.0,
+                                 radius_AP=6.0)
+    im_src.save('src_seg.nii')
+    im_dest.save('dest_seg.nii')
+    for fname, im in [('src.nii', im_src), ('dest.nii', im_dest)]:
+        im_im = im.copy()
+        im_im.data = ndimage.gaussian_filter(im.data, 2) + 0.05 * rs.rand(*im.data.shape)
+        im_im.save(fname)
+
+    for rot_method in ['pca', 'pcahog']:
+        paramreg = Paramreg(algo='centermassrot', rot_method=rot_method)
+        t0 = time.time()
+        ref = centermassrot_per_slice(Image('src_seg.nii'), Image('dest_seg.nii'), Image('src.nii'),
+                                      Image('dest.nii'), rot_method)
+        t1 = time.time()
+        register2d_centermassrot(['src_seg.nii', 'src.nii'], ['dest_seg.nii', 'dest.nii'], paramreg=paramreg,
+                                 fname_warp='warp.nii.gz', fname_warp_inv='warp_inv.nii.gz', rot_method=rot_method,
+                                 filter_size=5, verbose=0)
+        t2 = time.time()
+        warp, warp_inv = Image('warp.nii.gz').data, Image('warp_inv.nii.gz').data
+        diff = max(np.abs(-warp[:, :, :, 0, 0] - ref[0]).max(), np.abs(-warp[:, :, :, 0, 1] - ref[1]).max(),
+                   np.abs(-warp_inv[:, :, :, 0, 0] - ref[2]).max(), np.abs(-warp_inv[:, :, :, 0, 1] - ref[3]).max())
+        print("{}: per slice {:.2f}s, batched {:.2f}s (including I/O), {} slices of {}x{}, max abs difference "
+              "{:.2e} mm".format(rot_method, t1 - t0, t2 - t1, nz, size, size, diff))
+
+    os.chdir(curdir)
+    shutil.rmtree(path_tmp)
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Benchmark of spinalcordtoolbox.process_seg.compute_shape.
+#
+# Compares the batched slice-wise shape analysis (single crop/scaling of all slices, optional
+# pool of processes) against the former loop, which warped and analysed the full slices one
+# after the other, and reports the largest relative difference between both. The moment-based
+# engine (no upsampling) is also timed and compared.
+#
+# Usage: python bench_compute_shape.py [nz] [n_jobs]
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+from __future__ import print_function, absolute_import
+
+import sys
+import math
+import time
+
+import numpy as np
+from skimage import transform
+
+from spinalcordtoolbox import process_seg
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.centerline.core import ParamCenterline, get_centerline
+from spinalcordtoolbox.resampling import resample_nib
+from spinalcordtoolbox.testing.create_test_data import dummy_segmentation
+
+
+def compute_shape_per_slice(im_seg, param_centerline):
+    """Reference implementation: former loop of compute_shape, with angle correction"""
+    im_seg = Image(im_seg).change_orientation('RPI')
+    nx, ny, nz, nt, px, py, pz, pt = im_seg.dim
+    pr = min([px, py])
+    im_segr = resample_nib(im_seg, new_size=[pr, pr, pz], new_size_type='mm', interpolation='linear')
+    nx, ny, nz, nt, px, py, pz, pt = im_segr.dim
+    X, Y, Z = (im_segr.data > 0).nonzero()
+    min_z_index, max_z_index = min(Z), max(Z)
+    properties = {}
+    _, arr_ctl, arr_ctl_der, fit_results = get_centerline(im_segr, param=param_centerline, verbose=0)
+    for iz in range(min_z_index, max_z_index + 1):
+        current_patch = im_segr.data[:, :, iz]
+        tangent_vect = np.array([arr_ctl_der[0][iz - min_z_index] * px, arr_ctl_der[1][iz - min_z_index] * py, pz])
+        tangent_vect = tangent_vect / np.linalg.norm(tangent_vect)
+        v0 = [tangent_vect[0], tangent_vect[2]]
+        angle_AP_rad = math.atan2(np.linalg.det([v0, [0, 1]]), np.dot(v0, [0, 1]))
+        v0 = [tangent_vect[1], tangent_vect[2]]
+        angle_RL_rad = math.atan2(np.linalg.det([v0, [0, 1]]), np.dot(v0, [0, 1]))
+        tform = transform.AffineTransform(scale=(np.cos(angle_RL_rad), np.cos(angle_AP_rad)))
+        current_patch_scaled = transform.warp(current_patch.astype(np.float64), tform.inverse,
+                                              output_shape=current_patch.shape, order=1)
+        shape_property = process_seg._properties2d(current_patch_scaled, [px, py])
+        for key in ['area', 'diameter_AP', 'diameter_RL', 'eccentricity', 'orientation', 'solidity']:
+            properties.setdefault(key, np.full(nz, np.nan))[iz] = shape_property[key]
+    return properties
+
+
+def main(nz=200, n_jobs=4):
+    # 0.5 mm in-plane resolution, 1 mm slices, oblique cord
+    im_seg = dummy_segmentation(size_arr=(192, 192, nz), pixdim=(0.5, 0.5, 1), shape='ellipse', radius_RL=18.0,
+                                radius_AP=8.0, angle_RL=-10.0, angle_AP=15.0)
+    param_centerline = ParamCenterline()
+
+    t0 = time.time()
+    ref = compute_shape_per_slice(im_seg, param_centerline)
+    t1 = time.time()
+    print("per-slice (former): {:.2f}s per subject".format(t1 - t0))
+    for jobs in sorted({1, n_jobs}):
+        t0 = time.time()
+        metrics, _ = process_seg.compute_shape(im_seg, param_centerline=param_centerline, verbose=0, n_jobs=jobs)
+        print("batched, n_jobs={}: {:.2f}s per subject".format(jobs, time.time() - t0))
+    for key in sorted(ref):
+        diff = np.nanmax(np.abs(metrics[key].data - ref[key]) / np.abs(ref[key]))
+        print("  {}: max relative difference {:.2e}".format(key, diff))
+
+    t0 = time.time()
+    metrics, _ = process_seg.compute_shape(im_seg, param_centerline=param_centerline, verbose=0, engine='moments')
+    print("moments, n_jobs=1: {:.2f}s per subject".format(time.time() - t0))
+    for key in sorted(ref):
+        diff = np.nanmax(np.abs(metrics[key].data - ref[key]) / np.abs(ref[key]))
+        print("  {}: max relative difference {:.2e}".format(key, diff))
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Benchmark of the segmentation of the spinal cord with 2D kernels (deepseg_sc.core.segment_2d).
+#
+# Segments a stack of nz random 64x64 slices with the 2D CNN of sct_deepseg_sc (weights of the t2
+# model if installed with sct_download_data, random weights otherwise: the duration does not depend
+# on them), slice by slice as the former implementation did, then as batches of increasing size.
+# Reports the throughput of each in slices/s.
+#
+# Usage: python bench_deepseg_sc_2d.py [nz]
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+from __future__ import print_function, absolute_import
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import numpy as np
+import nibabel
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.deepseg_sc import core as deepseg_sc
+from spinalcordtoolbox.deepseg_sc.cnn_models import nn_architecture_seg
+
+
+def segment_2d_per_slice(seg_model, im_in):
+    """Reference implementation: former prediction, one slice at a time"""
+    seg_crop = np.zeros(im_in.data.shape, dtype=np.float32)
+    for zz in range(im_in.dim[2]):
+        seg_crop[:, :, zz] = seg_model.predict(np.expand_dims(np.expand_dims(im_in.data[:, :, zz], -1), 0),
+                                               batch_size=deepseg_sc.BATCH_SIZE)[0, :, :, 0]
+    return seg_crop
+
+
+def main(nz=300):
+    path_tmp = tempfile.mkdtemp()
+    seg_model = nn_architecture_seg(height=64, width=64, depth=3, features=32, batchnorm=False, dropout=0.0)
+    model_fname = os.path.join(__sct_dir__, 'data', 'deepseg_sc_models', 't2_sc.h5')
+    if os.path.isfile(model_fname):
+        seg_model.load_weights(model_fname)
+        print("model: {}".format(model_fname))
+    else:
+        model_fname = os.path.join(path_tmp, 't2_sc.h5')
+        seg_model.save_weights(model_fname)
+        print("model: random weights")
+
+    data = np.random.RandomState(0).normal(0, 1, (64, 64, nz)).astype(np.float32)
+    nii = nibabel.Nifti1Image(data, np.eye(4))
+    im_in = Image(data, hdr=nii.header, dim=nii.header.get_data_shape())
+
+    # the model is kept by the registry of deepseg_models after the first call
+    deepseg_sc.segment_2d(model_fname, 't2', (64, 64), im_in)
+    t0 = time.time()
+    seg_ref = segment_2d_per_slice(seg_model, im_in)
+    print("per slice (former): {:.1f} slices/s".format(nz / (time.time() - t0)))
+    for batch_size in [1, 8, 32, 128]:
+        t0 = time.time()
+        seg = deepseg_sc.segment_2d(model_fname, 't2', (64, 64), im_in, batch_size=batch_size)
+        duration = time.time() - t0
+        print("batch_size={}: {:.1f} slices/s, max difference {:.2e}".format(
+            batch_size, nz / duration, np.abs(seg - seg_ref).max()))
+
+    shutil.rmtree(path_tmp)
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Benchmark of spinalcordtoolbox.aggregate_slicewise.extract_metric_all_labels.
+#
+# Extracts a metric within all the labels of a synthetic atlas (partial volume labels, as in
+# the white matter atlas), slice by slice, either with one call of extract_metric per label
+# (former behaviour of sct_extract_metric) or in a single pass over the data, and reports the
+# largest relative difference between both.
+#
+# Usage: python bench_extract_metric.py [n_labels] [nz]
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+from __future__ import print_function, absolute_import
+
+import sys
+import time
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+from spinalcordtoolbox.aggregate_slicewise import Metric, LabelStruc, extract_metric, extract_metric_all_labels
+
+
+def create_atlas(n_labels, shape, rs):
+    """Smooth partial volume labels, each voxel being shared between neighbouring labels"""
+    seeds = rs.randint(0, n_labels, size=shape[:2])
+    labels = np.stack([gaussian_filter((seeds == i).astype(np.float64), 2) for i in range(n_labels)], axis=-1)
+    labels /= labels.sum(axis=-1, keepdims=True)
+    return np.tile(labels[:, :, np.newaxis], (1, 1, shape[2], 1))
+
+
+def main(n_labels=36, nz=60):
+    rs = np.random.RandomState(0)
+    shape = (80, 80, nz)
+    labels = create_atlas(n_labels, shape, rs)
+    data = rs.normal(0.6, 0.1, size=shape) + np.dot(labels, rs.uniform(0, 0.4, n_labels))
+    label_struc = dict((i, LabelStruc(id=i, name='label_{}'.format(i), map_cluster=i % 3)) for i in range(n_labels))
+    label_struc[50] = LabelStruc(id=list(range(0, n_labels, 2)), name='even labels', map_cluster=None)
+    ids_label = list(label_struc)
+    indiv_labels_ids = list(range(n_labels))
+
+    for method in ['wa', 'bin', 'ml', 'map', 'max']:
+        kwargs = dict(perslice=True, method=method, label_struc=label_struc, indiv_labels_ids=indiv_labels_ids)
+        t0 = time.time()
+        ref = dict((id_label, extract_metric(Metric(data=data.copy()), labels=labels, id_label=id_label, **kwargs))
+                   for id_label in ids_label)
+        t1 = time.time()
+        agg_metrics = extract_metric_all_labels(Metric(data=data.copy()), labels=labels, ids_label=ids_label,
+                                                **kwargs)
+        t2 = time.time()
+        diff = max(abs(agg_metrics[id_label][slicegroup][key] - value) / abs(value)
+                   for id_label in ids_label for slicegroup in ref[id_label]
+                   for key, value in ref[id_label][slicegroup].items() if isinstance(value, float))
+        print("{}: per label {:.2f}s, all labels {:.2f}s ({} labels, {} slices), max relative difference {:.2e}"
+              .format(method, t1 - t0, t2 - t1, len(ids_label), nz, diff))
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
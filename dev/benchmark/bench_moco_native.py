@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Benchmark of the native estimator of slice-wise translations of msct_moco (-param estimator=native).
+#
+# Builds a time series from the mean fMRI volume of sct_testing_data (or from a synthetic volume
+# if the testing data are not installed), each volume being translated slice-wise (polynomial
+# along z) and corrupted with noise, then runs the estimation of msct_moco.moco with the native
+# estimator and, if isct_antsSliceRegularizedRegistration is in the PATH, with ANTs. Reports the
+# duration of each and the largest error of the estimated translations.
+#
+# Usage: python bench_moco_native.py [nt]
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+from __future__ import print_function, absolute_import
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import numpy as np
+import nibabel
+from scipy.ndimage import gaussian_filter
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+
+import msct_moco
+import sct_fmri_moco
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.moco import MotionParams, translate_slices
+
+
+def which(program):
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        if os.path.isfile(os.path.join(path, program)):
+            return os.path.join(path, program)
+
+
+def main(nt=50):
+    fname_fmri = os.path.join(__sct_dir__, 'sct_testing_data', 'fmri', 'fmri.nii.gz')
+    if os.path.isfile(fname_fmri):
+        im = Image(fname_fmri)
+        data = np.asarray(im.data, dtype=np.float64).mean(axis=3)
+        affine = im.hdr.get_best_affine()
+        print("data: {} (mean volume)".format(fname_fmri))
+    else:
+        rs = np.random.RandomState(1)
+        x, y = np.mgrid[0:64, 0:64]
+        data = gaussian_filter(rs.rand(64, 64, 20), (2, 2, 0)) * 500 + \
+            1000 * np.exp(-((x - 30.) ** 2 + (y - 34.) ** 2) / 80.)[..., np.newaxis]
+        affine = np.diag([1, 1, 3, 1.])
+        print("data: synthetic")
+
+    rs = np.random.RandomState(0)
+    z = np.linspace(-1, 1, data.shape[2])
+    translations = []
+    data_moving = np.zeros(data.shape + (nt,), dtype=np.float32)
+    for it in range(nt):
+        coeffs = rs.uniform(-1.5, 1.5, (2, 3)) * [[1], [1]] * [1, 0.5, 0.25]
+        translations.append(np.stack([np.polyval(coeffs[0], z), np.polyval(coeffs[1], z)], axis=1))
+        data_moving[..., it] = translate_slices(data, -translations[it], interp='spline') + \
+            rs.normal(0, 0.02 * data.std(), data.shape)
+
+    path_tmp = tempfile.mkdtemp()
+    curdir = os.getcwd()
+    os.chdir(path_tmp)
+    nii = nibabel.Nifti1Image(data_moving, affine)
+    Image(data_moving, hdr=nii.header, dim=nii.header.get_data_shape()).save('fmri.nii')
+    Image(data.astype(np.float32), hdr=nii.header.copy()).save('target.nii')
+
+    list_estimator = ['native']
+    if which('isct_antsSliceRegularizedRegistration'):
+        list_estimator.append('ants')
+    for estimator in list_estimator:
+        param = sct_fmri_moco.Param()
+        param.file_data = 'fmri.nii'
+        param.file_target = 'target.nii'
+        param.mat_moco = 'mat_' + estimator
+        param.todo = 'estimate'
+        param.estimator = estimator
+        param.iterAvg = 0
+        param.verbose = 0
+        t0 = time.time()
+        msct_moco.moco(param)
+        t1 = time.time()
+        translations_est = MotionParams.load(os.path.join(param.mat_moco, msct_moco.FILE_PARAMS)).to_translations()
+        error = np.abs(translations_est - np.array(translations)).max()
+        print("{}: {:.2f}s for {} volumes of {}, max error {:.3f} voxel".format(
+            estimator, t1 - t0, nt, 'x'.join(str(n) for n in data.shape), error))
+
+    os.chdir(curdir)
+    shutil.rmtree(path_tmp)
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Benchmark of the rendering of QC entries (spinalcordtoolbox.reports.qc.add_entry).
+#
+# Renders the axial mosaic of a synthetic image and cord segmentation (as sct_deepseg_sc -qc), the
+# axial mosaic of a template (as sct_warp_template -qc) and the sagittal view with a vertical line
+# (as sct_straighten_spinalcord -qc) with the matplotlib backend and with the NumPy raster backend,
+# and reports the mean duration of an entry with each (the resampling of the slices excluded).
+#
+# Usage: python bench_qc_raster.py [nz] [n_entries]
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+from __future__ import print_function, absolute_import
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import logging
+
+import numpy as np
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+
+from spinalcordtoolbox.reports import qc
+import spinalcordtoolbox.reports.slice as qcslice
+from spinalcordtoolbox.testing.create_test_data import dummy_segmentation
+
+
+def main(nz=50, n_entries=5):
+    logging.getLogger().setLevel(logging.WARNING)
+    path_tmp = tempfile.mkdtemp()
+    curdir = os.getcwd()
+    os.chdir(path_tmp)
+    im_seg = dummy_segmentation(size_arr=(64, 64, nz), shape='ellipse', radius_RL=6.0, radius_AP=4.0)
+    im = im_seg.copy()
+    im.data = im_seg.data * 100 + np.random.RandomState(0).rand(*im_seg.data.shape) * 50
+
+    views = [
+        ('listed_seg', 'Axial', lambda: qcslice.Axial([im, im_seg]), [qc.QcImage.listed_seg],
+         lambda x: x.mosaic()),
+        ('template', 'Axial', lambda: qcslice.Axial([im, im_seg]), [qc.QcImage.template],
+         lambda x: x.mosaic()),
+        ('vertical_line', 'Sagittal', lambda: qcslice.Sagittal([im, im_seg], p_resample=None),
+         [qc.QcImage.vertical_line], lambda x: x.single()),
+    ]
+    for name, plane, get_slice, operations, layout in views:
+        durations = {}
+        for backend in ['matplotlib', 'raster']:
+            # the resampling of the slices is common to both backends
+            slices = [get_slice() for i in range(n_entries)]
+            t0 = time.time()
+            for i, qcslice_ in enumerate(slices):
+                qc.add_entry(src='im.nii.gz', process='bench', args=[], path_qc='qc', plane=plane,
+                             qcslice=qcslice_, qcslice_operations=operations, qcslice_layout=layout,
+                             subject='sub-{}'.format(i), update_html=False, backend=backend)
+            durations[backend] = (time.time() - t0) / n_entries
+        print("{} ({}, {} slices): matplotlib {:.3f}s, raster {:.3f}s per entry".format(
+            name, plane, nz, durations['matplotlib'], durations['raster']))
+
+    os.chdir(curdir)
+    shutil.rmtree(path_tmp)
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
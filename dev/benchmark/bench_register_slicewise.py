@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Benchmark of the slice-wise registration steps of sct_register_to_template
+# (msct_register.register_slicewise).
+#
+# Runs the steps algo=centermassrot and algo=columnwise (and algo=syn, slicewise=1, if
+# isct_antsRegistration is in the PATH) between two synthetic cord segmentations. The former
+# implementation split the source and destination volumes into one NIfTI file per slice in
+# the working folder before each step: this cost is measured separately, so that the former
+# duration of a step is the current duration plus the splitting. The ANTs step is run with
+# n_jobs slices registered in parallel.
+#
+# Usage: python bench_register_slicewise.py [nz] [n_jobs]
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+from __future__ import print_function, absolute_import
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+
+from sct_image import split_data
+from msct_register import Paramreg, register_slicewise
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.testing.create_test_data import dummy_segmentation
+
+
+def which(program):
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        if os.path.isfile(os.path.join(path, program)):
+            return os.path.join(path, program)
+
+
+def split_and_save(fname):
+    """Reference implementation: former splitting of a volume along z, one file per slice"""
+    for im in split_data(Image(fname), 2):
+        im.save(verbose=0)
+
+
+def main(nz=400, n_jobs=1):
+    path_tmp = tempfile.mkdtemp()
+    curdir = os.getcwd()
+    os.chdir(path_tmp)
+    # template-like segmentation and rotated subject segmentation
+    dummy_segmentation(size_arr=(141, 141, nz), pixdim=(1, 1, 1), shape='ellipse', radius_RL=10.0,
+                       radius_AP=6.0).save('dest_seg.nii.gz')
+    dummy_segmentation(size_arr=(141, 141, nz), pixdim=(1, 1, 1), shape='ellipse', radius_RL=9.0,
+                       radius_AP=5.0, angle_IS=15).save('src_seg.nii.gz')
+
+    t_split = 0
+    for fname in ['src_seg.nii.gz', 'dest_seg.nii.gz']:
+        path_split = tempfile.mkdtemp(dir=path_tmp)
+        Image(fname).save(os.path.join(path_split, 'seg.nii'), verbose=0)
+        os.chdir(path_split)
+        t0 = time.time()
+        split_and_save('seg.nii')
+        t_split += time.time() - t0
+        os.chdir(path_tmp)
+    print("former splitting of src and dest ({} slices each): {:.2f}s per step".format(nz, t_split))
+
+    list_algo = ['centermassrot', 'columnwise']
+    if which('isct_antsRegistration'):
+        list_algo.append('syn')
+    for algo in list_algo:
+        paramreg = Paramreg(step='1', type='seg', algo=algo, metric='MeanSquares', iter='3', smooth='1',
+                            slicewise='1')
+        t0 = time.time()
+        register_slicewise('src_seg.nii.gz', 'dest_seg.nii.gz', paramreg=paramreg,
+                           warp_forward_out='warp_{}.nii.gz'.format(algo),
+                           warp_inverse_out='warp_inv_{}.nii.gz'.format(algo), remove_temp_files=1, verbose=0,
+                           n_jobs=n_jobs)
+        t_step = time.time() - t0
+        print("{}: in memory {:.2f}s, former (estimated) {:.2f}s".format(algo, t_step, t_step + t_split))
+
+    os.chdir(curdir)
+    shutil.rmtree(path_tmp)
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
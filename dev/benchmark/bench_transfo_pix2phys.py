@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Benchmark of Image.transfo_pix2phys / Image.transfo_phys2pix.
+#
+# Compares the batched transforms against the former per-point matrix product and checks
+# that both give bit-identical results.
+#
+# Usage: python bench_transfo_pix2phys.py [n_points]
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+from __future__ import print_function, absolute_import
+
+import sys
+import time
+
+import numpy as np
+import nibabel
+
+from spinalcordtoolbox.image import Image
+
+
+def transfo_per_point(affine, coordi):
+    """Reference implementation: one np.matmul per point"""
+    aug = np.hstack((np.asarray(coordi), np.ones((len(coordi), 1))))
+    ret = np.empty_like(coordi, dtype=np.float64)
+    for idx_coord, coord in enumerate(aug):
+        ret[idx_coord] = np.matmul(affine, coord)[:3]
+    return ret
+
+
+def main(n_points=10 ** 7):
+    affine = np.array([[-0.5, 0.01, 0.02, 40.],
+                       [0.01, 0.5, -0.03, -60.],
+                       [0.02, 0.03, 0.5, -800.],
+                       [0, 0, 0, 1]])
+    im = Image(np.zeros((10, 10, 10)), hdr=nibabel.Nifti1Image(np.zeros((10, 10, 10)), affine).header)
+    coordi = np.random.RandomState(0).uniform(0, 500, size=(n_points, 3))
+
+    for dtype in (np.float64, np.float32):
+        t0 = time.time()
+        phys = im.transfo_pix2phys(coordi, dtype=dtype)
+        t1 = time.time()
+        im.transfo_phys2pix(phys, real=False, dtype=dtype)
+        t2 = time.time()
+        print("batched {}: pix2phys {:.3f}s, phys2pix {:.3f}s for {} points".format(
+            np.dtype(dtype).name, t1 - t0, t2 - t1, n_points))
+
+    # The reference is slow: time it on a subset and extrapolate
+    n_ref = min(n_points, 10 ** 5)
+    t0 = time.time()
+    ref = transfo_per_point(im.hdr.get_best_affine(), coordi[:n_ref])
+    t1 = time.time()
+    print("per-point: pix2phys {:.3f}s for {} points (~{:.1f}s extrapolated to {} points)".format(
+        t1 - t0, n_ref, (t1 - t0) * n_points / n_ref, n_points))
+    print("bit-identical: {}".format(bool((ref == im.transfo_pix2phys(coordi[:n_ref])).all())))
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
@@ -12,7 +12,6 @@
 # About the license: see the file LICENSE.TXT
 #########################################################################################
 
-# TODO: check the status of spline()
 # TODO: check the status of combine_matrix()
 # TODO: add tests with sag and ax orientation, with -g 1 and 3, with mask (not covering all slices)
 # TODO: make it a spinalcordtoolbox module with im as input
@@ -21,17 +20,30 @@
 
 from __future__ import absolute_import
 
-import sys, os, glob
+import sys, os
+import multiprocessing
 from tqdm import tqdm
 import numpy as np
 import scipy.interpolate
+import scipy.io
 
 import sct_utils as sct
 from sct_convert import convert
 from spinalcordtoolbox.image import Image
+from spinalcordtoolbox import moco as sct_moco
+from spinalcordtoolbox.warping import DisplacementField, resample_points, _is_inside
 from sct_image import split_data, concat_data
 import sct_apply_transfo
 
+# number of volumes averaged with the target image when param.iterAvg=1
+NB_AVG = 10
+
+# file of motion parameters (see spinalcordtoolbox.moco.MotionParams), in the output folder of mat files
+FILE_PARAMS = 'moco_params.npz'
+
+# parameters shared by the registrations of a pool of processes (see _init_register_worker)
+_worker_args = None
+
 #=======================================================================================================================
 # moco Function
 #=======================================================================================================================
@@ -69,6 +81,27 @@ def moco(param):
     nx, ny, nz, nt, px, py, pz, pt = im_data.dim
     sct.printv(('  ' + str(nx) + ' x ' + str(ny) + ' x ' + str(nz) + ' x ' + str(nt)), verbose)
 
+    # number of volumes registered in parallel
+    n_jobs = param.n_jobs if param.n_jobs > 0 else multiprocessing.cpu_count()
+    n_jobs = min(n_jobs, nt)
+
+    # the native estimator of slice-wise translations registers the volumes in memory
+    native = param.estimator == 'native' and not todo == 'apply'
+    if native and param.is_sagittal:
+        sct.printv('WARNING: estimator=native only supports axial data. Using ANTs instead.', verbose, 'warning')
+        native = False
+    # the slice-wise translations of axial data are stored in a single file of motion parameters. The warping field of
+    # a volume is only built when the volume is moved.
+    fname_params = os.path.join(folder_mat, FILE_PARAMS)
+    motion_params = None
+    # the 2D affine transformations of sagittal slices are kept in their files: only their translations are stored in
+    # the file of motion parameters, as output of the motion parameters (it is not used to apply them)
+    displacement_sagittal = np.zeros((nt, nz, 3)) if param.is_sagittal and todo != 'apply' else None
+    if todo == 'apply' and not param.is_sagittal and os.path.isfile(fname_params):
+        motion_params = sct_moco.MotionParams.load(fname_params)
+    # with the native engine, the transformations are applied in memory, without splitting the data along T
+    native_apply = param.engine == 'native' and motion_params is not None
+
     # copy file_target to a temporary file
     sct.printv('\nCopy file_target to a temporary file...', verbose)
     file_target = "target.nii.gz"
@@ -121,6 +154,20 @@ def moco(param):
         # Split data along T dimension
         # sct.printv('\nSplit data along T dimension.', verbose)
         im_z = Image(file)
+        file_data_splitZ_moco.append(sct.add_suffix(file, suffix))
+        for it in range(nt):
+            file_mat[iz][it] = os.path.join(folder_mat, "mat.Z") + str(iz).zfill(4) + 'T' + str(it).zfill(4)
+        if native:
+            motion_params = moco_native(param, im_z, Image(file_target_splitZ[iz]),
+                                        im_maskz_list[iz] if not param.fname_mask == '' else None,
+                                        file_data_splitZ_moco[iz] if todo != 'estimate' else None)
+            motion_params.save(fname_params)
+            continue
+        if native_apply:
+            apply_native(im_z, Image(file_target_splitZ[iz]), motion_params, file_data_splitZ_moco[iz],
+                         interp=param.interp)
+            continue
+
         list_im_zt = split_data(im_z, dim=3)
         file_data_splitZ_splitT = []
         for im_zt in list_im_zt:
@@ -130,64 +177,100 @@ def moco(param):
 
         # Motion correction: initialization
         index = np.arange(nt)
-        file_data_splitT_num = []
-        file_data_splitZ_splitT_moco = []
+        file_data_splitZ_splitT_moco = [sct.add_suffix(fname, '_moco') for fname in file_data_splitZ_splitT]
         failed_transfo = [0 for i in range(nt)]
+        # deal with masking
+        if not param.fname_mask == '':
+            input_mask = im_maskz_list[iz]
+        else:
+            input_mask = None
+        # registration of each volume: (index, source, target, output transformation, output volume)
+        tasks = [(it, file_data_splitZ_splitT[it], file_target_splitZ[iz], file_mat[iz][it],
+                  file_data_splitZ_splitT_moco[it]) for it in index]
+        # with a pool of processes, the volumes that are averaged with the target image (warm-up) are registered one
+        # after the other, and the remaining ones are scheduled across the processes once the target is final. When
+        # applying motion parameters, all the volumes go through _register_volume, which writes their warping field.
+        if n_jobs > 1 or todo == 'apply':
+            nb_warmup = NB_AVG if param.iterAvg and not todo == 'apply' else 0
+        else:
+            nb_warmup = nt
 
         # Motion correction: Loop across T
-        for indice_index in tqdm(range(nt), unit='iter', unit_scale=False,
-                                 desc="Z=" + str(iz) + "/" + str(len(file_data_splitZ)-1), ascii=True, ncols=80):
+        pbar = tqdm(total=nt, unit='iter', unit_scale=False, desc="Z=" + str(iz) + "/" + str(len(file_data_splitZ)-1),
+                    ascii=True, ncols=80)
+        for indice_index in range(min(nb_warmup, nt)):
 
-            # create indices and display stuff
-            it = index[indice_index]
-            file_mat[iz][it] = os.path.join(folder_mat, "mat.Z") + str(iz).zfill(4) + 'T' + str(it).zfill(4)
-            file_data_splitZ_splitT_moco.append(sct.add_suffix(file_data_splitZ_splitT[it], '_moco'))
-            # deal with masking
-            if not param.fname_mask == '':
-                input_mask = im_maskz_list[iz]
-            else:
-                input_mask = None
             # run 3D registration
-            failed_transfo[it] = register(param, file_data_splitZ_splitT[it], file_target_splitZ[iz], file_mat[iz][it],
-                                          file_data_splitZ_splitT_moco[it], im_mask=input_mask)
+            it = index[indice_index]
+            failed_transfo[it] = register(param, *tasks[it][1:], im_mask=input_mask)
 
             # average registered volume with target image
             # N.B. use weighted averaging: (target * nb_it + moco) / (nb_it + 1)
-            if param.iterAvg and indice_index < 10 and failed_transfo[it] == 0 and not param.todo == 'apply':
+            if param.iterAvg and indice_index < NB_AVG and failed_transfo[it] == 0 and not param.todo == 'apply':
                 im_targetz = Image(file_target_splitZ[iz])
                 data_targetz = im_targetz.data
                 data_mocoz = Image(file_data_splitZ_splitT_moco[it]).data
                 data_targetz = (data_targetz * (indice_index + 1) + data_mocoz) / (indice_index + 2)
                 im_targetz.data = data_targetz
                 im_targetz.save(verbose=0)
+            pbar.update(1)
+        for it, failed in _map_register_volumes(param, input_mask, tasks[nb_warmup:], n_jobs, motion_params):
+            failed_transfo[it] = failed
+            pbar.update(1)
+        pbar.close()
 
-        # Replace failed transformation with the closest good one
         fT = [i for i, j in enumerate(failed_transfo) if j == 1]
         gT = [i for i, j in enumerate(failed_transfo) if j == 0]
+        # Move the translations estimated by ANTs to the file of motion parameters
+        if todo != 'apply' and not param.is_sagittal:
+            im_target = Image(file_target)
+            displacement = np.zeros((nt, im_target.data.shape[2], 3))
+            for it in gT:
+                displacement[it] = Image(file_mat[iz][it] + 'Warp.nii.gz').data[0, 0, :, 0, :]
+                os.remove(file_mat[iz][it] + 'Warp.nii.gz')
+            motion_params = sct_moco.MotionParams(displacement, im_target.hdr)
+        if displacement_sagittal is not None:
+            for it in gT:
+                displacement_sagittal[it, iz, :2] = read_affine_translation(file_mat[iz][it] + '0GenericAffine.mat')
+
+        # Replace failed transformation with the closest good one
         for it in range(len(fT)):
             abs_dist = [np.abs(gT[i] - fT[it]) for i in range(len(gT))]
             if not abs_dist == []:
                 index_good = abs_dist.index(min(abs_dist))
                 sct.printv('  transfo #' + str(fT[it]) + ' --> use transfo #' + str(gT[index_good]), verbose)
                 # copy transformation
-                sct.copy(file_mat[iz][gT[index_good]] + 'Warp.nii.gz', file_mat[iz][fT[it]] + 'Warp.nii.gz')
+                if displacement_sagittal is not None:
+                    displacement_sagittal[fT[it], iz] = displacement_sagittal[gT[index_good], iz]
+                if motion_params is not None:
+                    motion_params.displacement[fT[it]] = motion_params.displacement[gT[index_good]]
+                    motion_params.to_warp(fT[it]).save(file_mat[iz][fT[it]] + 'Warp.nii.gz', verbose=0)
+                else:
+                    sct.copy(file_mat[iz][gT[index_good]] + 'Warp.nii.gz', file_mat[iz][fT[it]] + 'Warp.nii.gz')
                 # apply transformation
                 sct_apply_transfo.main(args=['-i', file_data_splitZ_splitT[fT[it]],
                                              '-d', file_target,
                                              '-w', file_mat[iz][fT[it]] + 'Warp.nii.gz',
                                              '-o', file_data_splitZ_splitT_moco[fT[it]],
-                                             '-x', param.interp])
+                                             '-x', param.interp,
+                                             '-engine', param.engine])
+                if motion_params is not None:
+                    os.remove(file_mat[iz][fT[it]] + 'Warp.nii.gz')
             else:
                 # exit program if no transformation exists.
                 sct.printv('\nERROR in ' + os.path.basename(__file__) + ': No good transformation exist. Exit program.\n', verbose, 'error')
                 sys.exit(2)
+        if motion_params is not None and todo != 'apply':
+            motion_params.save(fname_params)
 
         # Merge data along T
-        file_data_splitZ_moco.append(sct.add_suffix(file, suffix))
         if todo != 'estimate':
             im_out = concat_data(file_data_splitZ_splitT_moco, 3)
             im_out.save(file_data_splitZ_moco[iz])
 
+    if displacement_sagittal is not None:
+        sct_moco.MotionParams(displacement_sagittal, Image(file_target).hdr).save(fname_params)
+
     # If sagittal, merge along Z
     if param.is_sagittal:
         im_out = concat_data(file_data_splitZ_moco, 2)
@@ -198,6 +281,154 @@ def moco(param):
     return file_mat
 
 
+def moco_native(param, im_data, im_target, im_mask, fname_out=None):
+    """
+    Motion correction of axial data with the native estimator of slice-wise translations (see spinalcordtoolbox.moco),
+    in memory. Same steps as moco(): registration of each volume to the target (iteratively averaged with the first
+    registered volumes), then replacement of the failed transformations with the closest good one.
+
+    :param param:
+    :param im_data: Image: 3D or 4D data
+    :param im_target: Image: 3D target
+    :param im_mask: Image of mask, or None
+    :param fname_out: str: output motion-corrected data, or None
+    :return: MotionParams: slice-wise translations of the volumes
+    """
+    shape = im_target.data.shape[:3]
+    nt = int(np.prod(im_data.data.shape[3:]))
+    data = np.asarray(im_data.data).reshape(shape + (nt,))
+    data_target = np.asarray(im_target.data, dtype=np.float64).reshape(shape)
+    data_mask = np.asarray(im_mask.data).reshape(shape) if im_mask is not None else None
+    # same units as the smoothing sigmas of ANTs (voxels)
+    smooth = float(param.smooth)
+    iterations = int(param.iter.split('x')[0])
+
+    translations = np.zeros((nt, shape[2], 2))
+    failed_transfo = np.zeros(nt, dtype=bool)
+    data_moco = np.zeros(data.shape, dtype=np.float32)
+    for it in tqdm(range(nt), unit='iter', unit_scale=False, desc="Z=0/0", ascii=True, ncols=80):
+        translations[it], is_valid = sct_moco.estimate_translations(
+            data[..., it], data_target, mask=data_mask, metric=param.metric, poly=int(param.poly), smooth=smooth,
+            iterations=iterations)
+        failed_transfo[it] = not np.any(is_valid)
+        if failed_transfo[it]:
+            sct.printv('WARNING in ' + os.path.basename(__file__) + ': No slice could be registered for volume #' +
+                       str(it) + '. Using previous transformation for this volume (if it exists).', param.verbose,
+                       'warning')
+            continue
+        data_moco[..., it] = sct_moco.translate_slices(data[..., it], translations[it], interp=param.interp)
+        # average registered volume with target image
+        if param.iterAvg and it < NB_AVG:
+            data_target = (data_target * (it + 1) + data_moco[..., it]) / (it + 2)
+
+    # Replace failed transformation with the closest good one
+    gT = np.where(~failed_transfo)[0]
+    for it in np.where(failed_transfo)[0]:
+        if not len(gT):
+            sct.printv('\nERROR in ' + os.path.basename(__file__) + ': No good transformation exist. Exit program.\n',
+                       param.verbose, 'error')
+            sys.exit(2)
+        it_good = gT[np.abs(gT - it).argmin()]
+        sct.printv('  transfo #' + str(it) + ' --> use transfo #' + str(it_good), param.verbose)
+        translations[it] = translations[it_good]
+        data_moco[..., it] = sct_moco.translate_slices(data[..., it], translations[it], interp=param.interp)
+
+    if fname_out is not None:
+        im_out = Image(data_moco.reshape(im_data.data.shape), hdr=im_data.hdr.copy())
+        im_out.hdr.set_data_dtype(np.float32)
+        im_out.save(fname_out, verbose=0)
+    return sct_moco.MotionParams.from_translations(translations, im_target)
+
+
+def apply_native(im_data, im_target, motion_params, fname_out, interp='spline'):
+    """
+    Apply the motion parameters of each volume in memory, with the native engine (same resampling as
+    sct_apply_transfo -engine native), without splitting the data along T nor writing warping fields.
+
+    :param im_data: Image: 3D or 4D data
+    :param im_target: Image: 3D target, whose grid is used for the output
+    :param motion_params: MotionParams
+    :param fname_out: str: output motion-corrected data
+    :param interp: {'nn', 'linear', 'spline'}
+    :return:
+    """
+    shape = im_target.data.shape[:3]
+    nt = motion_params.displacement.shape[0]
+    data = np.asarray(im_data.data).reshape(im_data.data.shape[:3] + (nt,))
+    x, y, z = np.mgrid[0:shape[0], 0:shape[1], 0:shape[2]]
+    points = im_target.transfo_pix2phys(np.stack((x.ravel(), y.ravel(), z.ravel()), axis=1))
+    data_out = np.zeros(shape + (nt,), dtype=np.float32)
+    for it in tqdm(range(nt), unit='iter', unit_scale=False, desc="Apply", ascii=True, ncols=80):
+        field = DisplacementField(motion_params.to_warp(it))
+        coords = im_data.transfo_phys2pix(field.transform_points(points), real=False)
+        data_out[..., it] = resample_points(data[..., it], coords, interp=interp,
+                                            inside=_is_inside(coords, data.shape[:3])).reshape(shape)
+    im_out = Image(data_out.reshape(shape + im_data.data.shape[3:]), hdr=im_target.hdr.copy())
+    im_out.hdr.set_data_dtype(np.float32)
+    im_out.save(fname_out, verbose=0)
+
+
+def _init_register_worker(param, im_mask, motion_params=None):
+    """Set the parameters, the mask and the motion parameters used by _register_volume"""
+    global _worker_args
+    _worker_args = (param, im_mask, motion_params)
+
+
+def _register_volume(task):
+    """
+    Register one volume to the target (see register). With motion parameters, the warping field of the volume is
+    written for the time of the registration.
+
+    :param task: tuple (index, source, target, output transformation, output volume)
+    :return: (index, status of failure)
+    """
+    it, file_src, file_dest, file_mat, file_out = task
+    param, im_mask, motion_params = _worker_args
+    if motion_params is None:
+        return it, register(param, file_src, file_dest, file_mat, file_out, im_mask=im_mask)
+    motion_params.to_warp(it).save(file_mat + 'Warp.nii.gz', verbose=0)
+    try:
+        return it, register(param, file_src, file_dest, file_mat, file_out, im_mask=im_mask)
+    finally:
+        os.remove(file_mat + 'Warp.nii.gz')
+
+
+def _map_register_volumes(param, im_mask, tasks, n_jobs=1, motion_params=None):
+    """
+    Register volumes to the target, serially or with a pool of processes. Each process runs ANTs with one thread.
+
+    :param param:
+    :param im_mask: Image of mask, or None
+    :param tasks: list of tasks (see _register_volume)
+    :param n_jobs: int: number of processes
+    :param motion_params: MotionParams to apply, or None
+    :return: generator of (index, status of failure), in order of completion
+    """
+    if not tasks:
+        return
+    n_jobs = min(n_jobs, len(tasks))
+    if n_jobs <= 1:
+        _init_register_worker(param, im_mask, motion_params)
+        try:
+            for task in tasks:
+                yield _register_volume(task)
+        finally:
+            _init_register_worker(None, None)
+        return
+
+    pool = multiprocessing.Pool(n_jobs, initializer=_init_register_worker,
+                                initargs=(param, im_mask, motion_params))
+    try:
+        for result in pool.imap_unordered(_register_volume, tasks):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
 def register(param, file_src, file_dest, file_mat, file_out, im_mask=None):
     """
     Register two images by estimating slice-wise Tx and Ty transformations, which are regularized along Z. This function
@@ -271,8 +502,10 @@ def register(param, file_src, file_dest, file_mat, file_out, im_mask=None):
             env = dict()
             env.update(os.environ)
             env = kw.get("env", env)
-            # reducing the number of CPU used for moco (see issue #201)
+            # reducing the number of CPU used for moco (see issue #201). With a pool of processes, each volume is
+            # registered by one process.
             env["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] = "1"
+            kw.update(dict(env=env))
             status, output = sct.run(cmd, verbose=0, **kw)
 
     elif param.todo == 'apply':
@@ -281,6 +514,7 @@ def register(param, file_src, file_dest, file_mat, file_out, im_mask=None):
                                      '-w', file_mat + 'Warp.nii.gz',
                                      '-o', file_out_concat,
                                      '-x', param.interp,
+                                     '-engine', param.engine,
                                      '-v', '0'])
 
     # check if output file exists
@@ -305,90 +539,65 @@ def register(param, file_src, file_dest, file_mat, file_out, im_mask=None):
     return failed_transfo
 
 
-def spline(folder_mat, nt, nz, verbose, index_b0 = [], graph=0):
+def read_affine_translation(fname):
+    """
+    Translation of a 2D affine transformation of ANTs (as registered for sagittal data)
+    :param fname: .mat file of the transformation (ITK format)
+    :return: array of (tx, ty), in ITK physical space
+    """
+    transfo = scipy.io.loadmat(fname)
+    params = [value for key, value in transfo.items() if key.startswith('AffineTransform_')][0]
+    return params.ravel()[4:6]
+
+
+def spline(folder_mat, verbose, index_b0=[], graph=0):
+    """
+    Regularize the motion parameters of folder_mat along T: the translation of each slice, along X and along Y, is
+    replaced by a smoothing spline of the translations of all the volumes. The former parameters are kept in the
+    sub-folder "old".
+    """
 
     sct.printv('\n\n\n------------------------------------------------------------------------------', verbose)
     sct.printv('Spline Regularization along T: Smoothing Patient Motion...', verbose)
 
-    file_mat = [[[] for i in range(nz)] for i in range(nt)]
-    for it in range(nt):
-        for iz in range(nz):
-            file_mat[it][iz] = os.path.join(folder_mat, "mat.T") + str(it) + '_Z' + str(iz) + '.txt'
-
-    # Copying the existing Matrices to another folder
+    sct.printv('\nloading motion parameters...', verbose)
+    motion_params = sct_moco.MotionParams.load(os.path.join(folder_mat, FILE_PARAMS))
+    # Copying the existing parameters to another folder
     old_mat = os.path.join(folder_mat, "old")
     if not os.path.exists(old_mat):
         os.makedirs(old_mat)
-    # TODO
-    for mat in glob.glob(os.path.join(folder_mat, '*.txt')):
-        sct.copy(mat, old_mat)
-
-    sct.printv('\nloading matrices...', verbose)
-    X = [[[] for i in range(nt)] for i in range(nz)]
-    Y = [[[] for i in range(nt)] for i in range(nz)]
-    X_smooth = [[[] for i in range(nt)] for i in range(nz)]
-    Y_smooth = [[[] for i in range(nt)] for i in range(nz)]
-    for iz in range(nz):
-        for it in range(nt):
-            file =  open(file_mat[it][iz])
-            Matrix = np.loadtxt(file)
-            file.close()
-
-            X[iz][it] = Matrix[0, 3]
-            Y[iz][it] = Matrix[1, 3]
+    motion_params.save(os.path.join(old_mat, FILE_PARAMS))
 
     # Generate motion splines
     sct.printv('\nGenerate motion splines...', verbose)
+    displacement = motion_params.displacement
+    nt, nz = displacement.shape[:2]
     T = np.arange(nt)
-    if graph:
-        import pylab as pl
-
+    displacement_smooth = displacement.copy()
     for iz in range(nz):
+        for i in range(2):
+            spline = scipy.interpolate.UnivariateSpline(T, displacement[:, iz, i], w=None, bbox=[None, None], k=3,
+                                                        s=None)
+            displacement_smooth[:, iz, i] = spline(T)
+    motion_params.displacement = displacement_smooth
 
-        spline = scipy.interpolate.UnivariateSpline(T, X[iz][:], w=None, bbox=[None, None], k=3, s=None)
-        X_smooth[iz][:] = spline(T)
-
-        if graph:
-            pl.plot(T, X_smooth[iz][:], label='spline_smoothing')
-            pl.plot(T, X[iz][:], marker='*', linestyle='None', label='original_val')
-            if len(index_b0) != 0:
-                T_b0 = [T[i_b0] for i_b0 in index_b0]
-                X_b0 = [X[iz][i_b0] for i_b0 in index_b0]
-                pl.plot(T_b0, X_b0, marker='D', linestyle='None', color='k', label='b=0')
-            pl.title('X')
-            pl.grid()
-            pl.legend()
-            pl.show()
-
-        spline = scipy.interpolate.UnivariateSpline(T, Y[iz][:], w=None, bbox=[None, None], k=3, s=None)
-        Y_smooth[iz][:] = spline(T)
-
-        if graph:
-            pl.plot(T, Y_smooth[iz][:], label='spline_smoothing')
-            pl.plot(T, Y[iz][:], marker='*', linestyle='None', label='original_val')
-            if len(index_b0) != 0:
-                T_b0 = [T[i_b0] for i_b0 in index_b0]
-                Y_b0 = [Y[iz][i_b0] for i_b0 in index_b0]
-                pl.plot(T_b0, Y_b0, marker='D', linestyle='None', color='k', label='b=0')
-            pl.title('Y')
-            pl.grid()
-            pl.legend()
-            pl.show()
-
-    # Storing the final Matrices
-    sct.printv('\nStoring the final Matrices...', verbose)
-    for iz in range(nz):
-        for it in range(nt):
-            file =  open(file_mat[it][iz])
-            Matrix = np.loadtxt(file)
-            file.close()
-
-            Matrix[0, 3] = X_smooth[iz][it]
-            Matrix[1, 3] = Y_smooth[iz][it]
-
-            file =  open(file_mat[it][iz], 'w')
-            np.savetxt(file_mat[it][iz], Matrix, fmt="%s", delimiter='  ', newline='\n')
-            file.close()
+    if graph:
+        import pylab as pl
+        for iz in range(nz):
+            for i, name in enumerate(['X', 'Y']):
+                pl.plot(T, displacement_smooth[:, iz, i], label='spline_smoothing')
+                pl.plot(T, displacement[:, iz, i], marker='*', linestyle='None', label='original_val')
+                if len(index_b0) != 0:
+                    pl.plot(T[index_b0], displacement[index_b0, iz, i], marker='D', linestyle='None', color='k',
+                            label='b=0')
+                pl.title(name)
+                pl.grid()
+                pl.legend()
+                pl.show()
+
+    # Storing the final parameters
+    sct.printv('\nStoring the final motion parameters...', verbose)
+    motion_params.save(os.path.join(folder_mat, FILE_PARAMS))
 
     sct.printv('\n...Done. Patient motion has been smoothed', verbose)
     sct.printv('------------------------------------------------------------------------------\n', verbose)
@@ -17,22 +17,23 @@
 from __future__ import division, absolute_import
 
 import sys, os, logging
+import multiprocessing
 from math import asin, cos, sin, acos
 import numpy as np
-from tqdm import tqdm
 
 from scipy import ndimage
 from scipy.signal import argrelmax, medfilt
 from scipy.io import loadmat
 from nibabel import load, Nifti1Image, save
 
+import spinalcordtoolbox.image as msct_image
 from spinalcordtoolbox.image import Image, find_zmin_zmax, spatial_crop
 
 import sct_utils as sct
 import sct_apply_transfo
 import sct_concat_transfo
 from sct_convert import convert
-from sct_image import split_data, concat_warp2d
+from sct_image import concat_warp2d
 from msct_register_landmarks import register_landmarks
 
 logger = logging.getLogger(__name__)
@@ -529,7 +530,8 @@ def register(src, dest, paramregmulti, param, i_step_str):
                                warp_inverse_out=warp_inverse_out,
                                ants_registration_params=ants_registration_params,
                                remove_temp_files=param.remove_temp_files,
-                               verbose=param.verbose)
+                               verbose=param.verbose,
+                               n_jobs=param.n_jobs)
 
     # slice-wise transfo
     elif paramregmulti.steps[i_step_str].algo in ['centermass', 'centermassrot', 'columnwise']:
@@ -600,7 +602,7 @@ def register(src, dest, paramregmulti, param, i_step_str):
 
 def register_slicewise(fname_src, fname_dest, paramreg=None, fname_mask='', warp_forward_out='step0Warp.nii.gz',
                        warp_inverse_out='step0InverseWarp.nii.gz', ants_registration_params=None,
-                       path_qc='./', remove_temp_files=0, verbose=0):
+                       path_qc='./', remove_temp_files=0, verbose=0, n_jobs=1):
     """
     Main function that calls various methods for slicewise registration.
 
@@ -614,6 +616,7 @@ def register_slicewise(fname_src, fname_dest, paramreg=None, fname_mask='', warp
     :param path_qc:
     :param remove_temp_files:
     :param verbose:
+    :param n_jobs: int: number of slices registered in parallel with ANTs algorithms (see register2d)
     :return:
     """
 
@@ -682,6 +685,7 @@ def register_slicewise(fname_src, fname_dest, paramreg=None, fname_mask='', warp
                    paramreg=paramreg,
                    ants_registration_params=ants_registration_params,
                    verbose=verbose,
+                   n_jobs=n_jobs,
                    )
 
     sct.printv('\nMove warping fields...', verbose)
@@ -701,7 +705,7 @@ def register2d_centermassrot(fname_src, fname_dest, paramreg=None, fname_warp='w
     """
     Rotate the source image to match the orientation of the destination image, using the first and second eigenvector
     of the PCA. This function should be used on segmentations (not images).
-    This works for 2D and 3D images.  If 3D, it splits the image and performs the rotation slice-by-slice.
+    This works for 2D and 3D images. If 3D, the rotation is estimated for each slice (all slices at once).
 
     :param fname_src: List: Name of moving image. If rot=0 or 1, only the first element is used (should be a
         segmentation). If rot=2 or 3, the first element is a segmentation and the second is an image.
@@ -735,20 +739,9 @@ def register2d_centermassrot(fname_src, fname_dest, paramreg=None, fname_warp='w
     sct.printv('  matrix size: ' + str(nx) + ' x ' + str(ny) + ' x ' + str(nz), verbose)
     sct.printv('  voxel size:  ' + str(px) + 'mm x ' + str(py) + 'mm x ' + str(pz) + 'mm', verbose)
 
-    # Split source volume along z
-    sct.printv('\nSplit input segmentation...', verbose)
+    # Load source and destination segmentations (slices are processed in memory)
     im_src = Image(fname_src[0])
-    split_source_list = split_data(im_src, 2)
-    for im in split_source_list:
-        im.save()
-
-    # Split destination volume along z
-    sct.printv('\nSplit destination segmentation...', verbose)
     im_dest = Image(fname_dest[0])
-    split_dest_list = split_data(im_dest, 2)
-    for im in split_dest_list:
-        im.save()
-
     data_src = im_src.data
     data_dest = im_dest.data
 
@@ -762,102 +755,68 @@ def register2d_centermassrot(fname_src, fname_dest, paramreg=None, fname_warp='w
 
     # Deal with cases where both an image and segmentation are input
     if len(fname_src) > 1:
-        # Split source volume along z
-        sct.printv('\nSplit input image...', verbose)
         im_src_im = Image(fname_src[1])
-        split_source_list = split_data(im_src_im, 2)
-        for im in split_source_list:
-            im.save()
-
-        # Split destination volume along z
-        sct.printv('\nSplit destination image...', verbose)
         im_dest_im = Image(fname_dest[1])
-        split_dest_list = split_data(im_dest_im, 2)
-        for im in split_dest_list:
-            im.save()
-
         data_src_im = im_src_im.data
         data_dest_im = im_dest_im.data
 
-    # initialize displacement and rotation
-    coord_src = [None] * nz
-    pca_src = [None] * nz
-    coord_dest = [None] * nz
-    pca_dest = [None] * nz
-    centermass_src = np.zeros([nz, 2])
-    centermass_dest = np.zeros([nz, 2])
-    # displacement_forward = np.zeros([nz, 2])
-    # displacement_inverse = np.zeros([nz, 2])
-    angle_src_dest = np.zeros(nz)
-    z_nonzero = []
     th_max_angle *= np.pi / 180
 
-    # Loop across slices
-    for iz in tqdm(range(0, nz), unit='iter', unit_scale=False, desc="Estimate cord angle for each slice",
-                   ascii=False, ncols=100):
-        try:
-            # compute PCA and get center or mass based on segmentation
-            coord_src[iz], pca_src[iz], centermass_src[iz, :] = compute_pca(data_src[:, :, iz])
-            coord_dest[iz], pca_dest[iz], centermass_dest[iz, :] = compute_pca(data_dest[:, :, iz])
-
-            # detect rotation using the HOG method
-            if rot_method in ['hog', 'pcahog']:
-                angle_src_hog, conf_score_src = find_angle_hog(data_src_im[:, :, iz], centermass_src[iz, :],
-                                                               px, py, angle_range=th_max_angle)
-                angle_dest_hog, conf_score_dest = find_angle_hog(data_dest_im[:, :, iz], centermass_dest[ iz, : ],
-                                                                 px, py, angle_range=th_max_angle)
-                # In case no maxima is found (it should never happen)
-                if (angle_src_hog is None) or (angle_dest_hog is None):
-                    sct.printv('WARNING: Slice #' + str(iz) + ' no angle found in dest or src. It will be ignored.',
-                               verbose, 'warning')
-                    continue
-                if rot_method == 'hog':
-                    angle_src = -angle_src_hog  # flip sign to be consistent with PCA output
-                    angle_dest = angle_dest_hog
-
-            # Detect rotation using the PCA or PCA-HOG method
-            if rot_method in ['pca', 'pcahog']:
-                eigenv_src = pca_src[iz].components_.T[0][0], pca_src[iz].components_.T[1][0]
-                eigenv_dest = pca_dest[iz].components_.T[0][0], pca_dest[iz].components_.T[1][0]
-                # Make sure first element is always positive (to prevent sign flipping)
-                if eigenv_src[0] <= 0:
-                    eigenv_src = tuple([i * (-1) for i in eigenv_src])
-                if eigenv_dest[0] <= 0:
-                    eigenv_dest = tuple([i * (-1) for i in eigenv_dest])
-                angle_src = angle_between(eigenv_src, [1, 0])
-                angle_dest = angle_between([1, 0], eigenv_dest)
-                # compute ratio between axis of PCA
-                pca_eigenratio_src = pca_src[iz].explained_variance_ratio_[0] / pca_src[iz].explained_variance_ratio_[1]
-                pca_eigenratio_dest = pca_dest[iz].explained_variance_ratio_[0] / pca_dest[iz].explained_variance_ratio_[1]
-                # angle is set to 0 if either ratio between axis is too low or outside angle range
-                if pca_eigenratio_src < pca_eigenratio_th or angle_src > th_max_angle or angle_src < -th_max_angle:
-                    if rot_method == 'pca':
-                        angle_src = 0
-                    elif rot_method == 'pcahog':
-                        logger.info("Switched to method 'hog' for slice: {}".format(iz))
-                        angle_src = -angle_src_hog  # flip sign to be consistent with PCA output
-                if pca_eigenratio_dest < pca_eigenratio_th or angle_dest > th_max_angle or angle_dest < -th_max_angle:
-                    if rot_method == 'pca':
-                        angle_dest = 0
-                    elif rot_method == 'pcahog':
-                        logger.info("Switched to method 'hog' for slice: {}".format(iz))
-                        angle_dest = angle_dest_hog
-
-            if not rot_method == 'none':
-                # bypass estimation is source or destination angle is known a priori
-                if paramreg.rot_src is not None:
-                    angle_src = paramreg.rot_src
-                if paramreg.rot_dest is not None:
-                    angle_dest = paramreg.rot_dest
-                # the angle between (src, dest) is the angle between (src, origin) + angle between (origin, dest)
-                angle_src_dest[iz] = angle_src + angle_dest
-
-            # append to list of z_nonzero
-            z_nonzero.append(iz)
-
-        # if one of the slice is empty, ignore it
-        except ValueError:
-            sct.printv('WARNING: Slice #' + str(iz) + ' is empty. It will be ignored.', verbose, 'warning')
+    # Estimate center of mass and orientation of the cord of all slices at once
+    sct.printv('\nEstimate cord angle for each slice...', verbose)
+    centermass_src, eigenv_src, pca_eigenratio_src, is_valid_src = compute_pca_slices(data_src)
+    centermass_dest, eigenv_dest, pca_eigenratio_dest, is_valid_dest = compute_pca_slices(data_dest)
+    # if one of the slice is empty, ignore it
+    is_valid = is_valid_src & is_valid_dest
+    for iz in np.where(~is_valid)[0]:
+        sct.printv('WARNING: Slice #' + str(iz) + ' is empty. It will be ignored.', verbose, 'warning')
+    z_nonzero = list(np.where(is_valid)[0])
+    centermass_src[~is_valid] = 0
+    centermass_dest[~is_valid] = 0
+    angle_src_dest = np.zeros(nz)
+
+    # detect rotation using the HOG method
+    if rot_method in ['hog', 'pcahog']:
+        angle_src_hog = find_angle_hog_slices(data_src_im[:, :, z_nonzero], centermass_src[z_nonzero], px, py,
+                                              angle_range=th_max_angle)
+        angle_dest_hog = find_angle_hog_slices(data_dest_im[:, :, z_nonzero], centermass_dest[z_nonzero], px, py,
+                                               angle_range=th_max_angle)
+        angle_src = -angle_src_hog  # flip sign to be consistent with PCA output
+        angle_dest = angle_dest_hog
+
+    # Detect rotation using the PCA or PCA-HOG method
+    if rot_method in ['pca', 'pcahog']:
+        eigenv_src, eigenv_dest = eigenv_src[z_nonzero], eigenv_dest[z_nonzero]
+        # Make sure first element is always positive (to prevent sign flipping)
+        eigenv_src[eigenv_src[:, 0] <= 0] *= -1
+        eigenv_dest[eigenv_dest[:, 0] <= 0] *= -1
+        # angle between (eigenv_src, [1, 0]) and between ([1, 0], eigenv_dest), see angle_between()
+        angle_src_pca = -np.sign(eigenv_src[:, 1]) * np.arccos(
+            np.clip(eigenv_src[:, 0] / np.linalg.norm(eigenv_src, axis=1), -1, 1))
+        angle_dest_pca = np.sign(eigenv_dest[:, 1]) * np.arccos(
+            np.clip(eigenv_dest[:, 0] / np.linalg.norm(eigenv_dest, axis=1), -1, 1))
+        # angle is set to 0 (pca) or to the HOG estimation (pcahog) if either ratio between axis is too low or
+        # outside angle range
+        is_outlier_src = (pca_eigenratio_src[z_nonzero] < pca_eigenratio_th) | (np.abs(angle_src_pca) > th_max_angle)
+        is_outlier_dest = (pca_eigenratio_dest[z_nonzero] < pca_eigenratio_th) | \
+            (np.abs(angle_dest_pca) > th_max_angle)
+        if rot_method == 'pca':
+            angle_src = np.where(is_outlier_src, 0, angle_src_pca)
+            angle_dest = np.where(is_outlier_dest, 0, angle_dest_pca)
+        else:
+            for iz in np.array(z_nonzero)[is_outlier_src | is_outlier_dest]:
+                logger.info("Switched to method 'hog' for slice: {}".format(iz))
+            angle_src = np.where(is_outlier_src, angle_src, angle_src_pca)
+            angle_dest = np.where(is_outlier_dest, angle_dest, angle_dest_pca)
+
+    if not rot_method == 'none':
+        # bypass estimation is source or destination angle is known a priori
+        if paramreg.rot_src is not None:
+            angle_src = paramreg.rot_src
+        if paramreg.rot_dest is not None:
+            angle_dest = paramreg.rot_dest
+        # the angle between (src, dest) is the angle between (src, origin) + angle between (origin, dest)
+        angle_src_dest[z_nonzero] = angle_src + angle_dest
 
     # regularize rotation
     if not filter_size == 0 and (rot_method in ['pca', 'hog', 'pcahog']):
@@ -875,92 +834,108 @@ def register2d_centermassrot(fname_src, fname_dest, paramreg=None, fname_warp='w
         # update variable
         angle_src_dest[z_nonzero] = angle_src_dest_regularized
 
+    # construct 3D warping matrix for all slices at once
+    sct.printv('\nBuild 3D deformation field...', verbose)
     warp_x = np.zeros(data_dest.shape)
     warp_y = np.zeros(data_dest.shape)
     warp_inv_x = np.zeros(data_src.shape)
     warp_inv_y = np.zeros(data_src.shape)
-
-    # construct 3D warping matrix
-    for iz in tqdm(z_nonzero, unit='iter', unit_scale=False, desc="Build 3D deformation field",
-                   ascii=False, ncols=100):
-        # get indices of x and y coordinates
-        row, col = np.indices((nx, ny))
-        # build 2xn array of coordinates in pixel space
-        coord_init_pix = np.array([row.ravel(), col.ravel(), np.array(np.ones(len(row.ravel())) * iz)]).T
-        # convert coordinates to physical space
-        coord_init_phy = np.array(im_src.transfo_pix2phys(coord_init_pix))
-        # get centermass coordinates in physical space
-        centermass_src_phy = im_src.transfo_pix2phys([[centermass_src[iz, :].T[0], centermass_src[iz, :].T[1], iz]])[0]
-        centermass_dest_phy = im_src.transfo_pix2phys([[centermass_dest[iz, :].T[0], centermass_dest[iz, :].T[1], iz]])[0]
-        # build rotation matrix
-        R = np.matrix(((cos(angle_src_dest[iz]), sin(angle_src_dest[iz])), (-sin(angle_src_dest[iz]), cos(angle_src_dest[iz]))))
-        # build 3D rotation matrix
-        R3d = np.eye(3)
-        R3d[0:2, 0:2] = R
-        # apply forward transformation (in physical space)
-        coord_forward_phy = np.array(np.dot((coord_init_phy - np.transpose(centermass_dest_phy)), R3d) + np.transpose(centermass_src_phy))
-        # apply inverse transformation (in physical space)
-        coord_inverse_phy = np.array(np.dot((coord_init_phy - np.transpose(centermass_src_phy)), R3d.T) + np.transpose(centermass_dest_phy))
-        # display rotations
-        if verbose == 2 and not angle_src_dest[iz] == 0 and not rot_method == 'hog':
-            # compute new coordinates
-            coord_src_rot = coord_src[iz] * R
-            coord_dest_rot = coord_dest[iz] * R.T
-            # generate figure
-            plt.figure(figsize=(9, 9))
-            # plt.ion()  # enables interactive mode (allows keyboard interruption)
-            for isub in [221, 222, 223, 224]:
-                # plt.figure
-                plt.subplot(isub)
-                # ax = matplotlib.pyplot.axis()
-                try:
-                    if isub == 221:
-                        plt.scatter(coord_src[iz][:, 0], coord_src[iz][:, 1], s=5, marker='o', zorder=10, color='steelblue',
-                                    alpha=0.5)
-                        pcaaxis = pca_src[iz].components_.T
-                        pca_eigenratio = pca_src[iz].explained_variance_ratio_
-                        plt.title('src')
-                    elif isub == 222:
-                        plt.scatter([coord_src_rot[i, 0] for i in range(len(coord_src_rot))], [coord_src_rot[i, 1] for i in range(len(coord_src_rot))], s=5, marker='o', zorder=10, color='steelblue', alpha=0.5)
-                        pcaaxis = pca_dest[iz].components_.T
-                        pca_eigenratio = pca_dest[iz].explained_variance_ratio_
-                        plt.title('src_rot')
-                    elif isub == 223:
-                        plt.scatter(coord_dest[iz][:, 0], coord_dest[iz][:, 1], s=5, marker='o', zorder=10, color='red',
-                                    alpha=0.5)
-                        pcaaxis = pca_dest[iz].components_.T
-                        pca_eigenratio = pca_dest[iz].explained_variance_ratio_
-                        plt.title('dest')
-                    elif isub == 224:
-                        plt.scatter([coord_dest_rot[i, 0] for i in range(len(coord_dest_rot))], [coord_dest_rot[i, 1] for i in range(len(coord_dest_rot))], s=5, marker='o', zorder=10, color='red', alpha=0.5)
-                        pcaaxis = pca_src[iz].components_.T
-                        pca_eigenratio = pca_src[iz].explained_variance_ratio_
-                        plt.title('dest_rot')
-                    plt.text(-2.5, -2, 'eigenvectors:', horizontalalignment='left', verticalalignment='bottom')
-                    plt.text(-2.5, -2.8, str(pcaaxis), horizontalalignment='left', verticalalignment='bottom')
-                    plt.text(-2.5, 2.5, 'eigenval_ratio:', horizontalalignment='left', verticalalignment='bottom')
-                    plt.text(-2.5, 2, str(pca_eigenratio), horizontalalignment='left', verticalalignment='bottom')
-                    plt.plot([0, pcaaxis[0, 0]], [0, pcaaxis[1, 0]], linewidth=2, color='red')
-                    plt.plot([0, pcaaxis[0, 1]], [0, pcaaxis[1, 1]], linewidth=2, color='orange')
-                    plt.axis([-3, 3, -3, 3])
-                    plt.gca().set_aspect('equal', adjustable='box')
-                except Exception as e:
-                    raise Exception
-
-            plt.savefig(os.path.join(path_qc, 'register2d_centermassrot_pca_z' + str(iz) + '.png'))
-            plt.close()
-
-        # construct 3D warping matrix
-        warp_x[:, :, iz] = np.array([coord_forward_phy[i, 0] - coord_init_phy[i, 0] for i in range(nx * ny)]).reshape((nx, ny))
-        warp_y[:, :, iz] = np.array([coord_forward_phy[i, 1] - coord_init_phy[i, 1] for i in range(nx * ny)]).reshape((nx, ny))
-        warp_inv_x[:, :, iz] = np.array([coord_inverse_phy[i, 0] - coord_init_phy[i, 0] for i in range(nx * ny)]).reshape((nx, ny))
-        warp_inv_y[:, :, iz] = np.array([coord_inverse_phy[i, 1] - coord_init_phy[i, 1] for i in range(nx * ny)]).reshape((nx, ny))
+    displacement, displacement_inv = compute_centermassrot_displacements(
+        im_src, (nx, ny), z_nonzero, centermass_src[z_nonzero], centermass_dest[z_nonzero], angle_src_dest[z_nonzero])
+    warp_x[:, :, z_nonzero] = displacement[..., 0]
+    warp_y[:, :, z_nonzero] = displacement[..., 1]
+    warp_inv_x[:, :, z_nonzero] = displacement_inv[..., 0]
+    warp_inv_y[:, :, z_nonzero] = displacement_inv[..., 1]
+
+    # display rotations
+    if verbose == 2 and not rot_method == 'hog':
+        for iz in z_nonzero:
+            if not angle_src_dest[iz] == 0:
+                plot_centermassrot_pca(data_src[:, :, iz], data_dest[:, :, iz], angle_src_dest[iz],
+                                       os.path.join(path_qc, 'register2d_centermassrot_pca_z' + str(iz) + '.png'))
 
     # Generate forward warping field (defined in destination space)
     generate_warping_field(fname_dest[0], warp_x, warp_y, fname_warp, verbose)
     generate_warping_field(fname_src[0], warp_inv_x, warp_inv_y, fname_warp_inv, verbose)
 
 
+def compute_centermassrot_displacements(im_src, shape2d, z_slices, centermass_src, centermass_dest, angles):
+    """
+    Compute the forward and inverse displacements (in physical space) of the rotation around the center of mass of
+    several slices. The forward transformation maps the destination onto the source: each point is rotated around the
+    center of mass of the destination, then translated to the center of mass of the source.
+    :param im_src: Image: source image, which header is used to convert pixel coordinates into physical coordinates
+    :param shape2d: tuple: (nx, ny)
+    :param z_slices: list of int: indices of the slices
+    :param centermass_src: nz x 2 array: center of mass of the source (in pixel space) for each slice of z_slices
+    :param centermass_dest: nz x 2 array: center of mass of the destination (in pixel space)
+    :param angles: nz array: rotation angle between source and destination (in rad)
+    :return: displacement, displacement_inv: nx x ny x nz x 2 arrays of x and y displacements
+    """
+    nx, ny = shape2d
+    z_slices = np.asarray(z_slices, dtype=np.float64)
+    affine = im_src.hdr.get_best_affine()
+    # physical coordinates of the grid of the first slice, then offset of each slice and centers of mass (x and y)
+    row, col = np.indices((nx, ny))
+    coord_init_phy = (np.dot(np.stack((row.ravel(), col.ravel()), axis=1), affine[:2, :2].T) + affine[:2, 3])
+    offset_phy = z_slices[:, np.newaxis] * affine[:2, 2]
+    centermass_src_phy = np.dot(centermass_src, affine[:2, :2].T) + affine[:2, 3] + offset_phy
+    centermass_dest_phy = np.dot(centermass_dest, affine[:2, :2].T) + affine[:2, 3] + offset_phy
+    # rotation matrices, applied to row vectors
+    cos_angles, sin_angles = np.cos(angles), np.sin(angles)
+    R = np.stack((np.stack((cos_angles, sin_angles), axis=-1), np.stack((-sin_angles, cos_angles), axis=-1)), axis=1)
+    # forward transformation: (x - centermass_dest) R + centermass_src - x, for x = coord_init_phy + offset_phy
+    # inverse transformation: (x - centermass_src) R^T + centermass_dest - x
+    displacement = np.einsum('vi,zij->vzj', coord_init_phy, R - np.eye(2)) + \
+        np.einsum('zi,zij->zj', offset_phy - centermass_dest_phy, R) + centermass_src_phy - offset_phy
+    R_inv = np.transpose(R, (0, 2, 1))
+    displacement_inv = np.einsum('vi,zij->vzj', coord_init_phy, R_inv - np.eye(2)) + \
+        np.einsum('zi,zij->zj', offset_phy - centermass_src_phy, R_inv) + centermass_dest_phy - offset_phy
+    return displacement.reshape((nx, ny, -1, 2)), displacement_inv.reshape((nx, ny, -1, 2))
+
+
+def plot_centermassrot_pca(data2d_src, data2d_dest, angle, fname_out):
+    """
+    Display the PCA of the source and destination segmentations, before and after rotation.
+    :param data2d_src: 2d array: source segmentation
+    :param data2d_dest: 2d array: destination segmentation
+    :param angle: float: rotation angle between source and destination (in rad)
+    :param fname_out: str: output figure
+    :return:
+    """
+    import matplotlib
+    matplotlib.use('Agg')  # prevent display figure
+    import matplotlib.pyplot as plt
+
+    coord_src, pca_src, _ = compute_pca(data2d_src)
+    coord_dest, pca_dest, _ = compute_pca(data2d_dest)
+    # compute new coordinates
+    R = np.array(((cos(angle), sin(angle)), (-sin(angle), cos(angle))))
+    coord_src_rot = np.dot(coord_src, R)
+    coord_dest_rot = np.dot(coord_dest, R.T)
+    # generate figure
+    plt.figure(figsize=(9, 9))
+    for isub, coord, pca, color, title in [(221, coord_src, pca_src, 'steelblue', 'src'),
+                                           (222, coord_src_rot, pca_dest, 'steelblue', 'src_rot'),
+                                           (223, coord_dest, pca_dest, 'red', 'dest'),
+                                           (224, coord_dest_rot, pca_src, 'red', 'dest_rot')]:
+        plt.subplot(isub)
+        plt.scatter(coord[:, 0], coord[:, 1], s=5, marker='o', zorder=10, color=color, alpha=0.5)
+        pcaaxis = pca.components_.T
+        pca_eigenratio = pca.explained_variance_ratio_
+        plt.title(title)
+        plt.text(-2.5, -2, 'eigenvectors:', horizontalalignment='left', verticalalignment='bottom')
+        plt.text(-2.5, -2.8, str(pcaaxis), horizontalalignment='left', verticalalignment='bottom')
+        plt.text(-2.5, 2.5, 'eigenval_ratio:', horizontalalignment='left', verticalalignment='bottom')
+        plt.text(-2.5, 2, str(pca_eigenratio), horizontalalignment='left', verticalalignment='bottom')
+        plt.plot([0, pcaaxis[0, 0]], [0, pcaaxis[1, 0]], linewidth=2, color='red')
+        plt.plot([0, pcaaxis[0, 1]], [0, pcaaxis[1, 1]], linewidth=2, color='orange')
+        plt.axis([-3, 3, -3, 3])
+        plt.gca().set_aspect('equal', adjustable='box')
+    plt.savefig(fname_out)
+    plt.close()
+
+
 def register2d_columnwise(fname_src, fname_dest, fname_warp='warp_forward.nii.gz', fname_warp_inv='warp_inverse.nii.gz', verbose=0, path_qc='./', smoothWarpXY=1):
     """
     Column-wise non-linear registration of segmentations. Based on an idea from Allan Martin.
@@ -992,21 +967,9 @@ def register2d_columnwise(fname_src, fname_dest, fname_warp='warp_forward.nii.gz
     sct.printv('  matrix size: ' + str(nx) + ' x ' + str(ny) + ' x ' + str(nz), verbose)
     sct.printv('  voxel size:  ' + str(px) + 'mm x ' + str(py) + 'mm x ' + str(pz) + 'mm', verbose)
 
-    # Split source volume along z
-    sct.printv('\nSplit input volume...', verbose)
+    # open image (slices are processed in memory)
     im_src = Image('src.nii')
-    split_source_list = split_data(im_src, 2)
-    for im in split_source_list:
-        im.save()
-
-    # Split destination volume along z
-    sct.printv('\nSplit destination volume...', verbose)
     im_dest = Image('dest.nii')
-    split_dest_list = split_data(im_dest, 2)
-    for im in split_dest_list:
-        im.save()
-
-    # open image
     data_src = im_src.data
     data_dest = im_dest.data
 
@@ -1228,7 +1191,7 @@ def register2d(fname_src, fname_dest, fname_mask='', fname_warp='warp_forward.ni
                ants_registration_params={'rigid': '', 'affine': '', 'compositeaffine': '', 'similarity': '',
                                          'translation': '', 'bspline': ',10', 'gaussiandisplacementfield': ',3,0',
                                          'bsplinedisplacementfield': ',5,10', 'syn': ',3,0', 'bsplinesyn': ',1,3'},
-               verbose=0):
+               verbose=0, n_jobs=1):
     """
     Slice-by-slice registration of two images.
 
@@ -1240,6 +1203,8 @@ def register2d(fname_src, fname_dest, fname_mask='', fname_warp='warp_forward.ni
     :param paramreg: Class Paramreg()
     :param ants_registration_params: dict: specific algorithm's parameters for antsRegistration
     :param verbose:
+    :param n_jobs: int: number of slices registered in parallel (one antsRegistration process each). 0 or negative: use
+        all available CPUs.
     :return:
         if algo==translation:
             x_displacement: list of translation along x axis for each slice (type: list)
@@ -1264,116 +1229,74 @@ def register2d(fname_src, fname_dest, fname_mask='', fname_warp='warp_forward.ni
     sct.printv('.. matrix size: ' + str(nx) + ' x ' + str(ny) + ' x ' + str(nz), verbose)
     sct.printv('.. voxel size:  ' + str(px) + 'mm x ' + str(py) + 'mm x ' + str(pz) + 'mm', verbose)
 
-    # Split input volume along z
-    sct.printv('\nSplit input volume...', verbose)
+    # Load input, destination and mask volumes. antsRegistration needs one file per slice: they are written just before
+    # registering each slice, in a RAM-backed scratch folder, along with the 2d transformations.
     im_src = Image(fname_src)
-    split_source_list = split_data(im_src, 2)
-    for im in split_source_list:
-        im.save()
-
-    # Split destination volume along z
-    sct.printv('\nSplit destination volume...', verbose)
     im_dest = Image(fname_dest)
-    split_dest_list = split_data(im_dest, 2)
-    for im in split_dest_list:
-        im.save()
-
-    # Split mask volume along z
-    if fname_mask != '':
-        sct.printv('\nSplit mask volume...', verbose)
-        im_mask = Image('mask.nii.gz')
-        split_mask_list = split_data(im_mask, 2)
-        for im in split_mask_list:
-            im.save()
-
-    # initialization
-    if paramreg.algo in ['Translation']:
-        x_displacement = [0 for i in range(nz)]
-        y_displacement = [0 for i in range(nz)]
-        theta_rotation = [0 for i in range(nz)]
-    if paramreg.algo in ['Rigid', 'Affine', 'BSplineSyN', 'SyN']:
-        list_warp = []
-        list_warp_inv = []
-
-    # loop across slices
-    for i in range(nz):
-        # set masking
-        sct.printv('Registering slice ' + str(i) + '/' + str(nz - 1) + '...', verbose)
-        num = numerotation(i)
-        prefix_warp2d = 'warp2d_' + num
-        # if mask is used, prepare command for ANTs
-        if fname_mask != '':
-            masking = ['-x', 'mask_Z' + num + '.nii.gz']
-        else:
-            masking = []
-        # main command for registration
-        # TODO fixup isct_ants* parsers
-        cmd = ['isct_antsRegistration',
-         '--dimensionality', '2',
-         '--transform', paramreg.algo + '[' + str(paramreg.gradStep) + ants_registration_params[paramreg.algo.lower()] + ']',
-         '--metric', paramreg.metric + '[dest_Z' + num + '.nii' + ',src_Z' + num + '.nii' + ',1,' + metricSize + ']',  #[fixedImage,movingImage,metricWeight +nb_of_bins (MI) or radius (other)
-         '--convergence', str(paramreg.iter),
-         '--shrink-factors', str(paramreg.shrink),
-         '--smoothing-sigmas', str(paramreg.smooth) + 'mm',
-         '--output', '[' + prefix_warp2d + ',src_Z' + num + '_reg.nii]',    #--> file.mat (contains Tx,Ty, theta)
-         '--interpolation', 'BSpline[3]',
-         '--verbose', '1',
-        ] + masking
-        # add init translation
-        if not paramreg.init == '':
-            init_dict = {'geometric': '0', 'centermass': '1', 'origin': '2'}
-            cmd += ['-r', '[dest_Z' + num + '.nii' + ',src_Z' + num + '.nii,' + init_dict[paramreg.init] + ']']
-
-        try:
-            # run registration
-            sct.run(cmd, is_sct_binary=True)
-
-            if paramreg.algo in ['Translation']:
-                file_mat = prefix_warp2d + '0GenericAffine.mat'
-                matfile = loadmat(file_mat, struct_as_record=True)
-                array_transfo = matfile['AffineTransform_double_2_2']
-                x_displacement[i] = array_transfo[4][0]  # Tx in ITK'S coordinate system
-                y_displacement[i] = array_transfo[5][0]  # Ty  in ITK'S and fslview's coordinate systems
-                theta_rotation[i] = asin(array_transfo[2])  # angle of rotation theta in ITK'S coordinate system (minus theta for fslview)
-
-            if paramreg.algo in ['Rigid', 'Affine', 'BSplineSyN', 'SyN']:
-                # List names of 2d warping fields for subsequent merge along Z
-                file_warp2d = prefix_warp2d + '0Warp.nii.gz'
-                file_warp2d_inv = prefix_warp2d + '0InverseWarp.nii.gz'
-                list_warp.append(file_warp2d)
-                list_warp_inv.append(file_warp2d_inv)
-
-            if paramreg.algo in ['Rigid', 'Affine']:
-                # Generating null 2d warping field (for subsequent concatenation with affine transformation)
-                # TODO fixup isct_ants* parsers
-                sct.run(['isct_antsRegistration',
-                 '-d', '2',
-                 '-t', 'SyN[1,1,1]',
-                 '-c', '0',
-                 '-m', 'MI[dest_Z' + num + '.nii,src_Z' + num + '.nii,1,32]',
-                 '-o', 'warp2d_null',
-                 '-f', '1',
-                 '-s', '0',
-                ], is_sct_binary=True)
-                # --> outputs: warp2d_null0Warp.nii.gz, warp2d_null0InverseWarp.nii.gz
-                file_mat = prefix_warp2d + '0GenericAffine.mat'
-                # Concatenating mat transfo and null 2d warping field to obtain 2d warping field of affine transformation
-                sct.run(['isct_ComposeMultiTransform', '2', file_warp2d, '-R', 'dest_Z' + num + '.nii', 'warp2d_null0Warp.nii.gz', file_mat], is_sct_binary=True)
-                sct.run(['isct_ComposeMultiTransform', '2', file_warp2d_inv, '-R', 'src_Z' + num + '.nii', 'warp2d_null0InverseWarp.nii.gz', '-i', file_mat], is_sct_binary=True)
-
-        # if an exception occurs with ants, take the last value for the transformation
-        # TODO: DO WE NEED TO DO THAT??? (julien 2016-03-01)
-        except Exception as e:
-            sct.printv('ERROR: Exception occurred.\n' + str(e), 1, 'error')
+    im_mask = Image('mask.nii.gz') if fname_mask != '' else None
+    path_slices = sct.tmp_create(basename="register2d", verbose=verbose, ram=True)
+
+    if n_jobs <= 0:
+        n_jobs = multiprocessing.cpu_count()
+    n_jobs = min(n_jobs, nz)
+    # each process gets its share of the CPUs for the ITK threads of antsRegistration
+    if n_jobs > 1:
+        env = dict(os.environ)
+        env["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] = str(max(1, multiprocessing.cpu_count() // n_jobs))
+    else:
+        env = None
+
+    def get_tasks():
+        """Write the slices of the volumes and yield one registration task per slice"""
+        for i in range(nz):
+            num = numerotation(i)
+            prefix_warp2d = os.path.join(path_slices, 'warp2d_' + num)
+            fname_src_z = save_slice(im_src, i, os.path.join(path_slices, 'src_Z' + num + '.nii'))
+            fname_dest_z = save_slice(im_dest, i, os.path.join(path_slices, 'dest_Z' + num + '.nii'))
+            fname_src_z_reg = os.path.join(path_slices, 'src_Z' + num + '_reg.nii')
+            # if mask is used, prepare command for ANTs
+            if im_mask is not None:
+                fname_mask_z = save_slice(im_mask, i, os.path.join(path_slices, 'mask_Z' + num + '.nii'))
+                masking = ['-x', fname_mask_z]
+            else:
+                fname_mask_z = None
+                masking = []
+            # main command for registration
+            # TODO fixup isct_ants* parsers
+            cmd = ['isct_antsRegistration',
+             '--dimensionality', '2',
+             '--transform', paramreg.algo + '[' + str(paramreg.gradStep) + ants_registration_params[paramreg.algo.lower()] + ']',
+             '--metric', paramreg.metric + '[' + fname_dest_z + ',' + fname_src_z + ',1,' + metricSize + ']',  #[fixedImage,movingImage,metricWeight +nb_of_bins (MI) or radius (other)
+             '--convergence', str(paramreg.iter),
+             '--shrink-factors', str(paramreg.shrink),
+             '--smoothing-sigmas', str(paramreg.smooth) + 'mm',
+             '--output', '[' + prefix_warp2d + ',' + fname_src_z_reg + ']',    #--> file.mat (contains Tx,Ty, theta)
+             '--interpolation', 'BSpline[3]',
+             '--verbose', '1',
+            ] + masking
+            # add init translation
+            if not paramreg.init == '':
+                init_dict = {'geometric': '0', 'centermass': '1', 'origin': '2'}
+                cmd += ['-r', '[' + fname_dest_z + ',' + fname_src_z + ',' + init_dict[paramreg.init] + ']']
+            yield (i, paramreg.algo, cmd, prefix_warp2d, fname_src_z, fname_dest_z, fname_src_z_reg, fname_mask_z,
+                   env, int(n_jobs <= 1))
+
+    # register the slices, serially or with a pool of processes. The results are gathered by slice index, whatever the
+    # order of completion.
+    transfo = [None] * nz
+    for i, transfo_slice, error in _map_register2d_slices(get_tasks(), nz, n_jobs):
+        if error is not None:
+            # TODO: DO WE NEED TO DO THAT??? (julien 2016-03-01)
+            sct.printv('ERROR: Exception occurred.\n' + error, 1, 'error')
+        transfo[i] = transfo_slice
+        sct.printv('Registered slice ' + str(i) + '/' + str(nz - 1), verbose)
 
     # Merge warping field along z
     sct.printv('\nMerge warping fields along z...', verbose)
 
     if paramreg.algo in ['Translation']:
-        # convert to array
-        x_disp_a = np.asarray(x_displacement)
-        y_disp_a = np.asarray(y_displacement)
-        theta_rot_a = np.asarray(theta_rotation)
+        # convert to array (slices that failed are not displaced)
+        x_disp_a, y_disp_a, theta_rot_a = np.array([t if t is not None else (0, 0, 0) for t in transfo]).T
         # Generate warping field
         generate_warping_field(fname_dest, x_disp_a, y_disp_a, fname_warp=fname_warp)  #name_warp= 'step'+str(paramreg.step)
         # Inverse warping field
@@ -1381,9 +1304,113 @@ def register2d(fname_src, fname_dest, fname_mask='', fname_warp='warp_forward.ni
 
     if paramreg.algo in ['Rigid', 'Affine', 'BSplineSyN', 'SyN']:
         # concatenate 2d warping fields along z
+        list_warp, list_warp_inv = [[t[k] for t in transfo if t is not None] for k in range(2)]
         concat_warp2d(list_warp, fname_warp, fname_dest)
         concat_warp2d(list_warp_inv, fname_warp_inv, fname_src)
 
+    sct.rmtree(path_slices, verbose=verbose)
+
+
+def _map_register2d_slices(tasks, nb_tasks, n_jobs=1):
+    """
+    Run the slice-wise registrations of register2d, serially or with a pool of processes.
+
+    :param tasks: iterable of tasks (see _register2d_slice)
+    :param nb_tasks: int: number of tasks
+    :param n_jobs: int: number of processes
+    :return: generator of (slice index, transformation, error message), in order of completion
+    """
+    if n_jobs <= 1:
+        for task in tasks:
+            yield _register2d_slice(task)
+        return
+
+    sct.printv('Registering {} slices with {} processes...'.format(nb_tasks, n_jobs))
+    pool = multiprocessing.Pool(n_jobs)
+    try:
+        for result in pool.imap_unordered(_register2d_slice, tasks):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _register2d_slice(task):
+    """
+    Register one slice with antsRegistration, and remove the input slices once done.
+
+    :param task: tuple (slice index, algo, antsRegistration command, output prefix, source slice, destination slice,
+        registered source slice, mask slice or None, environment of the commands or None, verbose)
+    :return: (slice index, transformation, error message or None). The transformation is (Tx, Ty, theta) for
+        algo=Translation, the forward and inverse 2d warping fields otherwise, and None if the registration failed.
+    """
+    i, algo, cmd, prefix_warp2d, fname_src_z, fname_dest_z, fname_src_z_reg, fname_mask_z, env, verbose = task
+    transfo, error = None, None
+    try:
+        # run registration
+        sct.run(cmd, verbose=verbose, env=env, is_sct_binary=True)
+
+        if algo in ['Translation']:
+            file_mat = prefix_warp2d + '0GenericAffine.mat'
+            matfile = loadmat(file_mat, struct_as_record=True)
+            array_transfo = matfile['AffineTransform_double_2_2']
+            transfo = (array_transfo[4][0],  # Tx in ITK'S coordinate system
+                       array_transfo[5][0],  # Ty  in ITK'S and fslview's coordinate systems
+                       asin(array_transfo[2]))  # angle of rotation theta in ITK'S coordinate system (minus theta for fslview)
+
+        if algo in ['Rigid', 'Affine', 'BSplineSyN', 'SyN']:
+            # names of 2d warping fields for subsequent merge along Z
+            file_warp2d = prefix_warp2d + '0Warp.nii.gz'
+            file_warp2d_inv = prefix_warp2d + '0InverseWarp.nii.gz'
+            transfo = (file_warp2d, file_warp2d_inv)
+
+        if algo in ['Rigid', 'Affine']:
+            # Generating null 2d warping field (for subsequent concatenation with affine transformation)
+            # TODO fixup isct_ants* parsers
+            prefix_null = prefix_warp2d + '_null'
+            sct.run(['isct_antsRegistration',
+             '-d', '2',
+             '-t', 'SyN[1,1,1]',
+             '-c', '0',
+             '-m', 'MI[' + fname_dest_z + ',' + fname_src_z + ',1,32]',
+             '-o', prefix_null,
+             '-f', '1',
+             '-s', '0',
+            ], verbose=verbose, env=env, is_sct_binary=True)
+            # --> outputs: warp2d_XXXX_null0Warp.nii.gz, warp2d_XXXX_null0InverseWarp.nii.gz
+            file_mat = prefix_warp2d + '0GenericAffine.mat'
+            # Concatenating mat transfo and null 2d warping field to obtain 2d warping field of affine transformation
+            sct.run(['isct_ComposeMultiTransform', '2', file_warp2d, '-R', fname_dest_z, prefix_null + '0Warp.nii.gz', file_mat], verbose=verbose, env=env, is_sct_binary=True)
+            sct.run(['isct_ComposeMultiTransform', '2', file_warp2d_inv, '-R', fname_src_z, prefix_null + '0InverseWarp.nii.gz', '-i', file_mat], verbose=verbose, env=env, is_sct_binary=True)
+
+    # if an exception occurs with ants, the error is reported by the caller
+    except Exception as e:
+        error = str(e)
+
+    # only the 2d warping fields are kept until they are merged
+    for fname in [fname_src_z, fname_dest_z, fname_src_z_reg, fname_mask_z]:
+        if fname is not None and os.path.isfile(fname):
+            os.remove(fname)
+
+    return i, transfo, error
+
+
+def save_slice(im, iz, fname):
+    """
+    Save one axial slice of an image, with the header of the volume (as done by sct_image -split z).
+    :param im: Image: 3d volume
+    :param iz: int: slice (z)
+    :param fname: str: output file name
+    :return: fname
+    """
+    im_slice = msct_image.empty_like(im)
+    im_slice.data = im.data[:, :, iz]
+    im_slice.save(fname, verbose=0)
+    return fname
+
 
 def numerotation(nb):
     """Indexation of number for matching fslsplit's index.
@@ -1440,7 +1467,7 @@ def generate_warping_field(fname_dest, warp_x, warp_y, fname_warp='warping_field
 
     # save warping field
     im_dest = load(fname_dest)
-    hdr_dest = im_dest.get_header()
+    hdr_dest = im_dest.header
     hdr_warp = hdr_dest.copy()
     hdr_warp.set_intent('vector', (), '')
     hdr_warp.set_data_dtype('float32')
@@ -1550,6 +1577,39 @@ def compute_pca(data2d):
     return coordsrc, pca, centermass
 
 
+def compute_pca_slices(data3d):
+    """
+    Compute the center of mass and the PCA of the non-zero values of each slice (along the 3rd dimension) at once. This
+    is equivalent to calling compute_pca() on each slice.
+    :param data3d: 3d array. PCA will be computed on non-zeros values (after rounding) of each slice.
+    :return:
+        centermass: nz x 2 array: 2d coordinates of the center of mass of each slice
+        eigenv: nz x 2 array: first eigenvector (PCA component) of each slice
+        eigenratio: nz array: ratio between the first and second explained variance of each slice
+        is_valid: nz array of bool: False for slices with less than two non-zero values (PCA cannot be computed)
+    """
+    mask = data3d.round().astype(int) != 0
+    nx, ny, nz = mask.shape
+    nb_points = mask.sum(axis=(0, 1))
+    is_valid = nb_points > 1
+    nb_points = np.maximum(nb_points, 1)
+    xx, yy = np.mgrid[:nx, :ny]
+    centermass = np.stack((np.einsum('xy,xyz->z', xx, mask), np.einsum('xy,xyz->z', yy, mask)), axis=1) / \
+        nb_points[:, np.newaxis]
+    # covariance of the centered coordinates
+    dx = (xx[..., np.newaxis] - centermass[:, 0]) * mask
+    dy = (yy[..., np.newaxis] - centermass[:, 1]) * mask
+    cov = np.empty((nz, 2, 2))
+    cov[:, 0, 0] = (dx ** 2).sum(axis=(0, 1))
+    cov[:, 1, 1] = (dy ** 2).sum(axis=(0, 1))
+    cov[:, 0, 1] = cov[:, 1, 0] = (dx * dy).sum(axis=(0, 1))
+    # eigenvalues in ascending order
+    eigenval, eigenvect = np.linalg.eigh(cov)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        eigenratio = eigenval[:, 1] / np.maximum(eigenval[:, 0], 0)
+    return centermass, eigenvect[:, :, 1], eigenratio, is_valid
+
+
 def find_index_halfmax(data1d):
     """
     Find the two indices at half maximum for a bell-type curve (non-parametric). Uses center of mass calculation.
@@ -1682,6 +1742,94 @@ def gradient_orientation_histogram(image, nb_bin, seg_weighted_mask=None):
     return grad_orient_histo[0].astype(float)  # return only the values of the bins, not the bins (we know them)
 
 
+def find_angle_hog_slices(data3d, centermass, px, py, angle_range=10):
+    """
+    Find the angle of each slice (along the 3rd dimension) of an image, with the method of find_angle_hog(). The
+    gradients and orientation histograms of all slices are computed at once.
+    :param data3d: 3d array
+    :param centermass: nz x 2 array: center of mass of each slice
+    :param px, py: dimensions of the pixels in the x and y direction
+    :param angle_range: float or None, see find_angle_hog()
+    :return: nz array: angle found for each slice
+    """
+    # same parameters as find_angle_hog()
+    sigma = 10
+    nb_bin = 360
+    kmedian_size = 5
+
+    sigmax = sigma / px
+    sigmay = sigma / py
+    if nb_bin % 2 != 0:
+        nb_bin = nb_bin - 1
+    if angle_range is None:
+        angle_range = 90
+
+    # weighting of the orientation histogram based on the center of mass of each slice
+    nx, ny, nz = data3d.shape
+    xx, yy = np.mgrid[:nx, :ny]
+    seg_weighted_mask = np.exp(-(((xx[..., np.newaxis] - centermass[:, 0]) ** 2) / (2 * (sigmax ** 2)) +
+                                 ((yy[..., np.newaxis] - centermass[:, 1]) ** 2) / (2 * (sigmay ** 2))))
+    grad_orient_histo = gradient_orientation_histogram_slices(data3d, nb_bin=nb_bin,
+                                                              seg_weighted_mask=seg_weighted_mask)
+    repr_hist = np.linspace(-(np.pi - 2 * np.pi / nb_bin), (np.pi - 2 * np.pi / nb_bin), nb_bin - 1)
+    # circular median filtering of the histograms, then circular autoconvolution
+    grad_orient_histo_smooth = ndimage.median_filter(grad_orient_histo, size=(1, kmedian_size), mode='wrap')
+    grad_orient_histo_conv = np.array([circular_conv(histo, histo) for histo in grad_orient_histo_smooth])
+    # search for the maximum within the angle range
+    index_restrain = int(np.ceil(np.true_divide(angle_range, 180) * nb_bin))
+    center = (nb_bin - 1) // 2
+    grad_orient_histo_conv_restrained = grad_orient_histo_conv[:, center - index_restrain + 1:center + index_restrain + 1]
+    index_angle_found = np.argmax(grad_orient_histo_conv_restrained, axis=1) + (nb_bin // 2 - index_restrain)
+    return repr_hist[index_angle_found] / 2
+
+
+def gradient_orientation_histogram_slices(data3d, nb_bin, seg_weighted_mask=None):
+    """
+    Compute the orientation histogram of each slice (along the 3rd dimension) of an image, as done by
+    gradient_orientation_histogram() for a 2d image.
+    :param data3d: 3d array
+    :param nb_bin: int: number of bins of the histogram
+    :param seg_weighted_mask: optional, 3d array between 0 and 1 weighting the histogram count
+    :return: nz x (nb_bin - 1) array: histogram of each slice
+    """
+    h_kernel = np.array([[1, 2, 1],
+                         [0, 0, 0],
+                         [-1, -2, -1]]) / 4.0
+    v_kernel = h_kernel.T
+
+    # Normalization by median of each slice
+    median = np.median(data3d, axis=(0, 1))
+    data3d = data3d / np.where(median != 0, median, 1)
+
+    # x and y gradients of each slice (the kernels do not extend along z)
+    gradx = ndimage.convolve(data3d, v_kernel[..., np.newaxis])
+    grady = ndimage.convolve(data3d, h_kernel[..., np.newaxis])
+    orient = np.arctan2(grady, gradx)
+
+    # weight by gradient magnitude, normalized within each slice
+    grad_mag = np.sqrt(gradx ** 2 + grady ** 2)
+    grad_mag_max = grad_mag.max(axis=(0, 1))
+    grad_mag /= np.where(grad_mag_max != 0, grad_mag_max, 1)
+    weighting_map = grad_mag if seg_weighted_mask is None else seg_weighted_mask * grad_mag
+
+    # histogram of each slice, with the same binning as np.histogram()
+    nz = data3d.shape[2]
+    n_bins = nb_bin - 1
+    first_edge, last_edge = -(np.pi - np.pi / nb_bin), (np.pi - np.pi / nb_bin)
+    bin_edges = np.linspace(first_edge, last_edge, n_bins + 1)
+    orient = orient.reshape(-1, nz)
+    weighting_map = weighting_map.reshape(-1, nz)
+    keep = (orient >= first_edge) & (orient <= last_edge)
+    indices = ((orient - first_edge) * (n_bins / (last_edge - first_edge))).astype(np.intp)
+    indices[indices == n_bins] -= 1
+    indices = np.clip(indices, 0, n_bins - 1)
+    indices[orient < bin_edges[indices]] -= 1
+    indices[(orient >= bin_edges[np.minimum(indices + 1, n_bins)]) & (indices != n_bins - 1)] += 1
+    indices = np.clip(indices, 0, n_bins - 1) + n_bins * np.arange(nz)
+    grad_orient_histo = np.bincount(indices[keep], weights=weighting_map[keep], minlength=n_bins * nz)
+    return grad_orient_histo.reshape(nz, n_bins).astype(float)
+
+
 def circular_conv(signal1, signal2):
     """takes two 1D numpy array and do a circular convolution with them
     inputs :
@@ -23,6 +23,7 @@ from spinalcordtoolbox.utils import Metavar, SmartFormatter
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.cropping import ImageCropper
 from spinalcordtoolbox.math import dilate
+from spinalcordtoolbox.warping import apply_transforms
 
 import sct_utils as sct
 import sct_image
@@ -99,6 +100,22 @@ def get_parser():
         required=False,
         default='spline',
         choices=('nn', 'linear', 'spline', 'label'))
+    optional.add_argument(
+        "-engine",
+        help="""Engine used to apply the transformations. 'ants': isct_antsApplyTransforms. 'native': in-process 
+        resampling with NumPy/SciPy, which avoids writing temporary files and reuses the composed transformations 
+        when several images are warped to the same destination.""",
+        required=False,
+        default='ants',
+        choices=('ants', 'native'))
+    optional.add_argument(
+        "-cpu",
+        metavar=Metavar.int,
+        type=int,
+        help="Number of threads used to warp the volumes of 4D data with the native engine. 0: use all available "
+             "CPUs.",
+        required=False,
+        default=1)
     optional.add_argument(
         "-r",
         help="""Remove temporary files.""",
@@ -119,7 +136,7 @@ def get_parser():
 
 class Transform:
     def __init__(self, input_filename, fname_dest, list_warp, list_warpinv=[], output_filename='', verbose=0, crop=0,
-                 interp='spline', remove_temp_files=1, debug=0):
+                 interp='spline', remove_temp_files=1, debug=0, engine='ants', n_jobs=1):
         self.input_filename = input_filename
         self.list_warp = list_warp
         self.list_warpinv = list_warpinv
@@ -130,6 +147,8 @@ class Transform:
         self.verbose = verbose
         self.remove_temp_files = remove_temp_files
         self.debug = debug
+        self.engine = engine
+        self.n_jobs = n_jobs
 
     def apply(self):
         # Initialization
@@ -219,12 +238,26 @@ class Transform:
                 fname_src = fname_dilated_labels
 
             sct.printv("\nApply transformation and resample to destination space...", verbose)
-            sct.run(['isct_antsApplyTransforms',
-                     '-d', dim,
-                     '-i', fname_src,
-                     '-o', fname_out,
-                     '-t'
-                     ] + fname_warp_list_invert + ['-r', fname_dest] + interp, verbose=verbose, is_sct_binary=True)
+            if self.engine == 'native':
+                apply_transforms(Image(fname_src), Image(fname_dest), list_warp, self.list_warpinv,
+                                 interp=self.interp).save(fname_out)
+            else:
+                sct.run(['isct_antsApplyTransforms',
+                         '-d', dim,
+                         '-i', fname_src,
+                         '-o', fname_out,
+                         '-t'
+                         ] + fname_warp_list_invert + ['-r', fname_dest] + interp, verbose=verbose, is_sct_binary=True)
+
+        # if 4d and native engine, compute the sampling points once and warp all volumes in memory
+        elif self.engine == 'native':
+            if islabel:
+                raise NotImplementedError
+
+            dim = '4'
+            sct.printv('\nApply transformation to each 3D volume...', verbose)
+            apply_transforms(img_src, Image(fname_dest), list_warp, self.list_warpinv, interp=self.interp,
+                             n_jobs=self.n_jobs).save(fname_out)
 
         # if 4d, loop across the T dimension
         else:
@@ -366,6 +399,8 @@ def main(args=None):
     transform.interp = arguments.x
     transform.remove_temp_files = arguments.r
     transform.verbose = arguments.v
+    transform.engine = arguments.engine
+    transform.n_jobs = arguments.cpu
     sct.init_sct(log_level=transform.verbose, update=True)  # Update log level
 
     transform.apply()
@@ -18,7 +18,8 @@ import os
 import sys
 import argparse
 
-from spinalcordtoolbox.utils import Metavar, SmartFormatter, ActionCreateFolder
+from spinalcordtoolbox.utils import Metavar, SmartFormatter, ActionCreateFolder, type_float_range
+from spinalcordtoolbox.deepseg_lesion.core import BATCH_SIZE
 
 import sct_utils as sct
 
@@ -82,6 +83,25 @@ def get_parser():
         required=False,
         choices=(0, 1),
         default=1)
+    optional.add_argument(
+        "-batch-size",
+        type=int,
+        metavar=Metavar.int,
+        help="Number of patches segmented at once by the CNN. Larger batches are faster, at the cost of more memory.",
+        default=BATCH_SIZE)
+    optional.add_argument(
+        "-overlap",
+        type=type_float_range(0, 1, include_max=False),
+        metavar=Metavar.float,
+        help="Fraction of the patches shared by neighbouring patches, between 0 and 1 (excluded). Larger overlaps are "
+             "more accurate at the borders of the patches, and slower.",
+        default=0.0)
+    optional.add_argument(
+        "-blending",
+        help="Blending of the predictions of overlapping patches: with weights higher at the center of the patches "
+             "(gaussian), or uniform (constant).",
+        choices=('gaussian', 'constant'),
+        default='gaussian')
     optional.add_argument(
         "-ofolder",
         help='Output folder. Example: My_Output_Folder/ ',
@@ -151,7 +171,8 @@ def main():
     from spinalcordtoolbox.deepseg_lesion.core import deep_segmentation_MSlesion
     im_image = Image(fname_image)
     im_seg, im_labels_viewer, im_ctr = deep_segmentation_MSlesion(im_image, contrast_type, ctr_algo=ctr_algo, ctr_file=manual_centerline_fname,
-                                        brain_bool=brain_bool, remove_temp_files=remove_temp_files, verbose=verbose)
+                                        brain_bool=brain_bool, remove_temp_files=remove_temp_files, verbose=verbose,
+                                        overlap=args.overlap, batch_size=args.batch_size, blending=args.blending)
 
     # Save segmentation
     fname_seg = os.path.abspath(os.path.join(output_folder, sct.extract_fname(fname_image)[1] + '_lesionseg' +
@@ -18,7 +18,8 @@ import sys
 import argparse
 
 import sct_utils as sct
-from spinalcordtoolbox.utils import Metavar, SmartFormatter, ActionCreateFolder
+from spinalcordtoolbox.utils import Metavar, SmartFormatter, ActionCreateFolder, type_float_range
+from spinalcordtoolbox.deepseg_sc.core import BATCH_SIZE_2D, BATCH_SIZE
 
 
 def get_parser():
@@ -85,6 +86,33 @@ def get_parser():
         help="Choice of kernel shape for the CNN. Segmentation with 3D kernels is slower than with 2D kernels.",
         choices=('2d', '3d'),
         default="2d")
+    optional.add_argument(
+        "-batch-size",
+        type=int,
+        metavar=Metavar.int,
+        help="Number of axial slices segmented at once by the CNN with 2D kernels. Larger batches are faster, at the "
+             "cost of more memory.",
+        default=BATCH_SIZE_2D)
+    optional.add_argument(
+        "-batch-size-3d",
+        type=int,
+        metavar=Metavar.int,
+        help="Number of patches segmented at once by the CNN with 3D kernels. Larger batches are faster, at the cost "
+             "of more memory.",
+        default=BATCH_SIZE)
+    optional.add_argument(
+        "-overlap",
+        type=type_float_range(0, 1, include_max=False),
+        metavar=Metavar.float,
+        help="Fraction of the patches shared by neighbouring patches with 3D kernels, between 0 and 1 (excluded). "
+             "Larger overlaps are more accurate at the borders of the patches, and slower.",
+        default=0.0)
+    optional.add_argument(
+        "-blending",
+        help="Blending of the predictions of overlapping patches with 3D kernels: with weights higher at the center "
+             "of the patches (gaussian), or uniform (constant).",
+        choices=('gaussian', 'constant'),
+        default='gaussian')
     optional.add_argument(
         "-ofolder",
         metavar=Metavar.str,
@@ -189,7 +217,9 @@ def main():
     im_seg, im_image_RPI_upsamp, im_seg_RPI_upsamp = \
         deep_segmentation_spinalcord(im_image.copy(), contrast_type, ctr_algo=ctr_algo,
                                      ctr_file=manual_centerline_fname, brain_bool=brain_bool, kernel_size=kernel_size,
-                                     threshold_seg=threshold, remove_temp_files=remove_temp_files, verbose=verbose)
+                                     threshold_seg=threshold, remove_temp_files=remove_temp_files, verbose=verbose,
+                                     batch_size=args.batch_size, overlap=args.overlap,
+                                     batch_size_3d=args.batch_size_3d, blending=args.blending)
 
     # Save segmentation
     fname_seg = os.path.abspath(os.path.join(output_folder, sct.extract_fname(fname_image)[1] + '_seg' +
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+#
+# Local inference server of the deepseg tools
+#
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+
+from __future__ import absolute_import, division
+
+import sys
+import argparse
+import sct_utils as sct
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Local inference server of sct_deepseg_sc, sct_deepseg_gm and sct_deepseg_lesion.\n\n'
+                    'The server keeps the CNN models loaded across commands: while it is running, the deepseg '
+                    'commands of the user\nsend their data to the server instead of loading Keras and the models '
+                    'themselves, which saves their startup\nwhen processing many subjects. The server handles one '
+                    'prediction at a time. The environment variable\nSCT_DEEPSEG_SERVER=0 disables its use by a '
+                    'command, and SCT_DEEPSEG_CACHE_SIZE sets the number of models kept loaded\n(default: 4).\n\n'
+                    'The socket of the server is in $XDG_RUNTIME_DIR/sct_deepseg (~/.cache/sct/sct_deepseg if '
+                    'XDG_RUNTIME_DIR is not set).\nThe server is not used if this folder, the socket or the '
+                    'authentication key is accessible by other users.',
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog='Examples:\n'
+               'sct_deepseg_server &\n'
+               'sct_deepseg_server -status\n'
+               'sct_deepseg_server -stop'
+    )
+    parser.add_argument('-status',
+                        action='store_true',
+                        help='Display the models loaded by the running server')
+    parser.add_argument('-stop',
+                        action='store_true',
+                        help='Stop the running server')
+    return parser
+
+
+def main(args):
+    from spinalcordtoolbox import deepseg_models
+
+    if args.status or args.stop:
+        try:
+            if args.stop:
+                deepseg_models.request('stop')
+                sct.printv('Inference server stopped')
+            else:
+                status = deepseg_models.request('status')
+                sct.printv('Inference server running (PID {}), models loaded: {}'.format(
+                    status['pid'], ', '.join(str(key[:4]) for key in status['models']) or 'none'))
+        except (IOError, OSError, EOFError) as e:
+            sct.printv('The inference server is not running ({})'.format(e), type='warning')
+            sys.exit(1)
+        return
+
+    deepseg_models.serve()
+
+
+if __name__ == '__main__':
+    sct.init_sct()
+    parser = get_parser()
+    main(parser.parse_args())
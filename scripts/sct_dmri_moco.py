@@ -34,7 +34,6 @@ from __future__ import division, absolute_import
 
 import sys, os, time, math
 import importlib
-from tqdm import tqdm
 import numpy as np
 
 import sct_utils as sct
@@ -42,7 +41,7 @@ import msct_moco as moco
 import sct_dmri_separate_b0_and_dwi
 from sct_convert import convert
 from spinalcordtoolbox.image import Image
-from sct_image import split_data, concat_data
+from spinalcordtoolbox import moco as sct_moco
 from msct_parser import Parser
 
 
@@ -71,6 +70,8 @@ class Param:
         self.metric = 'MI'  # metric: MI, MeanSquares, CC
         self.sampling = '0.2'  # sampling rate used for registration metric
         self.interp = 'spline'  # nn, linear, spline
+        self.engine = 'ants'  # engine used to apply the transformations: ants, native
+        self.estimator = 'ants'  # estimator of the slice-wise translations: ants, native
         self.run_eddy = 0
         self.mat_eddy = ''
         self.min_norm = 0.001
@@ -78,6 +79,7 @@ class Param:
         self.bval_min = 100  # in case user does not have min bvalues at 0, set threshold (where csf disapeared).
         self.otsu = 0  # use otsu algorithm to segment dwi data for better moco. Value coresponds to data threshold. For no segmentation set to 0.
         self.iterAvg = 1  # iteratively average target image for more robust moco
+        self.n_jobs = 1  # number of volumes registered in parallel. 0: use all available CPUs.
         self.is_sagittal = False  # if True, then split along Z (right-left) and register each 2D slice (vs. 3D volume)
 # Note: this feature is currently ONLY supported by sct_fmri_moco (not here).
 
@@ -157,7 +159,9 @@ def get_parser():
                                                 "smooth [mm]: Smoothing kernel. Default=" + param_default.smooth + ".\n"
                                                   "metric {MI, MeanSquares, CC}: Metric used for registration. Default=" + param_default.metric + ".\n"
                                                   "gradStep [float]: Searching step used by registration algorithm. The higher the more deformation allowed. Default=" + param_default.gradStep + ".\n"
-                                                    "sample [0-1]: Sampling rate used for registration metric. Default=" + param_default.sampling + ".\n",
+                                                    "sample [0-1]: Sampling rate used for registration metric. Default=" + param_default.sampling + ".\n"
+                                  "engine {ants, native}: Engine used to apply the transformations (native: in-process, without isct_antsApplyTransforms). Default=" + param_default.engine + ".\n"
+                                  "estimator {ants, native}: Estimator of the slice-wise translations (native: in-process, FFT phase correlation and Gauss-Newton refinement of each slice, then polynomial fit along z, without isct_antsSliceRegularizedRegistration; axial data only). Default=" + param_default.estimator + ".\n",
                       mandatory=False)
     parser.add_option(name='-thr',
                       type_value='float',
@@ -183,6 +187,13 @@ def get_parser():
                       default_value='./',
                       example='dmri_moco_results/')
     parser.usage.addSection('MISC')
+    parser.add_option(name="-cpu",
+                      type_value="int",
+                      description="Number of volumes registered in parallel (one process each). With iterative "
+                                  "averaging, the volumes averaged with the target are registered first, one after the "
+                                  "other. 0: use all available CPUs.",
+                      mandatory=False,
+                      default_value=param_default.n_jobs)
     parser.add_option(name="-r",
                       type_value="multiple_choice",
                       description='Remove temporary files.',
@@ -236,6 +247,7 @@ def main(args=None):
         path_out = arguments['-ofolder']
     if '-r' in arguments:
         param.remove_temp_files = int(arguments['-r'])
+    param.n_jobs = int(arguments['-cpu'])
     param.verbose = int(arguments.get('-v'))
     sct.init_sct(log_level=param.verbose, update=True)  # Update log level
 
@@ -320,7 +332,6 @@ def dmri_moco(param):
     ext_data = '.nii.gz' # workaround "too many open files" by slurping the data
     mat_final = 'mat_final/'
     file_dwi_group = 'dwi_averaged_groups.nii'
-    ext_mat = 'Warp.nii.gz'  # warping field
 
     # Get dimensions of data
     sct.printv('\nGet dimensions of data...', param.verbose)
@@ -338,27 +349,19 @@ def dmri_moco(param):
 
     # Prepare NIFTI (mean/groups...)
     #===================================================================================================================
-    # Split into T dimension
-    sct.printv('\nSplit along T dimension...', param.verbose)
-    im_data_split_list = split_data(im_data, 3)
-    for im in im_data_split_list:
-        x_dirname, x_basename, x_ext = sct.extract_fname(im.absolutepath)
-        im.absolutepath = os.path.join(x_dirname, x_basename + ".nii.gz")
-        im.save()
+    # The b=0 images and the means of the DWI groups are obtained by indexing the (memory-mapped) 4D data: the only
+    # files written are the inputs of moco.
+    data = im_data.data
+
+    def save_volumes(data_out, fname):
+        """Save volume(s) with the header of the input data"""
+        Image(data_out, hdr=im_data.hdr.copy()).save(fname, verbose=0)
 
     # Merge b=0 images
     sct.printv('\nMerge b=0...', param.verbose)
-    im_b0_list = []
-    for it in range(nb_b0):
-        im_b0_list.append(im_data_split_list[index_b0[it]])
-    im_b0_out = concat_data(im_b0_list, 3).save(file_b0)
+    save_volumes(data[..., index_b0], file_b0)
     sct.printv(('  File created: ' + file_b0), param.verbose)
 
-    # Average b=0 images
-    sct.printv('\nAverage b=0...', param.verbose)
-    file_b0_mean = sct.add_suffix(file_b0, '_mean')
-    sct.run(['sct_maths', '-i', file_b0, '-o', file_b0_mean, '-mean', 't'], param.verbose)
-
     # Number of DWI groups
     nb_groups = int(math.floor(nb_dwi / param.group_size))
 
@@ -373,36 +376,14 @@ def dmri_moco(param):
         nb_groups += 1
         group_indexes.append(index_dwi[len(index_dwi) - nb_remaining:len(index_dwi)])
 
+    # Average DW images within groups, and merge groups means
+    sct.printv('\nAverage DW images within groups...', param.verbose)
+    data_dwi_group = np.stack([np.mean(data[..., index_dwi_i], axis=3) for index_dwi_i in group_indexes], axis=3)
+    save_volumes(data_dwi_group, file_dwi_group)
+    # the mean of the first group is the target of the registration of DWI groups
     file_dwi_dirname, file_dwi_basename, file_dwi_ext = sct.extract_fname(file_dwi)
-    # DWI groups
-    file_dwi_mean = []
-    for iGroup in tqdm(range(nb_groups), unit='iter', unit_scale=False, desc="Merge within groups", ascii=True, ncols=80):
-        # get index
-        index_dwi_i = group_indexes[iGroup]
-        nb_dwi_i = len(index_dwi_i)
-        # Merge DW Images
-        file_dwi_merge_i = os.path.join(file_dwi_dirname, file_dwi_basename + '_' + str(iGroup) + ext_data)
-        im_dwi_list = []
-        for it in range(nb_dwi_i):
-            im_dwi_list.append(im_data_split_list[index_dwi_i[it]])
-        im_dwi_out = concat_data(im_dwi_list, 3).save(file_dwi_merge_i)
-        # Average DW Images
-        file_dwi_mean_i = os.path.join(file_dwi_dirname, file_dwi_basename + '_mean_' + str(iGroup) + ext_data)
-        file_dwi_mean.append(file_dwi_mean_i)
-        sct.run(["sct_maths", "-i", file_dwi_merge_i, "-o", file_dwi_mean[iGroup], "-mean", "t"], 0)
-
-    # Merge DWI groups means
-    sct.printv('\nMerging DW files...', param.verbose)
-    # file_dwi_groups_means_merge = 'dwi_averaged_groups'
-    im_dw_list = []
-    for iGroup in range(nb_groups):
-        im_dw_list.append(file_dwi_mean[iGroup])
-    im_dw_out = concat_data(im_dw_list, 3).save(file_dwi_group)
-
-    # Average DW Images
-    # TODO: USEFULL ???
-    sct.printv('\nAveraging all DW images...', param.verbose)
-    sct.run(["sct_maths", "-i", file_dwi_group, "-o", file_dwi_group + '_mean' + ext_data, "-mean", "t"], param.verbose)
+    file_dwi_mean_0 = os.path.join(file_dwi_dirname, file_dwi_basename + '_mean_' + str(0) + ext_data)
+    save_volumes(data_dwi_group[..., 0], file_dwi_mean_0)
 
     # segment dwi images using otsu algorithm
     if param.otsu:
@@ -431,47 +412,46 @@ def dmri_moco(param):
     if index_dwi[0] != 0:
         # If first DWI is not the first volume (most common), then there is a least one b=0 image before. In that case
         # select it as the target image for registration of all b=0
-        param_moco.file_target = os.path.join(file_data_dirname, file_data_basename + '_T' + str(index_b0[index_dwi[0] - 1]).zfill(4) + ext_data)
+        index_b0_target = index_b0[index_dwi[0] - 1]
     else:
         # If first DWI is the first volume, then the target b=0 is the first b=0 from the index_b0.
-        param_moco.file_target = os.path.join(file_data_dirname, file_data_basename + '_T' + str(index_b0[0]).zfill(4) + ext_data)
+        index_b0_target = index_b0[0]
+    param_moco.file_target = os.path.join(file_data_dirname, file_data_basename + '_T' + str(index_b0_target).zfill(4) + ext_data)
+    save_volumes(data[..., index_b0_target], param_moco.file_target)
 
     param_moco.path_out = ''
     param_moco.todo = 'estimate'
     param_moco.mat_moco = 'mat_b0groups'
-    file_mat_b0 = moco.moco(param_moco)
+    moco.moco(param_moco)
 
     # Estimate moco on dwi groups
     sct.printv('\n-------------------------------------------------------------------------------', param.verbose)
     sct.printv('  Estimating motion on DW images...', param.verbose)
     sct.printv('-------------------------------------------------------------------------------', param.verbose)
     param_moco.file_data = file_dwi_group
-    param_moco.file_target = file_dwi_mean[0]  # target is the first DW image (closest to the first b=0)
+    param_moco.file_target = file_dwi_mean_0  # target is the first DW image (closest to the first b=0)
     param_moco.path_out = ''
     param_moco.todo = 'estimate_and_apply'
     param_moco.mat_moco = 'mat_dwigroups'
-    file_mat_dwi = moco.moco(param_moco)
+    moco.moco(param_moco)
 
     # create final mat folder
     sct.create_folder(mat_final)
 
-    # Copy b=0 registration matrices
-    # TODO: use file_mat_b0 and file_mat_dwi instead of the hardcoding below
-    sct.printv('\nCopy b=0 registration matrices...', param.verbose)
-    for it in range(nb_b0):
-        sct.copy('mat_b0groups/' + 'mat.Z0000T' + str(it).zfill(4) + ext_mat,
-                 mat_final + 'mat.Z0000T' + str(index_b0[it]).zfill(4) + ext_mat)
-
-    # Copy DWI registration matrices
-    sct.printv('\nCopy DWI registration matrices...', param.verbose)
-    for iGroup in range(nb_groups):
-        for dwi in range(len(group_indexes[iGroup])):  # we cannot use enumerate because group_indexes has 2 dim.
-            sct.copy('mat_dwigroups/' + 'mat.Z0000T' + str(iGroup).zfill(4) + ext_mat,
-                     mat_final + 'mat.Z0000T' + str(group_indexes[iGroup][dwi]).zfill(4) + ext_mat)
+    # Gather the motion parameters of all volumes: each b=0 image gets its own, and each DW image gets the ones of its
+    # group
+    sct.printv('\nGather motion parameters of b=0 and DWI groups...', param.verbose)
+    params_b0 = sct_moco.MotionParams.load(os.path.join('mat_b0groups', moco.FILE_PARAMS))
+    params_dwi = sct_moco.MotionParams.load(os.path.join('mat_dwigroups', moco.FILE_PARAMS))
+    displacement = np.zeros((nt,) + params_dwi.displacement.shape[1:])
+    displacement[index_b0] = params_b0.displacement
+    displacement[np.concatenate(group_indexes)] = np.repeat(params_dwi.displacement,
+                                                            [len(index) for index in group_indexes], axis=0)
+    sct_moco.MotionParams(displacement, params_dwi.header).save(os.path.join(mat_final, moco.FILE_PARAMS))
 
     # Spline Regularization along T
     if param.spline_fitting:
-        moco.spline(mat_final, nt, nz, param.verbose, np.array(index_b0), param.plot_graph)
+        moco.spline(mat_final, param.verbose, np.array(index_b0), param.plot_graph)
 
     # combine Eddy Matrices
     if param.run_eddy:
@@ -484,7 +464,7 @@ def dmri_moco(param):
     sct.printv('  Apply moco', param.verbose)
     sct.printv('-------------------------------------------------------------------------------', param.verbose)
     param_moco.file_data = file_data
-    param_moco.file_target = os.path.join(file_dwi_dirname, file_dwi_basename + '_mean_' + str(0) + ext_data)  # reference for reslicing into proper coordinate system
+    param_moco.file_target = file_dwi_mean_0  # reference for reslicing into proper coordinate system
     param_moco.path_out = ''
     param_moco.mat_moco = mat_final
     param_moco.todo = 'apply'
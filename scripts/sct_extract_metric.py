@@ -26,7 +26,9 @@ import numpy as np
 
 from spinalcordtoolbox.metadata import read_label_file
 from spinalcordtoolbox.utils import parse_num_list
-from spinalcordtoolbox.aggregate_slicewise import check_labels, extract_metric, save_as_csv, Metric, LabelStruc
+from spinalcordtoolbox.aggregate_slicewise import check_labels, extract_metric_all_labels, save_as_csv, Metric, \
+    LabelStruc
+from spinalcordtoolbox.template import VertLevelIndex
 import sct_utils as sct
 from spinalcordtoolbox.image import Image
 from msct_parser import Parser
@@ -315,9 +317,9 @@ def main(fname_data, path_label, method, slices, levels, fname_output, labels_us
     labels = np.concatenate(labels_tmp[:], 3)  # labels: (x,y,z,label)
     # Load vertebral levels
     if vertebral_levels:
-        im_vertebral_labeling = Image(fname_vertebral_labeling).change_orientation("RPI")
+        vert_level_index = VertLevelIndex(Image(fname_vertebral_labeling).change_orientation("RPI"))
     else:
-        im_vertebral_labeling = None
+        vert_level_index = None
 
     # Get dimensions of data and labels
     nx, ny, nz = data.data.shape
@@ -334,13 +336,14 @@ def main(fname_data, path_label, method, slices, levels, fname_output, labels_us
                                      map_cluster=None)
         labels_id_user = [99]
 
+    # Estimate all labels in a single pass over the data
+    sct.printv('Estimation for labels: ' + ', '.join([label_struc[i].name for i in labels_id_user]), verbose)
+    agg_metrics = extract_metric_all_labels(data, labels=labels, ids_label=labels_id_user, slices=slices,
+                                            levels=levels, perslice=perslice, perlevel=perlevel,
+                                            vert_level=vert_level_index, method=method, label_struc=label_struc,
+                                            indiv_labels_ids=indiv_labels_ids)
     for id_label in labels_id_user:
-        sct.printv('Estimation for label: '+label_struc[id_label].name, verbose)
-        agg_metric = extract_metric(data, labels=labels, slices=slices, levels=levels, perslice=perslice,
-                                    perlevel=perlevel, vert_level=im_vertebral_labeling, method=method,
-                                    label_struc=label_struc, id_label=id_label, indiv_labels_ids=indiv_labels_ids)
-
-        save_as_csv(agg_metric, fname_output, fname_in=fname_data, append=append_csv)
+        save_as_csv(agg_metrics[id_label], fname_output, fname_in=fname_data, append=append_csv)
         append_csv = True  # when looping across labels, need to append results in the same file
     sct.display_open(fname_output)
 
@@ -25,6 +25,7 @@ import msct_moco as moco
 import sct_maths
 from sct_convert import convert
 from spinalcordtoolbox.image import Image
+from spinalcordtoolbox import moco as sct_moco
 from sct_image import split_data, concat_data
 from msct_parser import Parser
 
@@ -54,6 +55,8 @@ class Param:
         self.metric = 'MeanSquares'  # metric: MI, MeanSquares, CC
         self.sampling = '0.2'  # sampling rate used for registration metric
         self.interp = 'spline'  # nn, linear, spline
+        self.engine = 'ants'  # engine used to apply the transformations: ants, native
+        self.estimator = 'ants'  # estimator of the slice-wise translations: ants, native
         self.run_eddy = 0
         self.mat_eddy = ''
         self.min_norm = 0.001
@@ -61,6 +64,7 @@ class Param:
         self.bval_min = 100  # in case user does not have min bvalues at 0, set threshold (where csf disappeared).
         self.otsu = 0  # use otsu algorithm to segment dwi data for better moco. Value coresponds to data threshold. For no segmentation set to 0.
         self.iterAvg = 1  # iteratively average target image for more robust moco
+        self.n_jobs = 1  # number of volumes registered in parallel. 0: use all available CPUs.
         self.num_target = '0'
         self.is_sagittal = False  # if True, then split along Z (right-left) and register each 2D slice (vs. 3D volume)
         self.output_motion_param = True  # if True, the motion parameters are outputted
@@ -125,6 +129,8 @@ The outputs of the motion correction process are:
                                   "metric {MI, MeanSquares, CC}: Metric used for registration. Default=" + param_default.metric + ".\n"
                                   "gradStep [float]: Searching step used by registration algorithm. The higher the more deformation allowed. Default=" + param_default.gradStep + ".\n"
                                   "sampling [0-1]: Sampling rate used for registration metric. Default=" + param_default.sampling + ".\n"
+                                  "engine {ants, native}: Engine used to apply the transformations (native: in-process, without isct_antsApplyTransforms). Default=" + param_default.engine + ".\n"
+                                  "estimator {ants, native}: Estimator of the slice-wise translations (native: in-process, FFT phase correlation and Gauss-Newton refinement of each slice, then polynomial fit along z, without isct_antsSliceRegularizedRegistration; axial data only). Default=" + param_default.estimator + ".\n"
                                   "numTarget [int]: Target volume or group (starting with 0). Default=" + param_default.num_target + ".\n"
                                   "iterAvg [int]: Iterative averaging: Target volume is a weighted average of the previously-registered volumes. Default=" + str(param_default.iterAvg) + ".\n",
                       mandatory=False)
@@ -139,6 +145,13 @@ The outputs of the motion correction process are:
                       mandatory=False,
                       default_value='linear',
                       example=['nn', 'linear', 'spline'])
+    parser.add_option(name="-cpu",
+                      type_value="int",
+                      description="Number of volumes registered in parallel (one process each). With iterative "
+                                  "averaging, the volumes averaged with the target are registered first, one after the "
+                                  "other. 0: use all available CPUs.",
+                      mandatory=False,
+                      default_value=param_default.n_jobs)
     parser.add_option(name="-r",
                       type_value="multiple_choice",
                       description="""Remove temporary files.""",
@@ -184,6 +197,7 @@ def main(args=None):
         path_out = arguments['-ofolder']
     if '-r' in arguments:
         param.remove_temp_files = int(arguments['-r'])
+    param.n_jobs = int(arguments['-cpu'])
     param.verbose = int(arguments.get('-v'))
     sct.init_sct(log_level=param.verbose, update=True)  # Update log level
 
@@ -241,7 +255,6 @@ def fmri_moco(param):
 
     file_data = "fmri.nii"
     mat_final = 'mat_final/'
-    ext_mat = 'Warp.nii.gz'  # warping field
 
     # Get dimensions of data
     sct.printv('\nGet dimensions of data...', param.verbose)
@@ -347,7 +360,7 @@ def fmri_moco(param):
     param_moco.path_out = ''
     param_moco.todo = 'estimate_and_apply'
     param_moco.mat_moco = 'mat_groups'
-    file_mat = moco.moco(param_moco)
+    moco.moco(param_moco)
 
     # TODO: if g=1, no need to run the block below (already applied)
     if param.group_size == 1:
@@ -357,19 +370,11 @@ def fmri_moco(param):
         # create final mat folder
         sct.create_folder(mat_final)
 
-        # Copy registration matrices
-        sct.printv('\nCopy transformations...', param.verbose)
-        for iGroup in range(nb_groups):
-            for data in range(len(group_indexes[iGroup])):  # we cannot use enumerate because group_indexes has 2 dim.
-                # fetch all file_mat_z for given t-group
-                list_file_mat_z = file_mat[:, iGroup]
-                # loop across file_mat_z and copy to mat_final folder
-                for file_mat_z in list_file_mat_z:
-                    # we want to copy 'mat_groups/mat.ZXXXXTYYYYWarp.nii.gz' --> 'mat_final/mat.ZXXXXTYYYZWarp.nii.gz'
-                    # Notice the Y->Z in the under the T index: the idea here is to use the single matrix from each group,
-                    # and apply it to all images belonging to the same group.
-                    sct.copy(file_mat_z + ext_mat,
-                             mat_final + file_mat_z[11:20] + 'T' + str(group_indexes[iGroup][data]).zfill(4) + ext_mat)
+        # Each volume gets the motion parameters of its group
+        sct.printv('\nCopy motion parameters of groups...', param.verbose)
+        params_groups = sct_moco.MotionParams.load(os.path.join(param_moco.mat_moco, moco.FILE_PARAMS))
+        sct_moco.MotionParams(np.repeat(params_groups.displacement, [len(index) for index in group_indexes], axis=0),
+                              params_groups.header).save(os.path.join(mat_final, moco.FILE_PARAMS))
 
         # Apply moco on all fmri data
         sct.printv('\n-------------------------------------------------------------------------------', param.verbose)
@@ -382,7 +387,7 @@ def fmri_moco(param):
         param_moco.path_out = ''
         param_moco.mat_moco = mat_final
         param_moco.todo = 'apply'
-        file_mat = moco.moco(param_moco)
+        moco.moco(param_moco)
 
     # copy geometric information from header
     # NB: this is required because WarpImageMultiTransform in 2D mode wrongly sets pixdim(3) to "1".
@@ -393,47 +398,17 @@ def fmri_moco(param):
 
     # Extract and output the motion parameters
     if param.output_motion_param:
-        from sct_image import multicomponent_split
         import csv
-        #files_warp = []
-        files_warp_X, files_warp_Y = [], []
-        moco_param = []
-        for fname_warp in file_mat[0]:
-            # Cropping the image to keep only one voxel in the XY plane
-            im_warp = Image(fname_warp + ext_mat)
-            im_warp.data = np.expand_dims(np.expand_dims(im_warp.data[0, 0, :, :, :], axis=0), axis=0)
-
-            # These three lines allow to generate one file instead of two, containing X, Y and Z moco parameters
-            #fname_warp_crop = fname_warp + '_crop_' + ext_mat
-            #files_warp.append(fname_warp_crop)
-            #im_warp.save(fname_warp_crop)
-
-            # Separating the three components and saving X and Y only (Z is equal to 0 by default).
-            im_warp_XYZ = multicomponent_split(im_warp)
-
-            fname_warp_crop_X = fname_warp + '_crop_X_' + ext_mat
-            im_warp_XYZ[0].save(fname_warp_crop_X)
-            files_warp_X.append(fname_warp_crop_X)
-
-            fname_warp_crop_Y = fname_warp + '_crop_Y_' + ext_mat
-            im_warp_XYZ[1].save(fname_warp_crop_Y)
-            files_warp_Y.append(fname_warp_crop_Y)
-
-            # Calculating the slice-wise average moco estimate to provide a QC file
-            moco_param.append([np.mean(np.ravel(im_warp_XYZ[0].data)), np.mean(np.ravel(im_warp_XYZ[1].data))])
-
-        # These two lines allow to generate one file instead of two, containing X, Y and Z moco parameters
-        #im_warp_concat = concat_data(files_warp, dim=3)
-        #im_warp_concat.save('fmri_moco_params.nii')
-
-        # Concatenating the moco parameters into a time series for X and Y components.
-        im_warp_concat = concat_data(files_warp_X, dim=3)
-        im_warp_concat.save('fmri_moco_params_X.nii')
-
-        im_warp_concat = concat_data(files_warp_Y, dim=3)
-        im_warp_concat.save('fmri_moco_params_Y.nii')
+        # X and Y translations of each slice (Z is equal to 0 by default), as time series of one voxel in the XY plane
+        motion_params = sct_moco.MotionParams.load(os.path.join(param_moco.mat_moco, moco.FILE_PARAMS))
+        for i, name in enumerate(['X', 'Y']):
+            im_param = Image(motion_params.displacement[..., i].T[np.newaxis, np.newaxis].astype(np.float32),
+                             hdr=motion_params.header.copy())
+            im_param.hdr.set_data_dtype(np.float32)
+            im_param.save('fmri_moco_params_' + name + '.nii')
 
         # Writing a TSV file with the slicewise average estimate of the moco parameters, as it is a useful QC file.
+        moco_param = motion_params.displacement[..., :2].mean(axis=1)
         with open('fmri_moco_params.tsv', 'wt') as out_file:
             tsv_writer = csv.writer(out_file, delimiter='\t')
             tsv_writer.writerow(['X', 'Y'])
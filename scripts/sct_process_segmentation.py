@@ -27,6 +27,8 @@ from spinalcordtoolbox import process_seg
 from spinalcordtoolbox.aggregate_slicewise import aggregate_per_slice_or_level, save_as_csv, func_wa, func_std, \
     func_sum, _merge_dict
 from spinalcordtoolbox.utils import parse_num_list
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.template import VertLevelIndex
 from spinalcordtoolbox.centerline.core import ParamCenterline
 from spinalcordtoolbox.reports.qc import generate_qc
 
@@ -117,6 +119,20 @@ def get_parser():
                       description='Degree of smoothing for centerline fitting. Only use with -centerline-algo {bspline, linear}.',
                       mandatory=False,
                       default_value=30)
+    parser.add_option(name='-engine',
+                      type_value='multiple_choice',
+                      description='Method used to compute the morphometric measures on each slice. regionprops: '
+                                  'on the binarized slice upsampled 5x. moments: from the image moments of the partial '
+                                  'volume segmentation at native resolution (faster, lower memory).',
+                      mandatory=False,
+                      example=['regionprops', 'moments'],
+                      default_value='regionprops')
+    parser.add_option(name='-cpu',
+                      type_value='int',
+                      description='Number of processes used to compute the slice-wise morphometric measures. 0: use '
+                                  'all available CPUs.',
+                      mandatory=False,
+                      default_value=1)
     parser.add_option(name='-qc',
                       type_value='folder_creation',
                       description='The path where the quality control generated content will be saved',
@@ -262,6 +278,8 @@ def main(args):
         algo_fitting=arguments['-centerline-algo'],
         smooth=arguments['-centerline-smooth'],
         minmax=True)
+    n_jobs = int(arguments['-cpu'])
+    engine = arguments['-engine']
     path_qc = arguments.get("-qc", None)
     qc_dataset = arguments.get("-qc-dataset", None)
     qc_subject = arguments.get("-qc-subject", None)
@@ -277,19 +295,26 @@ def main(args):
     metrics, fit_results = process_seg.compute_shape(fname_segmentation,
                                                      angle_correction=angle_correction,
                                                      param_centerline=param_centerline,
-                                                     verbose=verbose)
+                                                     verbose=verbose,
+                                                     n_jobs=n_jobs,
+                                                     engine=engine)
+    # Index the vertebral levels once for all metrics
+    if parse_num_list(vert_levels):
+        vert_level = VertLevelIndex(Image(fname_vert_levels).change_orientation('RPI'))
+    else:
+        vert_level = None
     for key in metrics:
         if key == 'length':
             # For computing cord length, slice-wise length needs to be summed across slices
             metrics_agg[key] = aggregate_per_slice_or_level(metrics[key], slices=parse_num_list(slices),
                                                             levels=parse_num_list(vert_levels), perslice=perslice,
-                                                            perlevel=perlevel, vert_level=fname_vert_levels,
+                                                            perlevel=perlevel, vert_level=vert_level,
                                                             group_funcs=(('SUM', func_sum),))
         else:
             # For other metrics, we compute the average and standard deviation across slices
             metrics_agg[key] = aggregate_per_slice_or_level(metrics[key], slices=parse_num_list(slices),
                                                             levels=parse_num_list(vert_levels), perslice=perslice,
-                                                            perlevel=perlevel, vert_level=fname_vert_levels,
+                                                            perlevel=perlevel, vert_level=vert_level,
                                                             group_funcs=group_funcs)
     metrics_agg_merged = _merge_dict(metrics_agg)
     save_as_csv(metrics_agg_merged, file_out, fname_in=fname_segmentation, append=append)
@@ -16,23 +16,25 @@ import sct_utils as sct
 
 def get_parser():
     parser = argparse.ArgumentParser(
-        description='Generate Quality Control (QC) report following SCT processing.',
+        description='Generate Quality Control (QC) report following SCT processing.\n\n'
+                    'SCT commands render their QC entry before returning. With the environment variable '
+                    'SCT_QC_MODE=queue, they only\nqueue it in the QC folder, to be rendered later with '
+                    '-render-queue. With SCT_QC_MODE=background, the queue is\nrendered by a detached process.',
         formatter_class=argparse.RawTextHelpFormatter,
         epilog='Examples:\n'
                'sct_qc -i t2.nii.gz -s t2_seg.nii.gz -p sct_deepseg_sc\n'
                'sct_qc -i t2.nii.gz -s t2_seg_labeled.nii.gz -p sct_label_vertebrae\n'
-               'sct_qc -i t2.nii.gz -s t2_seg.nii.gz -p sct_deepseg_sc -qc-dataset mydata -qc-subject sub-45'
+               'sct_qc -i t2.nii.gz -s t2_seg.nii.gz -p sct_deepseg_sc -qc-dataset mydata -qc-subject sub-45\n'
+               'sct_qc -qc ./qc -render-queue -cpu 4'
     )
     parser.add_argument('-i',
                         metavar='IMAGE',
-                        help='Input image #1 (mandatory)',
-                        required=True)
+                        help='Input image #1 (mandatory, unless -render-queue)')
     parser.add_argument('-p',
                         help='SCT function associated with the QC report to generate',
                         choices=('sct_propseg', 'sct_deepseg_sc', 'sct_deepseg_gm', 'sct_register_multimodal',
                                  'sct_register_to_template', 'sct_warp_template', 'sct_label_vertebrae',
-                                 'sct_detect_pmj'),
-                        required=True)
+                                 'sct_detect_pmj'))
     parser.add_argument('-s',
                         metavar='SEG',
                         help='Input segmentation',
@@ -57,11 +59,29 @@ def get_parser():
                         help='If provided, this string will be mentioned in the QC report as the subject the process '
                              'was run on',
                         required=False)
+    parser.add_argument('-render-queue',
+                        action='store_true',
+                        help='Render all the entries queued in the QC folder (see SCT_QC_MODE above), then update the '
+                             'report')
+    parser.add_argument('-cpu',
+                        metavar='CPU',
+                        type=int,
+                        help='Number of processes rendering queued entries in parallel. 0: use all available CPUs.',
+                        default=1)
     return parser
 
 
 def main(args):
-    from spinalcordtoolbox.reports.qc import generate_qc
+    from spinalcordtoolbox.reports.qc import generate_qc, render_queue, display_open_syntax
+
+    if args.render_queue:
+        nb_rendered, nb_failed = render_queue(args.qc, n_jobs=args.cpu)
+        sct.printv('Rendered {} queued QC entries'.format(nb_rendered))
+        if nb_failed:
+            sct.printv('{} queued QC entries could not be rendered'.format(nb_failed), type='warning')
+        if nb_rendered:
+            display_open_syntax(args.qc)
+        return
 
     # Build args list (for display)
     args_disp = '-i ' + args.i
@@ -83,4 +103,6 @@ if __name__ == '__main__':
     sct.init_sct()
     parser = get_parser()
     arguments = parser.parse_args()
+    if not arguments.render_queue and (arguments.i is None or arguments.p is None):
+        parser.error('-i and -p are required, unless -render-queue')
     main(arguments)
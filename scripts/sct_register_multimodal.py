@@ -195,6 +195,12 @@ def get_parser(paramregmulti=None):
                       type_value='str',
                       description='If provided, this string will be mentioned in the QC report as the subject the process was run on',
                       )
+    parser.add_option(name="-cpu",
+                      type_value="int",
+                      description="Number of slices registered in parallel with slicewise=1 and an ANTs algorithm "
+                                  "(translation, rigid, affine, syn, bsplinesyn). 0: use all available CPUs.",
+                      mandatory=False,
+                      default_value=1)
     parser.add_option(name="-r",
                       type_value="multiple_choice",
                       description="""Remove temporary files.""",
@@ -220,6 +226,7 @@ class Param:
         self.outSuffix = "_reg"
         self.padding = 5
         self.remove_temp_files = 1
+        self.n_jobs = 1
 
 
 # MAIN
@@ -318,6 +325,7 @@ def main(args=None):
     param.padding = padding
     param.fname_mask = fname_mask
     param.remove_temp_files = remove_temp_files
+    param.n_jobs = int(arguments['-cpu'])
 
     # Get if input is 3D
     sct.printv('\nCheck if input data are 3D...', verbose)
@@ -46,6 +46,7 @@ class Param:
         self.fname_mask = ''  # this field is needed in the function register@sct_register_multimodal
         self.padding = 10  # this field is needed in the function register@sct_register_multimodal
         self.verbose = 1  # verbose
+        self.n_jobs = 1  # number of slices registered in parallel (slicewise ANTs steps)
         self.path_template = os.path.join(sct.__data_dir__, 'PAM50')
         self.path_qc = None
         self.zsubsample = '0.25'
@@ -180,6 +181,12 @@ def get_parser():
                       type_value="image_nifti",
                       description="File name of ground-truth template cord segmentation (binary nifti).",
                       mandatory=False)
+    parser.add_option(name="-cpu",
+                      type_value="int",
+                      description="Number of slices registered in parallel by the steps with slicewise=1 and an ANTs "
+                                  "algorithm. 0: use all available CPUs.",
+                      mandatory=False,
+                      default_value=param.n_jobs)
     parser.add_option(name="-r",
                       type_value="multiple_choice",
                       description="""Remove temporary files.""",
@@ -233,6 +240,7 @@ def main(args=None):
     contrast_template = arguments['-c']
     ref = arguments['-ref']
     param.remove_temp_files = int(arguments.get('-r'))
+    param.n_jobs = int(arguments.get('-cpu'))
     verbose = int(arguments.get('-v'))
     sct.init_sct(log_level=verbose, update=True)  # Update log level
     param.verbose = verbose  # TODO: not clean, unify verbose or param.verbose in code, but not both
@@ -154,6 +154,19 @@ def get_parser():
              "\ntemplate_orientation: {0, 1} Disable/Enable orientation of the straight image to be the same as the template. Default=0",
         required=False)
 
+    optional.add_argument(
+        "-cpu",
+        metavar=Metavar.int,
+        type=int,
+        help="Number of processes used to compute the warping fields. 0: use all available CPUs.",
+        required=False,
+        default=1)
+    optional.add_argument(
+        "-engine",
+        help="Engine used to apply the warping fields. 'ants': isct_antsApplyTransforms. 'native': in-process "
+             "resampling with NumPy/SciPy.",
+        choices=("ants", "native"),
+        default="ants")
     optional.add_argument(
         "-x",
         help="Final interpolation.",
@@ -239,8 +252,8 @@ def main(args=None):
     sct.init_sct(log_level=verbose, update=True)  # Update log level
     sc_straight.verbose = verbose
 
-    # if "-cpu-nb" in arguments:
-    #     sc_straight.cpu_number = arguments.cpu-nb)
+    sc_straight.n_jobs = arguments.cpu
+    sc_straight.engine = arguments.engine
     if arguments.disable_straight2curved:
         sc_straight.straight2curved = False
     if arguments.disable_curved2straight:
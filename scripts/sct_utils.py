@@ -643,13 +643,18 @@ def find_file_within_folder(fname, directory, seek_type='file'):
     return all_path
 
 
-def tmp_create(basename=None, verbose=1):
+def tmp_create(basename=None, verbose=1, ram=False):
     """Create temporary folder and return its path
+    :param ram: bool: create the folder in a RAM-backed file system (/dev/shm) if available, for many small files
+    that only need to live during the process.
     """
     prefix = "sct-%s-" % datetime.datetime.now().strftime("%Y%m%d%H%M%S.%f")
     if basename:
         prefix += "%s-" % basename
-    tmpdir = tempfile.mkdtemp(prefix=prefix)
+    if ram and os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        tmpdir = tempfile.mkdtemp(prefix=prefix, dir='/dev/shm')
+    else:
+        tmpdir = tempfile.mkdtemp(prefix=prefix)
     printv('\nCreate temporary folder (%s)...' % tmpdir, verbose)
     return tmpdir
 
@@ -15,7 +15,7 @@ import csv
 import datetime
 import logging
 
-from spinalcordtoolbox.template import get_slices_from_vertebral_levels, get_vertebral_level_from_slice
+from spinalcordtoolbox.template import VertLevelIndex
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.utils import __version__, parse_num_list_inv
 
@@ -84,11 +84,22 @@ def func_map(data, mask, map_clusters):
     """
     # Check number of labels and map_clusters
     assert mask.shape[-1] == len(map_clusters)
+    n_vox = functools.reduce(operator.mul, data.shape, 1)
+    y = np.reshape(data, n_vox)
+    x = np.reshape(mask, (n_vox, mask.shape[mask.ndim-1]))
+    beta = _map_from_gram(np.dot(x.T, x), np.dot(x.T, y), _get_id_clusters(map_clusters))
+    return beta[0], beta
 
-    # Iterate across all labels (excluding the first one) and generate cluster labels. Examples of input/output:
-    #   [[0], [0], [0], [1], [2], [0]] --> [0, 0, 0, 1, 2, 0]
-    #   [[0, 1], [0], [0], [1], [2]] --> [0, 0, 0, 0, 1]
-    #   [[0, 1], [0], [1], [2], [3]] --> [0, 0, 0, 1, 2]
+
+def _get_id_clusters(map_clusters):
+    """
+    Generate the cluster index of each label from map_clusters (see func_map()). Examples of input/output:
+      [[0], [0], [0], [1], [2], [0]] --> [0, 0, 0, 1, 2, 0]
+      [[0, 1], [0], [0], [1], [2]] --> [0, 0, 0, 0, 1]
+      [[0, 1], [0], [1], [2], [3]] --> [0, 0, 0, 1, 2]
+    :param map_clusters: list of list of int
+    :return: list of int
+    """
     possible_clusters = [map_clusters[0]]
     id_clusters = [0]  # this one corresponds to the first cluster
     for i_cluster in map_clusters[1:]:  # skip the first
@@ -100,10 +111,29 @@ def func_map(data, mask, map_clusters):
         if not found_index:
             possible_clusters.append(i_cluster)
             id_clusters.append(possible_clusters.index([i_cluster[0]]))
+    return id_clusters
+
 
-    # Sum across each clustered labels, then concatenate to generate mask_clusters
-    # mask_clusters has dimension: x, y, z, n_clustered_labels, with n_clustered_labels being equal to the number of
-    # clusters that need to be estimated for ML method. Let's assume:
+def _ml_from_gram(xtx, xty):
+    """
+    ML estimation from the Gram matrix of the labels and their product with the measurements (see func_ml()).
+    :param xtx: [nb_labels x nb_labels]: Xt . X
+    :param xty: [nb_labels]: Xt . y
+    :return: beta [nb_labels]
+    """
+    return np.dot(np.linalg.pinv(xtx), xty)
+
+
+def _map_from_gram(xtx, xty, id_clusters):
+    """
+    MAP estimation from the Gram matrix of the labels and their product with the measurements (see func_map()).
+    :param xtx: [nb_labels x nb_labels]: Xt . X
+    :param xty: [nb_labels]: Xt . y
+    :param id_clusters: list of int: cluster index of each label (see _get_id_clusters())
+    :return: beta [nb_labels]
+    """
+    # Sum across each clustered labels: mask_clusters = X . C, with C [nb_labels x n_clustered_labels], with
+    # n_clustered_labels being equal to the number of clusters that need to be estimated for ML method. Let's assume:
     # label_struc = [
     #   LabelStruc(id=0, map_cluster=0),
     #   LabelStruc(id=1, map_cluster=0),
@@ -116,16 +146,11 @@ def func_map(data, mask, map_clusters):
     #   labels_id_user = [0,1], mask_clusters = [np.sum(label[0:2]), label[3], label[4]]
     #   labels_id_user = [3], mask_clusters = [np.sum(label[0:2]), label[3], label[4]]
     #   labels_id_user = [0,1,2,3], mask_clusters = [np.sum(label(0:3)), label[4]]
-    mask_l = []
-    for i_cluster in list(set(id_clusters)):
-        # Get label indices for given cluster
-        id_label_cluster = [i for i in range(len(id_clusters)) if i_cluster == id_clusters[i]]
-        # Sum all labels for this cluster
-        mask_l.append(np.expand_dims(np.sum(mask[..., id_label_cluster], axis=(mask.ndim - 1)), axis=(mask.ndim - 1)))
-    mask_clusters = np.concatenate(mask_l, axis=(mask.ndim-1))
+    list_clusters = sorted(set(id_clusters))
+    clusters = np.array([[float(i_cluster == id_cluster) for i_cluster in list_clusters] for id_cluster in id_clusters])
 
     # Run ML estimation for each clustered labels
-    _, beta_cluster = func_ml(data, mask_clusters)
+    beta_cluster = _ml_from_gram(np.dot(clusters.T, np.dot(xtx, clusters)), np.dot(clusters.T, xty))
 
     # MAP estimation:
     #   y [nb_vox x 1]: measurements vector (to which weights are applied)
@@ -134,14 +159,8 @@ def func_map(data, mask, map_clusters):
     #   beta [nb_labels] = beta_0 + (Xt . X + 1)^(-1) . Xt . (y - X . beta_0): The estimated metric value in each label
     #
     # Note: for simplicity we consider that sigma_noise = sigma_label
-    n_vox = functools.reduce(operator.mul, data.shape, 1)
-    y = np.reshape(data, n_vox)
-    x = np.reshape(mask, (n_vox, mask.shape[mask.ndim-1]))
-    beta_0 = [beta_cluster[id_clusters[i_label]] for i_label in range(mask.shape[-1])]
-    beta = beta_0 + np.dot(np.linalg.pinv(np.dot(x.T, x) + np.diag(np.ones(mask.shape[-1]))),
-                           np.dot(x.T,
-                                  (y - np.dot(x, beta_0))))
-    return beta[0], beta
+    beta_0 = np.array([beta_cluster[id_clusters[i_label]] for i_label in range(len(id_clusters))])
+    return beta_0 + np.dot(np.linalg.pinv(xtx + np.diag(np.ones(len(id_clusters)))), xty - np.dot(xtx, beta_0))
 
 
 def func_ml(data, mask, map_clusters=None):
@@ -163,7 +182,7 @@ def func_ml(data, mask, map_clusters=None):
     #   beta [nb_labels] = (Xt . X)^(-1) . Xt . y: The estimated metric value in each label
     y = np.reshape(data, n_vox)  # [nb_vox x 1]
     x = np.reshape(mask, (n_vox, mask.shape[mask.ndim-1]))
-    beta = np.dot(np.linalg.pinv(np.dot(x.T, x)), np.dot(x.T, y))
+    beta = _ml_from_gram(np.dot(x.T, x), np.dot(x.T, y))
     return beta[0], beta
 
 
@@ -219,12 +238,64 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], persli
     :param levels: List[int]: Vertebral levels to aggregate metric from. It has priority over "slices".
     :param Bool perslice: Aggregate per slice (True) or across slices (False)
     :param Bool perlevel: Aggregate per level (True) or across levels (False). Has priority over "perslice".
-    :param vert_level: Vertebral level. Could be either an Image or a file name.
+    :param vert_level: Vertebral level. Could be either an Image, a file name, or a VertLevelIndex built from it (faster
+    when aggregating several metrics with the same vertebral labeling).
     :param tuple group_funcs: Name and function to apply on metric. Example: (('MEAN', func_wa),)). Note, the function
       has special requirements in terms of i/o. See the definition to func_wa and use it as a template.
     :param map_clusters: list of list of int: See func_map()
     :return: Aggregated metric
     """
+    slicegroups, vertgroups = _get_slicegroups(metric.data.shape[-1], slices=slices, levels=levels, perslice=perslice,
+                                               perlevel=perlevel, vert_level=vert_level)
+    agg_metric = dict((slicegroup, dict()) for slicegroup in slicegroups)
+
+    # loop across slice group
+    for i_group, slicegroup in enumerate(slicegroups):
+        # add level info
+        if vertgroups is None:
+            agg_metric[slicegroup]['VertLevel'] = None
+        else:
+            agg_metric[slicegroup]['VertLevel'] = vertgroups[i_group]
+        # Loop across functions (e.g.: MEAN, STD)
+        for (name, func) in group_funcs:
+            try:
+                data_slicegroup = metric.data[..., slicegroup]  # selection is done in the last dimension
+                if mask is not None:
+                    mask_slicegroup = mask.data[..., slicegroup, :]
+                    agg_metric[slicegroup]['Label'] = mask.label
+                    # Add volume fraction
+                    agg_metric[slicegroup]['Size [vox]'] = np.sum(mask_slicegroup.flatten())
+                else:
+                    mask_slicegroup = np.ones(data_slicegroup.shape)
+                # Ignore nonfinite values (in data and in all labels of the mask)
+                i_nonfinite = np.where(np.isfinite(data_slicegroup) == False)
+                data_slicegroup[i_nonfinite] = 0.
+                mask_slicegroup[i_nonfinite] = 0.
+                # Make sure the number of pixels to extract metrics is not null
+                if mask_slicegroup.sum() == 0:
+                    result = None
+                else:
+                    # Run estimation
+                    result, _ = func(data_slicegroup, mask_slicegroup, map_clusters)
+                    # check if nan
+                    if np.isnan(result):
+                        result = None
+                # here we create a field with name: FUNC(METRIC_NAME). Example: MEAN(CSA)
+                agg_metric[slicegroup]['{}({})'.format(name, metric.label)] = result
+            except Exception as e:
+                logging.warning(e)
+                agg_metric[slicegroup]['{}({})'.format(name, metric.label)] = str(e)
+    return agg_metric
+
+
+def _get_slicegroups(nz, slices=[], levels=[], perslice=None, perlevel=False, vert_level=None):
+    """
+    Get the groups of slices (and associated vertebral levels) on which metrics are aggregated.
+    See aggregate_per_slice_or_level() for the description of the parameters.
+    :param nz: int: number of slices of the metric
+    :return: slicegroups: list of tuple of int. Example: [(0, 1, 2), (3, 4, 5)]
+    :return: vertgroups: list of tuple of int, or None if aggregation is not based on levels. Example: [(2,), (3,)]
+    """
     # If user neither specified slices nor levels, set perslice=True, otherwise, the output will likely contain nan
     # because in many cases the segmentation does not span the whole I-S dimension.
     if perslice is None:
@@ -234,15 +305,15 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], persli
             perslice = False
 
     # if slices is empty, select all available slices from the metric
-    ndim = metric.data.ndim
     if not slices:
-        slices = range(metric.data.shape[ndim-1])
+        slices = range(nz)
 
     # aggregation based on levels
     if levels:
-        im_vert_level = Image(vert_level).change_orientation('RPI')
+        if not isinstance(vert_level, VertLevelIndex):
+            vert_level = VertLevelIndex(Image(vert_level).change_orientation('RPI'))
         # slicegroups = [(0, 1, 2), (3, 4, 5), (6, 7, 8)]
-        slicegroups = [tuple(get_slices_from_vertebral_levels(im_vert_level, level)) for level in levels]
+        slicegroups = [tuple(vert_level.get_slices(level)) for level in levels]
         if perlevel:
             # vertgroups = [(2,), (3,), (4,)]
             vertgroups = [tuple([level]) for level in levels]
@@ -250,7 +321,7 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], persli
             # slicegroups = [(0,), (1,), (2,), (3,), (4,), (5,), (6,), (7,), (8,)]
             slicegroups = [tuple([i]) for i in functools.reduce(operator.concat, slicegroups)]  # reduce to individual tuple
             # vertgroups = [(2,), (2,), (2,), (3,), (3,), (3,), (4,), (4,), (4,)]
-            vertgroups = [tuple([get_vertebral_level_from_slice(im_vert_level, i[0])]) for i in slicegroups]
+            vertgroups = [tuple([vert_level.get_level(i[0])]) for i in slicegroups]
         # output aggregate metric across levels
         else:
             # slicegroups = [(0, 1, 2, 3, 4, 5, 6, 7, 8)]
@@ -266,54 +337,7 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], persli
         else:
             # slicegroups = [(0, 1, 2, 3, 4, 5, 6, 7, 8)]
             slicegroups = [tuple(slices)]
-    agg_metric = dict((slicegroup, dict()) for slicegroup in slicegroups)
-
-    # loop across slice group
-    for slicegroup in slicegroups:
-        # add level info
-        if vertgroups is None:
-            agg_metric[slicegroup]['VertLevel'] = None
-        else:
-            agg_metric[slicegroup]['VertLevel'] = vertgroups[slicegroups.index(slicegroup)]
-        # Loop across functions (e.g.: MEAN, STD)
-        for (name, func) in group_funcs:
-            try:
-                data_slicegroup = metric.data[..., slicegroup]  # selection is done in the last dimension
-                if mask is not None:
-                    mask_slicegroup = mask.data[..., slicegroup, :]
-                    agg_metric[slicegroup]['Label'] = mask.label
-                    # Add volume fraction
-                    agg_metric[slicegroup]['Size [vox]'] = np.sum(mask_slicegroup.flatten())
-                else:
-                    mask_slicegroup = np.ones(data_slicegroup.shape)
-                # Ignore nonfinite values
-                i_nonfinite = np.where(np.isfinite(data_slicegroup) == False)
-                data_slicegroup[i_nonfinite] = 0.
-                # TODO: the lines below could probably be done more elegantly
-                if mask_slicegroup.ndim == data_slicegroup.ndim + 1:
-                    arr_tmp_concat = []
-                    for i in range(mask_slicegroup.shape[-1]):
-                        arr_tmp = np.reshape(mask_slicegroup[..., i], data_slicegroup.shape)
-                        arr_tmp[i_nonfinite] = 0.
-                        arr_tmp_concat.append(np.expand_dims(arr_tmp, axis=(mask_slicegroup.ndim-1)))
-                    mask_slicegroup = np.concatenate(arr_tmp_concat, axis=(mask_slicegroup.ndim-1))
-                else:
-                    mask_slicegroup[i_nonfinite] = 0.
-                # Make sure the number of pixels to extract metrics is not null
-                if mask_slicegroup.sum() == 0:
-                    result = None
-                else:
-                    # Run estimation
-                    result, _ = func(data_slicegroup, mask_slicegroup, map_clusters)
-                    # check if nan
-                    if np.isnan(result):
-                        result = None
-                # here we create a field with name: FUNC(METRIC_NAME). Example: MEAN(CSA)
-                agg_metric[slicegroup]['{}({})'.format(name, metric.label)] = result
-            except Exception as e:
-                logging.warning(e)
-                agg_metric[slicegroup]['{}({})'.format(name, metric.label)] = str(e)
-    return agg_metric
+    return slicegroups, vertgroups
 
 
 def check_labels(indiv_labels_ids, selected_labels):
@@ -383,17 +407,7 @@ def extract_metric(data, labels=None, slices=None, levels=None, perslice=True, p
     if method in ['ml', 'map']:
         # Get the complementary list of labels (the ones not asked by the user)
         id_label_compl = diff_between_list_or_int(indiv_labels_ids, label_struc[id_label].id)
-        # Generate a list of map_clusters for each label. Start with the first label (the one chosen by the user).
-        # Note that the first label could be a combination of several labels (e.g., WM and GM).
-        if isinstance(label_struc[id_label].id, list):
-            # in case there are several labels for this id_label
-            map_clusters = [list(set([label_struc[i].map_cluster for i in label_struc[id_label].id]))]
-        else:
-            # in case there is only one label for this id_label
-            map_clusters = [[label_struc[id_label].map_cluster]]
-        # Append the cluster for each remaining labels (i.e. the ones not included in the combined labels)
-        for i_cluster in [label_struc[i].map_cluster for i in id_label_compl]:
-            map_clusters.append([i_cluster])
+        map_clusters = _get_map_clusters(label_struc, id_label, id_label_compl)
         # Concatenate labels: first, the one asked by the user, then the remaining ones.
         # Examples of scenario:
         #   labels_sum = [[0], [1:36]]
@@ -419,6 +433,167 @@ def extract_metric(data, labels=None, slices=None, levels=None, perslice=True, p
                                         map_clusters=map_clusters)
 
 
+def extract_metric_all_labels(data, labels=None, ids_label=None, slices=None, levels=None, perslice=True,
+                              perlevel=False, vert_level=None, method=None, label_struc=None, indiv_labels_ids=None):
+    """
+    Extract metric within several labels, using a given method. This gives the same output as calling extract_metric()
+    for each label, but in a single pass over the data: weighted sums (and Gram matrices of the labels, for ML and MAP)
+    are computed for each slice and for all labels at once, then summed within each group of slices.
+    :param data: Class Metric(): Data (a.k.a. metric) of n-dimension to extract aggregated value from
+    :param labels: Labels of (n+1)dim. The last dim encloses the labels.
+    :param ids_label: list of int: IDs of labels to select (keys of label_struc)
+    :param slices:
+    :param levels:
+    :param perslice:
+    :param perlevel:
+    :param vert_level:
+    :param method: {'wa', 'bin', 'ml', 'map', 'max'}
+    :param label_struc: LabelStruc class defined above
+    :param indiv_labels_ids: list of int: IDs of labels corresponding to individual (as opposed to combined) labels for
+    use with ML or MAP estimation.
+    :return: dict: {id_label: aggregate_per_slice_or_level()}
+    """
+    nz = data.data.shape[-1]
+    slicegroups, vertgroups = _get_slicegroups(nz, slices=slices, levels=levels, perslice=perslice,
+                                               perlevel=perlevel, vert_level=vert_level)
+    name_func = {'wa': 'WA', 'bin': 'BIN', 'ml': 'ML', 'map': 'MAP', 'max': 'MAX'}[method]
+    names = [name_func] if method == 'max' else [name_func, 'STD']
+
+    # Flatten the voxels of each slice: data (n_vox, nz), labels (n_vox, nz, n_labels)
+    data_vox = np.array(data.data, dtype=np.float64).reshape(-1, nz)
+    labels = np.asarray(labels).reshape(data_vox.shape + (-1,))
+    # Ignore nonfinite values
+    is_finite = np.isfinite(data_vox)
+    data_vox[~is_finite] = 0.
+    max_slices = data_vox.max(axis=0)
+    # Only keep voxels that belong to at least one label
+    in_labels = np.any(labels.reshape(len(labels), -1) != 0, axis=1)
+    data_vox, is_finite, labels = data_vox[in_labels], is_finite[in_labels], labels[in_labels]
+
+    # Mask of each selected label (sum of labels for combined labels), before and after removing nonfinite voxels:
+    # (n_vox, nz, n_selected)
+    selection = np.zeros((labels.shape[-1], len(ids_label)))
+    for k, id_label in enumerate(ids_label):
+        selection[label_struc[id_label].id, k] = 1
+    masks = np.dot(labels.reshape(-1, labels.shape[-1]), selection).reshape(data_vox.shape + (-1,))
+    size_slices = masks.sum(axis=0)
+    masks *= is_finite[..., np.newaxis]
+
+    # Sum within each group of slices: group_matrix [n_groups x nz]
+    group_matrix = np.zeros((len(slicegroups), nz))
+    errors = {}
+    for i_group, slicegroup in enumerate(slicegroups):
+        try:
+            group_matrix[i_group, list(slicegroup)] = 1
+            data.data[..., slicegroup]  # raises the same error as aggregate_per_slice_or_level() for invalid slices
+        except Exception as e:
+            logging.warning(e)
+            errors[i_group] = str(e)
+
+    # Weighted average and standard deviation: combine per-slice mean and sum of squared deviations (stable)
+    sum_w = masks.sum(axis=0)
+    sum_w_group = np.dot(group_matrix, sum_w)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_slices = np.einsum('vz,vzk->zk', data_vox, masks) / np.where(sum_w == 0, 1, sum_w)
+        mean_group = np.dot(group_matrix, sum_w * mean_slices) / sum_w_group
+        if method != 'max':
+            m2_slices = np.einsum('vzk,vzk->zk', masks, (data_vox[..., np.newaxis] - mean_slices) ** 2)
+            m2_group = np.dot(group_matrix, m2_slices) + np.einsum(
+                'gz,zk,gzk->gk', group_matrix, sum_w, (mean_slices[np.newaxis] - mean_group[:, np.newaxis]) ** 2)
+            std_group = np.sqrt(np.maximum(m2_group / sum_w_group, 0))
+        else:
+            std_group = np.full_like(mean_group, np.nan)
+    size_group = np.dot(group_matrix, size_slices)
+    sum_mask_group = sum_w_group
+
+    if method == 'wa':
+        result_group = mean_group
+    elif method == 'bin':
+        masks_bin = np.where(masks >= 0.5, 1., 0.)
+        sum_bin_group = np.dot(group_matrix, masks_bin.sum(axis=0))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result_group = np.dot(group_matrix, np.einsum('vz,vzk->zk', data_vox, masks_bin)) / sum_bin_group
+    elif method == 'max':
+        # empty groups (e.g. level missing from the vertebral labeling) have no voxel: output None, as the other methods
+        max_group = np.array([np.max(max_slices[list(slicegroup)]) if slicegroup and i_group not in errors else np.nan
+                              for i_group, slicegroup in enumerate(slicegroups)])
+        result_group = np.tile(max_group[:, np.newaxis], (1, len(ids_label)))
+    elif method in ['ml', 'map']:
+        # Gram matrix of all labels and product with the data, per slice
+        labels_finite = labels * is_finite[..., np.newaxis]
+        labels_slices = np.ascontiguousarray(labels_finite.transpose(1, 0, 2))  # (nz, n_vox, n_labels)
+        xtx_slices = np.matmul(labels_slices.transpose(0, 2, 1), labels_slices)
+        xty_slices = np.einsum('vzl,vz->zl', labels_finite, data_vox)
+        xtx_group = np.einsum('gz,zij->gij', group_matrix, xtx_slices)
+        xty_group = np.dot(group_matrix, xty_slices)
+        sum_labels_group = np.dot(group_matrix, labels_finite.sum(axis=0))
+        size_labels_group = np.dot(group_matrix, labels.sum(axis=0))
+        result_group = np.zeros((len(slicegroups), len(ids_label)))
+        sum_mask_group = np.zeros_like(result_group)
+        size_group = np.zeros_like(result_group)
+        for k, id_label in enumerate(ids_label):
+            # Design matrix: X = labels . C, with first the label asked by the user, then the remaining ones
+            id_label_compl = diff_between_list_or_int(indiv_labels_ids, label_struc[id_label].id)
+            ids = label_struc[id_label].id if isinstance(label_struc[id_label].id, list) else [label_struc[id_label].id]
+            combination = np.zeros((labels.shape[-1], 1 + len(id_label_compl)))
+            combination[ids, 0] = 1
+            combination[id_label_compl, np.arange(1, 1 + len(id_label_compl))] = 1
+            sum_mask_group[:, k] = np.dot(sum_labels_group, combination.sum(axis=1))
+            size_group[:, k] = np.dot(size_labels_group, combination.sum(axis=1))
+            if method == 'map':
+                id_clusters = _get_id_clusters(_get_map_clusters(label_struc, id_label, id_label_compl))
+            for i_group in range(len(slicegroups)):
+                xtx = np.dot(combination.T, np.dot(xtx_group[i_group], combination))
+                xty = np.dot(combination.T, xty_group[i_group])
+                if method == 'ml':
+                    result_group[i_group, k] = _ml_from_gram(xtx, xty)[0]
+                else:
+                    result_group[i_group, k] = _map_from_gram(xtx, xty, id_clusters)[0]
+
+    agg_metrics = {}
+    for k, id_label in enumerate(ids_label):
+        agg_metric = agg_metrics[id_label] = dict((slicegroup, dict()) for slicegroup in slicegroups)
+        for i_group, slicegroup in enumerate(slicegroups):
+            agg_metric[slicegroup]['VertLevel'] = None if vertgroups is None else vertgroups[i_group]
+            if i_group in errors:
+                for name in names:
+                    agg_metric[slicegroup]['{}({})'.format(name, data.label)] = errors[i_group]
+                continue
+            agg_metric[slicegroup]['Label'] = label_struc[id_label].name
+            agg_metric[slicegroup]['Size [vox]'] = size_group[i_group, k]
+            for name, result in zip(names, [result_group[i_group, k], std_group[i_group, k]]):
+                if sum_mask_group[i_group, k] == 0:
+                    result = None
+                elif name == 'STD' and sum_w_group[i_group, k] == 0 or name == 'BIN' and sum_bin_group[i_group, k] == 0:
+                    # same error as np.average() in func_std() and func_bin()
+                    result = "Weights sum to zero, can't be normalized"
+                elif np.isnan(result):
+                    result = None
+                agg_metric[slicegroup]['{}({})'.format(name, data.label)] = result
+    return agg_metrics
+
+
+def _get_map_clusters(label_struc, id_label, id_label_compl):
+    """
+    Generate a list of map_clusters for each label (see func_map()). Start with the first label (the one chosen by the
+    user). Note that the first label could be a combination of several labels (e.g., WM and GM).
+    :param label_struc: LabelStruc class defined above
+    :param id_label: int: ID of label to select
+    :param id_label_compl: list of int: IDs of the remaining labels
+    :return: list of list of int
+    """
+    if isinstance(label_struc[id_label].id, list):
+        # in case there are several labels for this id_label
+        map_clusters = [list(set([label_struc[i].map_cluster for i in label_struc[id_label].id]))]
+    else:
+        # in case there is only one label for this id_label
+        map_clusters = [[label_struc[id_label].map_cluster]]
+    # Append the cluster for each remaining labels (i.e. the ones not included in the combined labels)
+    for i_cluster in [label_struc[i].map_cluster for i in id_label_compl]:
+        map_clusters.append([i_cluster])
+    return map_clusters
+
+
 def make_a_string(item):
     """Convert tuple or list or None to a string. Important: elements in tuple or list are separated with ; (not ,)
     for compatibility with csv."""
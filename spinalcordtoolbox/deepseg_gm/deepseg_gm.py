@@ -33,6 +33,7 @@ else:
     sys.stderr = original_stderr
 
 from spinalcordtoolbox import resampling
+from spinalcordtoolbox.deepseg_models import ModelSpec, get_model
 from . import model
 from ..utils import __data_dir__
 
@@ -227,12 +228,13 @@ def segment_volume(ninput_volume, model_name,
     else:
         # larger sizer, crop at 200x200
         net_input_size = (SMALL_INPUT_SIZE, SMALL_INPUT_SIZE)
-
-    deepgmseg_model = model.create_model(metadata['filters'],
-                                         net_input_size)
+    net_input_size = tuple(int(size) for size in net_input_size)
 
     model_abs_path = gmseg_model_challenge.get_file_path(model_path)
-    deepgmseg_model.load_weights(model_abs_path)
+    deepgmseg_model = get_model(('deepseg_gm', model_name, '2d', net_input_size),
+                                ModelSpec('spinalcordtoolbox.deepseg_gm.model:create_model',
+                                          dict(nfilters=metadata['filters'], input_size=net_input_size),
+                                          model_abs_path))
 
     volume_data = ninput_volume.get_data()
     axial_slices = []
@@ -12,8 +12,10 @@ import sct_utils as sct
 
 import spinalcordtoolbox.image as msct_image
 from spinalcordtoolbox.image import Image
-from spinalcordtoolbox.deepseg_sc.core import find_centerline, crop_image_around_centerline, uncrop_image, _normalize_data
+from spinalcordtoolbox.deepseg_sc.core import find_centerline, crop_image_around_centerline, uncrop_image, \
+    predict_sliding_window
 from spinalcordtoolbox import resampling
+from spinalcordtoolbox.deepseg_models import ModelSpec, get_model
 
 logger = logging.getLogger(__name__)
 
@@ -74,47 +76,36 @@ def apply_intensity_normalization(img, contrast):
     return img_normalized
 
 
-def segment_3d(model_fname, contrast_type, im):
-    """Perform segmentation with 3D convolutions."""
-    from spinalcordtoolbox.deepseg_sc.cnn_models_3d import load_trained_model
+def segment_3d(model_fname, contrast_type, im, overlap=0.0, batch_size=BATCH_SIZE, blending='gaussian'):
+    """
+    Perform segmentation with 3D convolutions.
+    :param overlap: float: overlap of the patches. See deepseg_sc.core.predict_sliding_window
+    :param batch_size: int: number of patches per call to the model
+    :param blending: {'gaussian', 'constant'}: weights of the voxels of a patch. See
+        deepseg_sc.core.predict_sliding_window
+    """
     dct_patch_3d = {'t2': {'size': (48, 48, 48), 'mean': 871.309, 'std': 557.916},
                     't2_ax': {'size': (48, 48, 48), 'mean': 835.592, 'std': 528.386},
                     't2s': {'size': (48, 48, 48), 'mean': 1011.31, 'std': 678.985}}
 
     # load 3d model
-    seg_model = load_trained_model(model_fname)
-
-    out_data = np.zeros(im.data.shape)
-
-    # segment the spinal cord
-    z_patch_size = dct_patch_3d[contrast_type]['size'][2]
-    z_step_keep = list(range(0, im.data.shape[2], z_patch_size))
-    for zz in z_step_keep:
-        if zz == z_step_keep[-1]:  # deal with instances where the im.data.shape[2] % patch_size_z != 0
-            patch_im = np.zeros(dct_patch_3d[contrast_type]['size'])
-            z_patch_extracted = im.data.shape[2] - zz
-            patch_im[:, :, :z_patch_extracted] = im.data[:, :, zz:]
-        else:
-            z_patch_extracted = z_patch_size
-            patch_im = im.data[:, :, zz:z_patch_size + zz]
-
-        if np.any(patch_im):  # Check if the patch is (not) empty, which could occur after a brain detection.
-            patch_norm = _normalize_data(patch_im, dct_patch_3d[contrast_type]['mean'], dct_patch_3d[contrast_type]['std'])
-            patch_pred_proba = seg_model.predict(np.expand_dims(np.expand_dims(patch_norm, 0), 0), batch_size=BATCH_SIZE)
-            pred_seg_th = (patch_pred_proba > 0.1).astype(int)[0, 0, :, :, :]
-            if zz == z_step_keep[-1]:
-                out_data[:, :, zz:] = pred_seg_th[:, :, :z_patch_extracted]
-            else:
-                out_data[:, :, zz:z_patch_size + zz] = pred_seg_th
+    seg_model = get_model(('deepseg_lesion', contrast_type, '3d', dct_patch_3d[contrast_type]['size']),
+                          ModelSpec('spinalcordtoolbox.deepseg_sc.cnn_models_3d:load_trained_model',
+                                    dict(model_file=model_fname), None))
+
+    # segment the lesions
+    pred = predict_sliding_window(seg_model, im.data, dct_patch_3d[contrast_type]['size'],
+                                  dct_patch_3d[contrast_type]['mean'], dct_patch_3d[contrast_type]['std'],
+                                  overlap=overlap, batch_size=batch_size, blending=blending)
 
     out = msct_image.zeros_like(im, dtype=np.uint8)
-    out.data = out_data
+    out.data = (pred > 0.1).astype(np.uint8)
 
     return out.copy()
 
 
 def deep_segmentation_MSlesion(im_image, contrast_type, ctr_algo='svm', ctr_file=None, brain_bool=True,
-                               remove_temp_files=1, verbose=1):
+                               remove_temp_files=1, verbose=1, overlap=0.0, batch_size=BATCH_SIZE, blending='gaussian'):
     """
     Segment lesions from MRI data.
     :param im_image: Image() object containing the lesions to segment
@@ -123,6 +114,9 @@ def deep_segmentation_MSlesion(im_image, contrast_type, ctr_algo='svm', ctr_file
     :param ctr_file: Centerline or segmentation (optional)
     :param brain_bool: If brain if present or not in the image.
     :param remove_temp_files:
+    :param overlap: float: Overlap of the patches. See deepseg_sc.core.predict_sliding_window
+    :param batch_size: int: Number of patches segmented at once. See deepseg_sc.core.predict_sliding_window
+    :param blending: {'gaussian', 'constant'}: Blending of the patches. See deepseg_sc.core.predict_sliding_window
     :return:
     """
 
@@ -194,7 +188,10 @@ def deep_segmentation_MSlesion(im_image, contrast_type, ctr_algo='svm', ctr_file
     im_res3d = Image(fname_res3d)
     seg_im = segment_3d(model_fname=segmentation_model_fname,
                         contrast_type=contrast_type,
-                        im=im_res3d.copy())
+                        im=im_res3d.copy(),
+                        overlap=overlap,
+                        batch_size=batch_size,
+                        blending=blending)
     seg_im.save(fname_seg_crop_res)
     del im_res3d, seg_im
 
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# Models of the deepseg tools (sct_deepseg_sc, sct_deepseg_gm, sct_deepseg_lesion): in-process registry and local
+# inference server.
+#
+# Building a Keras model and loading its weights dominate the duration of a segmentation when many subjects are
+# processed. The models are kept in an in-process registry, keyed by (tool, contrast, kernel, input size) and by how they
+# are built (builder, arguments and weights), which evicts the least recently used one beyond CACHE_SIZE models. The
+# inference server (sct_deepseg_server) keeps such a registry alive across SCT commands: while it is running, get_model()
+# returns a proxy which sends the data to predict to the server through a Unix socket, and Keras is not even imported by
+# the command. Otherwise, the prediction is done in process.
+#
+# The messages of the server are pickled, so the server is only used if its folder, its socket and its authentication
+# key belong to the user and are not accessible by the group and the others.
+#
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+
+from __future__ import absolute_import
+
+import os
+import logging
+import stat
+import importlib
+import collections
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of models kept in the registry
+CACHE_SIZE = int(os.environ.get('SCT_DEEPSEG_CACHE_SIZE', 4))
+
+# How to build a model: builder is the 'module:function' returning the model from the keyword arguments kwargs, then
+# the weights are loaded from fname_weights (unless None, if the builder loads them).
+ModelSpec = collections.namedtuple('ModelSpec', ['builder', 'kwargs', 'fname_weights'])
+
+_registry = collections.OrderedDict()
+# whether the inference server answered (None: not tried yet)
+_server_available = None
+
+
+def build_model(spec):
+    """Build a model from its ModelSpec, and load its weights."""
+    module, function = spec.builder.split(':')
+    model = getattr(importlib.import_module(module), function)(**spec.kwargs)
+    if spec.fname_weights is not None:
+        model.load_weights(spec.fname_weights)
+    return model
+
+
+def get_local_model(key, spec):
+    """
+    Model of the in-process registry, built if it is not in it.
+
+    :param key: tuple (tool, contrast, kernel, input size)
+    :param spec: ModelSpec
+    :return: Keras model
+    """
+    # models of the same name with other weights (e.g. custom models) are different entries
+    key = key + (spec.builder, repr(sorted(spec.kwargs.items())), spec.fname_weights)
+    if key in _registry:
+        model = _registry.pop(key)
+    else:
+        logger.debug("Building model %s", key)
+        model = build_model(spec)
+    _registry[key] = model  # most recently used last
+    while len(_registry) > CACHE_SIZE:
+        _registry.popitem(last=False)
+    return model
+
+
+def get_model(key, spec):
+    """
+    Model to predict with: a proxy of the model of the inference server if it is running, the model of the in-process
+    registry otherwise. The environment variable SCT_DEEPSEG_SERVER=0 disables the server, and the server is not used if
+    its files are not private to the user (see check_private).
+
+    :param key: tuple (tool, contrast, kernel, input size)
+    :param spec: ModelSpec
+    :return: object with the method predict(x, batch_size)
+    """
+    global _server_available
+    if _server_available is None:
+        _server_available = False
+        address = get_address()
+        if os.environ.get('SCT_DEEPSEG_SERVER', '1') != '0' and os.path.exists(address):
+            try:
+                check_server_files(address)
+            except (IOError, OSError) as e:
+                logger.warning("Not using the inference server: {}".format(e))
+                return get_local_model(key, spec)
+            try:
+                pid = request('ping')
+                logger.info("Using the inference server (PID {})".format(pid))
+                _server_available = True
+            except (IOError, OSError, EOFError, AuthenticationError) as e:
+                logger.debug("Inference server not available: %s", e)
+    if _server_available:
+        return RemoteModel(key, spec)
+    return get_local_model(key, spec)
+
+
+class RemoteModel(object):
+    """Proxy of a model of the inference server"""
+    def __init__(self, key, spec):
+        self.key = key
+        self.spec = spec
+
+    def predict(self, x, batch_size=32, **kwargs):
+        """Same as the predict method of Keras models (other arguments are ignored)"""
+        return request('predict', self.key, self.spec, x, batch_size)
+
+
+def get_address():
+    """
+    Path of the Unix socket of the inference server: SCT_DEEPSEG_SOCKET if set, otherwise in the folder sct_deepseg of
+    the runtime folder of the user ($XDG_RUNTIME_DIR), or of ~/.cache/sct if it is not set.
+    """
+    if 'SCT_DEEPSEG_SOCKET' in os.environ:
+        return os.environ['SCT_DEEPSEG_SOCKET']
+    folder = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'sct')
+    return os.path.join(folder, 'sct_deepseg', 'server.sock')
+
+
+def check_private(path):
+    """
+    Check that a file or folder belongs to the user and has no permission for the group and the others, so that other
+    users can neither replace it nor read it. Symbolic links are not followed.
+
+    :param path: str
+    :raise: IOError (OSError if path does not exist)
+    """
+    st = os.lstat(path)
+    if st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise IOError("{} is not private to the user (owner {}, mode {:o})".format(
+            path, st.st_uid, stat.S_IMODE(st.st_mode)))
+
+
+def check_server_files(address):
+    """Check that the folder, the socket and the authentication key of the inference server are private to the user"""
+    for path in [os.path.dirname(os.path.abspath(address)), address, address + '.key']:
+        check_private(path)
+
+
+def request(*message):
+    """
+    Send a request to the inference server.
+
+    :param message: 'ping', 'status', 'stop' or 'predict', key, spec, x, batch_size
+    :return: answer of the server
+    """
+    address = get_address()
+    # the answer is unpickled: only trust a server of the user
+    check_server_files(address)
+    with open(address + '.key', 'rb') as f:
+        authkey = f.read()
+    conn = Client(address, family='AF_UNIX', authkey=authkey)
+    try:
+        conn.send(message)
+        status, answer = conn.recv()
+    finally:
+        conn.close()
+    if status == 'error':
+        raise RuntimeError("Inference server: {}".format(answer))
+    return answer
+
+
+def serve(address=None):
+    """
+    Run the inference server until it receives a 'stop' request. The requests are handled one at a time, with the
+    models of the registry of the server.
+
+    :param address: path of the Unix socket. Default: see get_address
+    """
+    address = address or get_address()
+    folder = os.path.dirname(os.path.abspath(address))
+    # the folder, the authentication key and the socket are only accessible by the user
+    umask = os.umask(0o077)
+    try:
+        if not os.path.isdir(folder):
+            os.makedirs(folder, 0o700)
+        try:
+            check_private(folder)
+        except IOError as e:
+            raise RuntimeError("Cannot run the inference server in {}: {}".format(folder, e))
+        if os.path.lexists(address):
+            try:
+                pid = request('ping')
+                raise RuntimeError("The inference server is already running (PID {})".format(pid))
+            except (IOError, OSError, EOFError, AuthenticationError):
+                # socket of a server which did not stop properly
+                os.remove(address)
+        if os.path.lexists(address + '.key'):
+            os.remove(address + '.key')
+        fd = os.open(address + '.key', os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        authkey = os.urandom(32)
+        os.write(fd, authkey)
+        os.close(fd)
+        listener = Listener(address, family='AF_UNIX', authkey=authkey)
+    finally:
+        os.umask(umask)
+    logger.info("Inference server listening on {}".format(address))
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except (IOError, OSError, EOFError, AuthenticationError) as e:
+                logger.warning("Connection refused: {}".format(e))
+                continue
+            try:
+                message = conn.recv()
+                if message[0] == 'stop':
+                    conn.send(('ok', None))
+                    break
+                conn.send(('ok', _handle(message)))
+            except (IOError, OSError, EOFError) as e:
+                logger.warning("Connection lost: {}".format(e))
+            except Exception as e:
+                logger.exception("Request failed")
+                conn.send(('error', "{}: {}".format(type(e).__name__, e)))
+            finally:
+                conn.close()
+    finally:
+        listener.close()
+        os.remove(address + '.key')
+    logger.info("Inference server stopped")
+
+
+def _handle(message):
+    """Answer of the server to a request (see request)"""
+    if message[0] == 'ping':
+        return os.getpid()
+    elif message[0] == 'status':
+        return {'pid': os.getpid(), 'models': list(_registry.keys())}
+    elif message[0] == 'predict':
+        key, spec, x, batch_size = message[1:]
+        return get_local_model(key, spec).predict(x, batch_size=batch_size)
+    raise ValueError("Unknown request: {}".format(message[0]))
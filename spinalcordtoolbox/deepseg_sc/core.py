@@ -11,8 +11,8 @@ from scipy.ndimage import distance_transform_edt
 import nibabel as nib
 
 from spinalcordtoolbox import resampling
-from .cnn_models import nn_architecture_seg, nn_architecture_ctr
-from .postprocessing import post_processing_volume_wise, keep_largest_object, fill_holes_2d
+from spinalcordtoolbox.deepseg_models import ModelSpec, get_model
+from .postprocessing import post_processing_volume_wise, post_processing_slice_wise
 from spinalcordtoolbox.image import Image, empty_like, change_type, zeros_like
 from spinalcordtoolbox.centerline.core import ParamCenterline, get_centerline, _call_viewer_centerline
 
@@ -22,6 +22,15 @@ from sct_image import concat_data, split_data
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 BATCH_SIZE = 4
+# Number of axial slices segmented at once by the 2D CNN (see segment_2d)
+BATCH_SIZE_2D = 32
+# Number of axial slices on which the centerline is tracked at once by the CNN of the heatmap (see heatmap)
+BATCH_SIZE_CTR = 32
+# The tracking block is re-centered when the center of mass of the cord moves away from its center by more than this
+# fraction of the block size. The prediction of the CNN depends on the position of the cord in the block: with 0, the
+# block is re-centered on the center of mass of the previous slice at every slice, as when the slices were predicted
+# one at a time.
+TRACKING_MARGIN = 0.0
 # Thresholds to apply to binarize segmentations from the output of the 2D CNN. These thresholds were obtained by
 # minimizing the standard deviation of cross-sectional area across contrasts. For more details, see:
 # https://github.com/sct-pipeline/deepseg-threshold
@@ -75,18 +84,20 @@ def find_centerline(algo, image_fname, contrast_type, brain_bool, folder_output,
 
         # load model
         ctr_model_fname = os.path.join(sct.__sct_dir__, 'data', 'deepseg_sc_models', '{}_ctr.h5'.format(contrast_type))
-        ctr_model = nn_architecture_ctr(height=dct_patch_ctr[contrast_type]['size'][0],
-                                        width=dct_patch_ctr[contrast_type]['size'][1],
-                                        channels=1,
-                                        classes=1,
-                                        features=dct_params_ctr[contrast_type]['features'],
-                                        depth=2,
-                                        temperature=1.0,
-                                        padding='same',
-                                        batchnorm=True,
-                                        dropout=0.0,
-                                        dilation_layers=dct_params_ctr[contrast_type]['dilation_layers'])
-        ctr_model.load_weights(ctr_model_fname)
+        ctr_model = get_model(('deepseg_sc', contrast_type, 'ctr', dct_patch_ctr[contrast_type]['size']),
+                              ModelSpec('spinalcordtoolbox.deepseg_sc.cnn_models:nn_architecture_ctr',
+                                        dict(height=dct_patch_ctr[contrast_type]['size'][0],
+                                             width=dct_patch_ctr[contrast_type]['size'][1],
+                                             channels=1,
+                                             classes=1,
+                                             features=dct_params_ctr[contrast_type]['features'],
+                                             depth=2,
+                                             temperature=1.0,
+                                             padding='same',
+                                             batchnorm=True,
+                                             dropout=0.0,
+                                             dilation_layers=dct_params_ctr[contrast_type]['dilation_layers']),
+                                        ctr_model_fname))
 
         # compute the heatmap
         im_heatmap, z_max = heatmap(im=im,
@@ -185,17 +196,44 @@ def crop_image_around_centerline(im_in, ctr_in, crop_size):
     return x_lst, y_lst, z_lst, im_new
 
 
+def _predict_blocks(model, blocks, mean_train, std_train):
+    """Predict the heatmap of a list of 2D blocks of the same shape, in batches."""
+    blocks_nn = _normalize_data(np.expand_dims(np.stack(blocks), -1), mean_train, std_train)
+    return model.predict(blocks_nn, batch_size=BATCH_SIZE_CTR)[..., 0]
+
+
+def _get_block_coords(x_CoM, y_CoM, patch_shape, shape_in, shape_out):
+    """
+    Coordinates of the block centered on the center of mass.
+    :return: (x_0, x_1, y_0, y_1) in the padded slice, (x_0, x_1, y_0, y_1, x_end, y_end) in the output slice
+    """
+    x_0, x_1 = _find_crop_start_end(x_CoM, patch_shape[0], shape_in[0])
+    y_0, y_1 = _find_crop_start_end(y_CoM, patch_shape[1], shape_in[1])
+    coords_in = (x_0, x_1, y_0, y_1)
+    # coordinates manipulation due to the padding and cropping
+    if x_1 > shape_out[0]:
+        x_end = shape_out[0]
+        x_1 = shape_out[0]
+        x_0 = shape_out[0] - patch_shape[0] if shape_out[0] > patch_shape[0] else 0
+    else:
+        x_end = patch_shape[0]
+    if y_1 > shape_out[1]:
+        y_end = shape_out[1]
+        y_1 = shape_out[1]
+        y_0 = shape_out[1] - patch_shape[1] if shape_out[1] > patch_shape[1] else 0
+    else:
+        y_end = patch_shape[1]
+    return coords_in, (x_0, x_1, y_0, y_1, x_end, y_end)
+
+
 def scan_slice(z_slice, model, mean_train, std_train, coord_lst, patch_shape, z_out_dim):
     """Scan the entire axial slice to detect the centerline."""
     z_slice_out = np.zeros(z_out_dim)
     sum_lst = []
-    # loop across all the non-overlapping blocks of a cross-sectional slice
-    for idx, coord in enumerate(coord_lst):
-        block = z_slice[coord[0]:coord[2], coord[1]:coord[3]]
-        block_nn = np.expand_dims(np.expand_dims(block, 0), -1)
-        block_nn_norm = _normalize_data(block_nn, mean_train, std_train)
-        block_pred = model.predict(block_nn_norm, batch_size=BATCH_SIZE)
-
+    # predict all the non-overlapping blocks of a cross-sectional slice at once
+    blocks_pred = _predict_blocks(model, [z_slice[coord[0]:coord[2], coord[1]:coord[3]] for coord in coord_lst],
+                                  mean_train, std_train)
+    for coord, block_pred in zip(coord_lst, blocks_pred):
         if coord[2] > z_out_dim[0]:
             x_end = patch_shape[0] - (coord[2] - z_out_dim[0])
         else:
@@ -205,8 +243,8 @@ def scan_slice(z_slice, model, mean_train, std_train, coord_lst, patch_shape, z_
         else:
             y_end = patch_shape[1]
 
-        z_slice_out[coord[0]:coord[2], coord[1]:coord[3]] = block_pred[0, :x_end, :y_end, 0]
-        sum_lst.append(np.sum(block_pred[0, :x_end, :y_end, 0]))
+        z_slice_out[coord[0]:coord[2], coord[1]:coord[3]] = block_pred[:x_end, :y_end]
+        sum_lst.append(np.sum(block_pred[:x_end, :y_end]))
 
     # Put first the coord of the patch were the centerline is likely located so that the search could be faster for the
     # next axial slices
@@ -225,15 +263,22 @@ def scan_slice(z_slice, model, mean_train, std_train, coord_lst, patch_shape, z_
     return z_slice_out, x_CoM, y_CoM, coord_lst
 
 
-def heatmap(im, model, patch_shape, mean_train, std_train, brain_bool=True):
-    """Compute the heatmap with CNN_1 representing the SC localization."""
+def heatmap(im, model, patch_shape, mean_train, std_train, brain_bool=True, tracking_margin=TRACKING_MARGIN):
+    """
+    Compute the heatmap with CNN_1 representing the SC localization.
+
+    The cord is tracked from slice to slice on the block centered on its center of mass (CoM). The next slices are
+    predicted at once on the same block, up to BATCH_SIZE_CTR slices: the number of slices of a batch doubles while the
+    block is not re-centered, and restarts at one slice otherwise. The block is re-centered when the CoM moves by more
+    than tracking_margin (fraction of the block size), and the slices where the cord is lost are entirely scanned.
+    """
     data_im = im.data.astype(np.float32)
     im_out = change_type(im, "uint8")
     del im
     data = np.zeros(im_out.data.shape)
 
     x_shape, y_shape = data_im.shape[:2]
-    x_shape_block, y_shape_block = np.ceil(x_shape * 1.0 / patch_shape[0]).astype(np.int), np.int(
+    x_shape_block, y_shape_block = np.ceil(x_shape * 1.0 / patch_shape[0]).astype(int), int(
         y_shape * 1.0 / patch_shape[1])
     x_pad = int(x_shape_block * patch_shape[0] - x_shape)
     if y_shape > patch_shape[1]:
@@ -253,61 +298,63 @@ def heatmap(im, model, patch_shape, mean_train, std_train, brain_bool=True):
     # scale intensities between 0 and 255
     data_im = scale_intensity(data_im)
 
+    def finish_slice(zz):
+        # distance transform to deal with the harsh edges of the prediction boundaries (Dice)
+        data[:, :, zz][np.where(data[:, :, zz] < 0.5)] = 0
+        data[:, :, zz] = distance_transform_edt(data[:, :, zz])
+
     x_CoM, y_CoM = None, None
     z_sc_notDetected_cmpt = 0
-    for zz in range(data_im.shape[2]):
-        # if SC was detected at zz-1, we will start doing the detection on the block centered around the previously
-        # computed center of mass (CoM)
+    n_tracked = 1  # number of slices of the next batch
+    zz = 0
+    while zz < data_im.shape[2]:
+        # if SC was detected at zz-1, we will do the detection on the blocks centered around the previously computed
+        # center of mass (CoM), on the next slices at once
         if x_CoM is not None:
             z_sc_notDetected_cmpt = 0  # SC detected, cmpt set to zero
-            x_0, x_1 = _find_crop_start_end(x_CoM, patch_shape[0], data_im.shape[0])
-            y_0, y_1 = _find_crop_start_end(y_CoM, patch_shape[1], data_im.shape[1])
-            block = data_im[x_0:x_1, y_0:y_1, zz]
-            block_nn = np.expand_dims(np.expand_dims(block, 0), -1)
-            block_nn_norm = _normalize_data(block_nn, mean_train, std_train)
-            block_pred = model.predict(block_nn_norm, batch_size=BATCH_SIZE)
-
-            # coordinates manipulation due to the above padding and cropping
-            if x_1 > data.shape[0]:
-                x_end = data.shape[0]
-                x_1 = data.shape[0]
-                x_0 = data.shape[0] - patch_shape[0] if data.shape[0] > patch_shape[0] else 0
-            else:
-                x_end = patch_shape[0]
-            if y_1 > data.shape[1]:
-                y_end = data.shape[1]
-                y_1 = data.shape[1]
-                y_0 = data.shape[1] - patch_shape[1] if data.shape[1] > patch_shape[1] else 0
-            else:
-                y_end = patch_shape[1]
-
-            data[x_0:x_1, y_0:y_1, zz] = block_pred[0, :x_end, :y_end, 0]
-
-            # computation of the new center of mass
-            if np.max(data[:, :, zz]) > 0.5:
-                z_slice_out_bin = data[:, :, zz] > 0.5  # if the SC was detection
-                x_CoM, y_CoM = center_of_mass(z_slice_out_bin)
-                x_CoM, y_CoM = int(x_CoM), int(y_CoM)
-            else:
-                x_CoM, y_CoM = None, None
+            x_ctr, y_ctr = x_CoM, y_CoM
+            (x_0, x_1, y_0, y_1), (x_0_out, x_1_out, y_0_out, y_1_out, x_end, y_end) = \
+                _get_block_coords(x_ctr, y_ctr, patch_shape, data_im.shape, data.shape)
+            z_lst = range(zz, min(zz + n_tracked, data_im.shape[2]))
+            blocks_pred = _predict_blocks(model, [data_im[x_0:x_1, y_0:y_1, z] for z in z_lst], mean_train, std_train)
+            n_tracked = min(2 * n_tracked, BATCH_SIZE_CTR)
+            for block_pred in blocks_pred:
+                data[x_0_out:x_1_out, y_0_out:y_1_out, zz] = block_pred[:x_end, :y_end]
+
+                # computation of the new center of mass
+                if np.max(data[:, :, zz]) > 0.5:
+                    z_slice_out_bin = data[:, :, zz] > 0.5  # if the SC was detection
+                    x_CoM, y_CoM = center_of_mass(z_slice_out_bin)
+                    x_CoM, y_CoM = int(x_CoM), int(y_CoM)
+                else:
+                    # the SC is lost: slice zz is scanned below
+                    x_CoM, y_CoM = None, None
+                    n_tracked = 1
+                    break
+                finish_slice(zz)
+                zz += 1
+                # the next slices are predicted again on a re-centered block
+                if abs(x_CoM - x_ctr) > tracking_margin * patch_shape[0] or \
+                        abs(y_CoM - y_ctr) > tracking_margin * patch_shape[1]:
+                    n_tracked = 1
+                    break
+            continue
 
         # if the SC was not detected at zz-1 or on the patch centered around CoM in slice zz, the entire cross-sectional
         # slice is scanned
-        if x_CoM is None:
-            z_slice, x_CoM, y_CoM, coord_lst = scan_slice(data_im[:, :, zz], model,
-                                                          mean_train, std_train,
-                                                          coord_lst, patch_shape, data.shape[:2])
-            data[:, :, zz] = z_slice
-
-            z_sc_notDetected_cmpt += 1
-            # if the SC has not been detected on 10 consecutive z_slices, we stop the SC investigation
-            if z_sc_notDetected_cmpt > 10 and brain_bool:
-                sct.printv('Brain section detected.')
-                break
+        z_slice, x_CoM, y_CoM, coord_lst = scan_slice(data_im[:, :, zz], model,
+                                                      mean_train, std_train,
+                                                      coord_lst, patch_shape, data.shape[:2])
+        data[:, :, zz] = z_slice
 
-        # distance transform to deal with the harsh edges of the prediction boundaries (Dice)
-        data[:, :, zz][np.where(data[:, :, zz] < 0.5)] = 0
-        data[:, :, zz] = distance_transform_edt(data[:, :, zz])
+        z_sc_notDetected_cmpt += 1
+        # if the SC has not been detected on 10 consecutive z_slices, we stop the SC investigation
+        if z_sc_notDetected_cmpt > 10 and brain_bool:
+            sct.printv('Brain section detected.')
+            break
+
+        finish_slice(zz)
+        zz += 1
 
     if not np.any(data):
         logger.error(
@@ -331,74 +378,127 @@ def _normalize_data(data, mean, std):
     return data
 
 
-def segment_2d(model_fname, contrast_type, input_size, im_in):
+def segment_2d(model_fname, contrast_type, input_size, im_in, batch_size=BATCH_SIZE_2D):
     """
     Segment data using 2D convolutions.
+    :param batch_size: int: Number of axial slices predicted at once. The stack of slices is run through the model in
+        batches of this size, which bounds the memory used by the prediction.
     :return: seg_crop.data: ndarray float32: Output prediction
     """
-    seg_model = nn_architecture_seg(height=input_size[0],
-                                    width=input_size[1],
-                                    depth=2 if contrast_type != 't2' else 3,
-                                    features=32,
-                                    batchnorm=False,
-                                    dropout=0.0)
-    seg_model.load_weights(model_fname)
+    seg_model = get_model(('deepseg_sc', contrast_type, '2d', tuple(input_size)),
+                          ModelSpec('spinalcordtoolbox.deepseg_sc.cnn_models:nn_architecture_seg',
+                                    dict(height=input_size[0],
+                                         width=input_size[1],
+                                         depth=2 if contrast_type != 't2' else 3,
+                                         features=32,
+                                         batchnorm=False,
+                                         dropout=0.0),
+                                    model_fname))
 
     seg_crop = zeros_like(im_in, dtype=np.float32)
 
-    data_norm = im_in.data
-    # TODO: use tqdm
-    for zz in range(im_in.dim[2]):
-        # 2D CNN prediction
-        pred_seg = seg_model.predict(np.expand_dims(np.expand_dims(data_norm[:, :, zz], -1), 0),
-                                     batch_size=BATCH_SIZE)[0, :, :, 0]
-        seg_crop.data[:, :, zz] = pred_seg
+    # 2D CNN prediction of the stack of axial slices: (nz, nx, ny, 1)
+    data_norm = np.expand_dims(np.moveaxis(im_in.data, 2, 0), -1)
+    pred_seg = seg_model.predict(data_norm, batch_size=batch_size)
+    seg_crop.data[...] = np.moveaxis(pred_seg[..., 0], 0, 2)
 
     return seg_crop.data
 
 
-def segment_3d(model_fname, contrast_type, im_in):
+def _get_patch_starts(dim, patch_dim, step):
+    """Start of the patches along an axis of size dim, the last one ending at the end of the axis."""
+    if dim <= patch_dim:
+        return [0]
+    return list(range(0, dim - patch_dim, step)) + [dim - patch_dim]
+
+
+def _gaussian_weights(patch_size, sigma_scale=1 / 8.):
+    """Weights of the voxels of a patch for the blending of overlapping predictions, higher at the center."""
+    grids = np.meshgrid(*[np.arange(p) - (p - 1) / 2. for p in patch_size], indexing='ij')
+    weights = np.exp(-sum(g ** 2 / (2 * (p * sigma_scale) ** 2) for g, p in zip(grids, patch_size)))
+    return np.maximum(weights / weights.max(), 1e-3).astype(np.float32)
+
+
+def predict_sliding_window(model, data, patch_size, mean, std, overlap=0.0, batch_size=BATCH_SIZE,
+                           blending='gaussian', skip_empty=True):
+    """
+    Predict a 3D volume with a model on 3D patches (channels first), with a sliding window.
+
+    The patches overlap by a fraction of their size along each axis, and the last patch of an axis ends at the end of
+    the axis. Axes shorter than the patch are zero-padded. The predictions of overlapping patches are blended with
+    weights, and the patches are predicted batch_size at a time, so that the memory used does not depend on the number
+    of patches.
+
+    :param model: Keras model predicting (n, 1, patch_size) arrays
+    :param data: 3D ndarray
+    :param patch_size: tuple of 3 ints
+    :param mean, std: float: normalization of the patches, as in training
+    :param overlap: float in [0, 1): fraction of the patch shared by neighbouring patches. Larger overlaps are more
+        accurate at the borders of the patches, and slower (by 1 / (1 - overlap) along each axis with more than one
+        patch).
+    :param batch_size: int: number of patches per call to the model
+    :param blending: {'gaussian', 'constant'}: weights of the voxels of a patch: higher at the center, or uniform
+    :param skip_empty: bool: skip the patches where the data are zero (e.g. after a brain detection); their prediction
+        is zero
+    :return: ndarray float32 of the shape of data: blended prediction
+    """
+    if not 0 <= overlap < 1:
+        raise ValueError("The overlap of the patches must be within [0, 1[, got {}".format(overlap))
+    shape = data.shape
+    # zero-pad the axes shorter than the patch
+    data = np.pad(data, [(0, max(0, p - n)) for n, p in zip(shape, patch_size)], 'constant')
+    steps = [max(1, int(round(p * (1 - overlap)))) for p in patch_size]
+    starts = [(x, y, z)
+              for x in _get_patch_starts(data.shape[0], patch_size[0], steps[0])
+              for y in _get_patch_starts(data.shape[1], patch_size[1], steps[1])
+              for z in _get_patch_starts(data.shape[2], patch_size[2], steps[2])]
+    if skip_empty:
+        # summed-area table of the non-zero voxels, to count them in any patch in constant time
+        table = np.zeros(tuple(n + 1 for n in data.shape), dtype=np.int32)
+        table[1:, 1:, 1:] = (data != 0).cumsum(0, dtype=np.int32).cumsum(1).cumsum(2)
+        px, py, pz = patch_size
+        starts = [(x, y, z) for x, y, z in starts
+                  if table[x + px, y + py, z + pz] - table[x, y + py, z + pz] - table[x + px, y, z + pz]
+                  - table[x + px, y + py, z] + table[x, y, z + pz] + table[x, y + py, z] + table[x + px, y, z]
+                  - table[x, y, z] > 0]
+
+    weights = _gaussian_weights(patch_size) if blending == 'gaussian' else np.ones(patch_size, dtype=np.float32)
+    pred_sum = np.zeros(data.shape, dtype=np.float32)
+    weight_sum = np.zeros(data.shape, dtype=np.float32)
+    for i in range(0, len(starts), batch_size):
+        batch_starts = starts[i:i + batch_size]
+        patches = np.stack([data[x:x + patch_size[0], y:y + patch_size[1], z:z + patch_size[2]]
+                            for x, y, z in batch_starts]).astype(np.float32)
+        patches_pred = model.predict(np.expand_dims(_normalize_data(patches, mean, std), 1), batch_size=batch_size)
+        for (x, y, z), patch_pred in zip(batch_starts, patches_pred[:, 0]):
+            pred_sum[x:x + patch_size[0], y:y + patch_size[1], z:z + patch_size[2]] += patch_pred * weights
+            weight_sum[x:x + patch_size[0], y:y + patch_size[1], z:z + patch_size[2]] += weights
+
+    pred = np.zeros(data.shape, dtype=np.float32)
+    np.divide(pred_sum, weight_sum, out=pred, where=weight_sum > 0)
+    return pred[:shape[0], :shape[1], :shape[2]]
+
+
+def segment_3d(model_fname, contrast_type, im_in, overlap=0.0, batch_size=BATCH_SIZE, blending='gaussian'):
     """
     Perform segmentation with 3D convolutions.
+    :param overlap: float: overlap of the patches. See predict_sliding_window
+    :param batch_size: int: number of patches per call to the model
+    :param blending: {'gaussian', 'constant'}: weights of the voxels of a patch. See predict_sliding_window
     :return: seg_crop.data: ndarray float32: Output prediction
     """
-    from spinalcordtoolbox.deepseg_sc.cnn_models_3d import load_trained_model
     dct_patch_sc_3d = {'t2': {'size': (64, 64, 48), 'mean': 65.8562, 'std': 59.7999},
                        't2s': {'size': (96, 96, 48), 'mean': 87.0212, 'std': 64.425},
                        't1': {'size': (64, 64, 48), 'mean': 88.5001, 'std': 66.275}}
     # load 3d model
-    seg_model = load_trained_model(model_fname)
-
-    out = zeros_like(im_in, dtype=np.float32)
+    seg_model = get_model(('deepseg_sc', contrast_type, '3d', dct_patch_sc_3d[contrast_type]['size']),
+                          ModelSpec('spinalcordtoolbox.deepseg_sc.cnn_models_3d:load_trained_model',
+                                    dict(model_file=model_fname), None))
 
     # segment the spinal cord
-    z_patch_size = dct_patch_sc_3d[contrast_type]['size'][2]
-    z_step_keep = list(range(0, im_in.data.shape[2], z_patch_size))
-    # TODO: use tqdm
-    for zz in z_step_keep:
-        if zz == z_step_keep[-1]:  # deal with instances where the im.data.shape[2] % patch_size_z != 0
-            patch_im = np.zeros(dct_patch_sc_3d[contrast_type]['size'])
-            z_patch_extracted = im_in.data.shape[2] - zz
-            patch_im[:, :, :z_patch_extracted] = im_in.data[:, :, zz:]
-        else:
-            z_patch_extracted = z_patch_size
-            patch_im = im_in.data[:, :, zz:z_patch_size + zz]
-
-        if np.any(patch_im):  # Check if the patch is (not) empty, which could occur after a brain detection.
-            patch_norm = \
-                _normalize_data(patch_im, dct_patch_sc_3d[contrast_type]['mean'], dct_patch_sc_3d[contrast_type]['std'])
-            patch_pred_proba = \
-                seg_model.predict(np.expand_dims(np.expand_dims(patch_norm, 0), 0), batch_size=BATCH_SIZE)
-            # pred_seg_th = (patch_pred_proba > 0.5).astype(int)[0, 0, :, :, :]
-            pred_seg_th = patch_pred_proba[0, 0, :, :, :]  # TODO: clarified variable (this is not thresholded!)
-
-            # TODO: add comment about what the code is doing below
-            if zz == z_step_keep[-1]:
-                out.data[:, :, zz:] = pred_seg_th[:, :, :z_patch_extracted]
-            else:
-                out.data[:, :, zz:z_patch_size + zz] = pred_seg_th
-
-    return out.data
+    return predict_sliding_window(seg_model, im_in.data, dct_patch_sc_3d[contrast_type]['size'],
+                                  dct_patch_sc_3d[contrast_type]['mean'], dct_patch_sc_3d[contrast_type]['std'],
+                                  overlap=overlap, batch_size=batch_size, blending=blending)
 
 
 def uncrop_image(ref_in, data_crop, x_crop_lst, y_crop_lst, z_crop_lst):
@@ -417,7 +517,8 @@ def uncrop_image(ref_in, data_crop, x_crop_lst, y_crop_lst, z_crop_lst):
 
 
 def deep_segmentation_spinalcord(im_image, contrast_type, ctr_algo='cnn', ctr_file=None, brain_bool=True,
-                                 kernel_size='2d', threshold_seg=None, remove_temp_files=1, verbose=1):
+                                 kernel_size='2d', threshold_seg=None, remove_temp_files=1, verbose=1,
+                                 batch_size=BATCH_SIZE_2D, overlap=0.0, batch_size_3d=BATCH_SIZE, blending='gaussian'):
     """
     Main pipeline for CNN-based segmentation of the spinal cord.
     :param im_image:
@@ -430,6 +531,10 @@ def deep_segmentation_spinalcord(im_image, contrast_type, ctr_algo='cnn', ctr_fi
         for no binarization (i.e. soft segmentation output)
     :param remove_temp_files:
     :param verbose:
+    :param batch_size: int: Number of axial slices segmented at once with 2D kernels. See segment_2d
+    :param overlap: float: Overlap of the patches with 3D kernels. See predict_sliding_window
+    :param batch_size_3d: int: Number of patches segmented at once with 3D kernels. See predict_sliding_window
+    :param blending: {'gaussian', 'constant'}: Blending of the patches with 3D kernels. See predict_sliding_window
     :return:
     """
     if threshold_seg is None:
@@ -500,7 +605,8 @@ def deep_segmentation_spinalcord(im_image, contrast_type, ctr_algo='cnn', ctr_fi
         seg_crop = segment_2d(model_fname=segmentation_model_fname,
                               contrast_type=contrast_type,
                               input_size=(crop_size, crop_size),
-                              im_in=im_norm_in)
+                              im_in=im_norm_in,
+                              batch_size=batch_size)
     elif kernel_size == '3d':
         # segment data using 3D convolutions
         logger.info("Segmenting the spinal cord using deep learning on 3D patches...")
@@ -508,25 +614,18 @@ def deep_segmentation_spinalcord(im_image, contrast_type, ctr_algo='cnn', ctr_fi
             os.path.join(sct.__sct_dir__, 'data', 'deepseg_sc_models', '{}_sc_3D.h5'.format(contrast_type))
         seg_crop = segment_3d(model_fname=segmentation_model_fname,
                               contrast_type=contrast_type,
-                              im_in=im_norm_in)
+                              im_in=im_norm_in,
+                              overlap=overlap,
+                              batch_size=batch_size_3d,
+                              blending=blending)
 
     # Postprocessing
-    seg_crop_postproc = np.zeros_like(seg_crop)
-    x_cOm, y_cOm = None, None
-    for zz in range(im_norm_in.dim[2]):
-        # Fill holes (only for binary segmentations)
-        if threshold_seg >= 0:
-            pred_seg_th = fill_holes_2d((seg_crop[:, :, zz] > threshold_seg).astype(int))
-            pred_seg_pp = keep_largest_object(pred_seg_th, x_cOm, y_cOm)
-            # Update center of mass for slice i+1
-            if 1 in pred_seg_pp:
-                x_cOm, y_cOm = center_of_mass(pred_seg_pp)
-                x_cOm, y_cOm = np.round(x_cOm), np.round(y_cOm)
-        else:
-            # If soft segmentation, do nothing
-            pred_seg_pp = seg_crop[:, :, zz]
-
-        seg_crop_postproc[:, :, zz] = pred_seg_pp  # dtype is float32
+    if threshold_seg >= 0:
+        # Fill holes and keep the largest object of each slice (only for binary segmentations)
+        seg_crop_postproc = post_processing_slice_wise(seg_crop, threshold_seg)  # dtype is float32
+    else:
+        # If soft segmentation, do nothing
+        seg_crop_postproc = seg_crop
 
     # reconstruct the segmentation from the crop data
     logger.info("Reassembling the image...")
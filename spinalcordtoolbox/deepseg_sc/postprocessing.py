@@ -6,13 +6,18 @@
 import logging
 import numpy as np
 from scipy.ndimage.measurements import label
-from scipy.ndimage.morphology import binary_fill_holes
-
-from ..process_seg import compute_shape
+from scipy.ndimage.morphology import binary_fill_holes, generate_binary_structure
 
 
 logger = logging.getLogger(__name__)
 
+# 2D structuring elements applied to each slice of a 3D stack (3D elements which do not connect adjacent slices):
+# 4-connectivity (default of label in 2D), and 8-connectivity (used to fill holes)
+STRUCTURE_2D_CROSS = np.zeros((3, 3, 3), dtype=bool)
+STRUCTURE_2D_CROSS[:, :, 1] = generate_binary_structure(2, 1)
+STRUCTURE_2D_SQUARE = np.zeros((3, 3, 3), dtype=bool)
+STRUCTURE_2D_SQUARE[:, :, 1] = True
+
 
 def _fill_z_holes(zz_lst, data, z_spaccing):
     data_interpol = np.copy(data)
@@ -63,21 +68,24 @@ def _remove_blobs(data):
     """Remove false positive blobs, likely occuring in brain sections."""
     labeled_obj, num_obj = label(data)
     if num_obj > 1:  # If there is more than one connected object
-        bigger_obj = (labeled_obj == (np.bincount(labeled_obj.flat)[1:].argmax() + 1))
+        size_obj = np.bincount(labeled_obj.flat)
+        id_bigger_obj = size_obj[1:].argmax() + 1
 
         data2clean = np.copy(data)
 
         # remove blobs only above the bigger connected object
-        z_max = np.max(np.where(bigger_obj)[2])
+        z_max = np.max(np.where(labeled_obj == id_bigger_obj)[2])
         data2clean[:, :, :z_max + 1] = 0
 
         labeled_obj2clean, num_obj2clean = label(data2clean)
         if num_obj2clean:  # If there is connected object above the biffer connected one
-            for obj_id in range(1, num_obj2clean + 1):
-                # if the blob has a volume < 10% of the bigger connected object, then remove it
-                if np.sum(labeled_obj2clean == obj_id) < 0.1 * np.sum(bigger_obj):
-                    logger.warning('Removing small objects above slice #' + str(z_max))
-                    data[np.where(labeled_obj2clean == obj_id)] = 0
+            # if the blob has a volume < 10% of the bigger connected object, then remove it
+            size_obj2clean = np.bincount(labeled_obj2clean.flat)
+            small_obj = np.zeros(num_obj2clean + 1, dtype=bool)
+            small_obj[1:] = size_obj2clean[1:] < 0.1 * size_obj[id_bigger_obj]
+            if np.any(small_obj):
+                logger.warning('Removing small objects above slice #' + str(z_max))
+                data[small_obj[labeled_obj2clean]] = 0
 
     return data
 
@@ -106,20 +114,23 @@ def _remove_isolated_voxels_on_the_edge(im_seg, n_slices=5):
     :param n_slices: Number of adjacent slices to consider. If not enough slices, this test will be bypassed.
     :return:
     """
-    # Compute shape info across segmentation
-    metrics, _ = compute_shape(im_seg, angle_correction=False)
-    # Extract CSA and get min/max index, corresponding to the top/bottom edges of the segmentation
-    ind_nonnan = np.where(np.isnan(metrics['area'].data) == False)[0]
+    # CSA of each slice (NaN if the slice is empty), up to the in-plane pixel size which does not change the test
+    area = im_seg.data.sum(axis=(0, 1)).astype(np.float64)
+    area[area == 0] = np.nan
+    # Get min/max index, corresponding to the top/bottom edges of the segmentation
+    ind_nonnan = np.where(np.isnan(area) == False)[0]
+    if not len(ind_nonnan):
+        return im_seg
     ind_min, ind_max = ind_nonnan[0], ind_nonnan[-1]
     # Check if the CSA at the edge is inferior to half of the median across adjacent slices...
     # ... for the top slice
-    if metrics['area'].data[ind_min] < np.median(metrics['area'].data[ind_min:n_slices])/2:
+    if area[ind_min] < np.median(area[ind_min:n_slices])/2:
         im_seg.data[:, :, ind_min] = 0
         logger.warning('Found isolated voxels on slice {}, Removing them'.format(ind_min))
     # ... for the bottom slice
-    if metrics['area'].data[ind_max] < np.median(metrics['area'].data[ind_max-n_slices+1:ind_max+1])/2:
+    if area[ind_max] < np.median(area[ind_max-n_slices+1:ind_max+1])/2:
         im_seg.data[:, :, ind_max] = 0
-        logger.warning('Found isolated voxels on slice {}, Removing them'.format(ind_min))
+        logger.warning('Found isolated voxels on slice {}, Removing them'.format(ind_max))
     return im_seg
 
 
@@ -134,7 +145,7 @@ def post_processing_volume_wise(im_seg):
     data_bin = _remove_blobs(data_bin)
 
     # Fill z_holes, i.e. interpolate for z_slice not segmented
-    zz_zeros = [zz for zz in range(im_seg.dim[2]) if 1 not in list(np.unique(data_bin[:, :, zz]))]
+    zz_zeros = list(np.where(~np.any(data_bin, axis=(0, 1)))[0])
     zz_holes = _remove_extrem_holes(zz_zeros, im_seg.dim[2] - 1, 0)
     data_pp = _fill_z_holes(zz_holes, data_bin, im_seg.dim[6]) if len(zz_holes) else data_bin
 
@@ -182,3 +193,53 @@ def fill_holes_2d(z_slice):
     """
     assert z_slice.dtype == np.dtype('int')
     return binary_fill_holes(z_slice, structure=np.ones((3, 3))).astype(np.int)
+
+
+def post_processing_slice_wise(data, threshold):
+    """
+    Binarize the prediction, fill the holes of each slice, and keep one connected object per slice: the one which
+    contains the center of mass of the object kept on the previous non-empty slice, or else the largest one.
+    Same as fill_holes_2d then keep_largest_object applied slice by slice from the bottom, on the whole stack at once:
+    the connected objects of all the slices are labeled once, and the object to keep is chosen from a table of the
+    objects of each slice.
+    :param data: float 3d-array: Prediction
+    :param threshold: float: Binarization threshold
+    :return: 3d-array of the dtype of data: Processed segmentation
+    """
+    # fill holes and label the objects in each slice (the structuring elements do not connect slices)
+    data_bin = binary_fill_holes(data > threshold, structure=STRUCTURE_2D_SQUARE)
+    labeled_obj, num_obj = label(data_bin, structure=STRUCTURE_2D_CROSS)
+    if num_obj == 0:
+        return np.zeros_like(data)
+
+    # table of the objects: slice, size, center of mass (rounded as keep_largest_object expects)
+    ids = np.arange(1, num_obj + 1)
+    x, y, z = np.nonzero(labeled_obj)
+    id_vox = labeled_obj[x, y, z]
+    size_obj = np.bincount(id_vox, minlength=num_obj + 1)[1:]
+    z_obj = np.empty(num_obj, dtype=int)
+    z_obj[id_vox - 1] = z
+    x_obj = np.round(np.bincount(id_vox, weights=x, minlength=num_obj + 1)[1:] / size_obj)
+    y_obj = np.round(np.bincount(id_vox, weights=y, minlength=num_obj + 1)[1:] / size_obj)
+
+    # largest object of each slice (the first one in scan order if several are as large)
+    order = np.lexsort((ids, -size_obj, z_obj))
+    first = np.ones(num_obj, dtype=bool)
+    first[1:] = z_obj[order][1:] != z_obj[order][:-1]
+    id_keep = np.zeros(data.shape[2], dtype=int)
+    id_keep[z_obj[order][first]] = ids[order][first]
+
+    # on slices with several objects, keep the one under the center of mass of the previous non-empty slice
+    num_obj_slice = np.bincount(z_obj, minlength=data.shape[2])
+    z_last_nonempty = np.maximum.accumulate(np.where(num_obj_slice > 0, np.arange(data.shape[2]), -1))
+    for zz in np.where(num_obj_slice > 1)[0]:
+        z_prev = z_last_nonempty[zz - 1] if zz > 0 else -1
+        if z_prev >= 0:
+            id_prev = id_keep[z_prev] - 1
+            id_com = labeled_obj[int(x_obj[id_prev]), int(y_obj[id_prev]), zz]
+            if id_com:
+                id_keep[zz] = id_com
+
+    keep = np.zeros(num_obj + 1, dtype=bool)
+    keep[id_keep[id_keep > 0]] = True
+    return keep[labeled_obj].astype(data.dtype)
@@ -571,11 +571,12 @@ class Image(object):
         return averaged_coordinates
 
 
-    def transfo_pix2phys(self, coordi=None):
+    def transfo_pix2phys(self, coordi=None, dtype=np.float64):
         """
         This function returns the physical coordinates of all points of 'coordi'.
 
         :param coordi: sequence of (nb_points x 3) values containing the pixel coordinate of points.
+        :param dtype: floating point type used for the computation and the output (np.float64 or np.float32)
         :return: sequence with the physical coordinates of the points in the space of the image.
 
         Example:
@@ -587,35 +588,37 @@ class Image(object):
         """
 
         m_p2f = self.hdr.get_best_affine()
-        aug = np.hstack((np.asarray(coordi), np.ones((len(coordi), 1))))
-        ret = np.empty_like(coordi, dtype=np.float64)
-        for idx_coord, coord in enumerate(aug):
-            phys = np.matmul(m_p2f, coord)
-            ret[idx_coord] = phys[:3]
-        return ret
+        return _apply_affine(m_p2f, coordi, dtype=dtype)
 
-
-    def transfo_phys2pix(self, coordi, real=True):
+    def transfo_phys2pix(self, coordi, real=True, dtype=np.float64):
         """
         This function returns the pixels coordinates of all points of 'coordi'
 
         :param coordi: sequence of (nb_points x 3) values containing the pixel coordinate of points.
         :param real: whether to return real pixel coordinates
+        :param dtype: floating point type used for the computation and the output (np.float64 or np.float32)
         :return: sequence with the physical coordinates of the points in the space of the image.
         """
 
-        m_p2f = self.hdr.get_best_affine()
-        m_f2p = np.linalg.inv(m_p2f)
-        aug = np.hstack((np.asarray(coordi), np.ones((len(coordi), 1))))
-        ret = np.empty_like(coordi, dtype=np.float64)
-        for idx_coord, coord in enumerate(aug):
-            phys = np.matmul(m_f2p, coord)
-            ret[idx_coord] = phys[:3]
+        m_f2p = self.get_inverse_affine()
+        ret = _apply_affine(m_f2p, coordi, dtype=dtype)
         if real:
             return np.int32(np.round(ret))
         else:
             return ret
 
+    def get_inverse_affine(self):
+        """
+        Return the inverse of the header's best affine (physical to pixel), computed once per affine.
+
+        The result is cached on the Image and recomputed only when the header affine changes.
+        """
+        m_p2f = self.hdr.get_best_affine()
+        key = m_p2f.tobytes()
+        cache = getattr(self, '_inverse_affine_cache', None)
+        if cache is None or cache[0] != key:
+            cache = self._inverse_affine_cache = (key, np.linalg.inv(m_p2f))
+        return cache[1]
 
     def get_values(self, coordi=None, interpolation_mode=0, border='constant', cval=0.0):
         """
@@ -709,7 +712,7 @@ class Image(object):
         """
         nx, ny, nz, nt, px, py, pz, pt = im_ref.dim
         x, y, z = np.mgrid[0:nx, 0:ny, 0:nz]
-        indexes_ref = np.array(list(zip(x.ravel(), y.ravel(), z.ravel())))
+        indexes_ref = np.stack((x.ravel(), y.ravel(), z.ravel()), axis=1)
         physical_coordinates_ref = im_ref.transfo_pix2phys(indexes_ref)
 
         # TODO: add optional transformation from reference space to image space to physical coordinates of ref grid.
@@ -732,6 +735,26 @@ class Image(object):
         return im_output
 
 
+def _apply_affine(affine, coordi, dtype=np.float64):
+    """
+    Apply a 4x4 affine to a batch of 3D points in a single product.
+
+    The einsum performs the same per-point reduction as ``np.matmul(affine, [x, y, z, 1])``,
+    so float64 results are bit-identical to transforming each point separately.
+
+    :param affine: 4x4 array
+    :param coordi: sequence of (nb_points x 3) coordinates
+    :param dtype: floating point type used for the computation and the output
+    :return: (nb_points x 3) array of transformed coordinates
+    """
+    coordi = np.asarray(coordi)
+    aug = np.empty((len(coordi), 4), dtype=dtype)
+    aug[:, :3] = coordi
+    aug[:, 3] = 1
+    ret = np.einsum('ij,nj->ni', np.asarray(affine[:3], dtype=dtype), aug)
+    return ret.reshape(coordi.shape)
+
+
 def compute_dice(image1, image2, mode='3d', label=1, zboundaries=False):
     """
     This function computes the Dice coefficient between two binary images.
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Slice-wise translation motion estimation, in-process with NumPy/SciPy.
+#
+# Same model as isct_antsSliceRegularizedRegistration with a Translation transform: each axial
+# slice of the moving volume is translated in-plane (Tx, Ty), and the translations are
+# regularized along z with a polynomial. The translation of each slice is initialized by FFT
+# phase correlation, then refined with Gauss-Newton iterations on the (masked) mean squares
+# between the slices, and a weighted least-squares polynomial is finally fitted along z.
+#
+# Conventions: translations are in voxels, from a destination (fixed) voxel to the corresponding
+# source (moving) voxel, i.e. the moved slice is src(x + tx, y + ty).
+#
+# The translations of all the volumes of a time series are stored in a single .npz file (MotionParams), as the
+# displacement of each slice in ITK physical space (same values as the warping fields of ANTs), along with the header
+# of the fixed image: the warping field of a volume is only built when the volume is moved.
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+from __future__ import division, absolute_import
+
+import numpy as np
+import nibabel
+from scipy.ndimage import gaussian_filter
+
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.warping import resample_points, _is_inside
+
+# Minimum number of voxels of a slice (within the mask) for its translation to be estimated
+MIN_VOXELS = 10
+
+
+def estimate_translations(data_src, data_dest, mask=None, metric='MeanSquares', poly=2, smooth=0, iterations=10):
+    """
+    Estimate the in-plane translation of each axial slice of a moving volume onto a fixed volume.
+
+    :param data_src: 3D array: moving volume
+    :param data_dest: 3D array: fixed volume, of the same shape
+    :param mask: 3D array or None: voxels of the fixed volume considered by the metric
+    :param metric: {'MeanSquares', 'CC', 'MI'}: with CC and MI, the intensities of each slice are standardized (zero mean,
+        unit variance within the mask) before computing the mean squares, which makes the estimation insensitive to
+        linear intensity changes between volumes
+    :param poly: int: degree of the polynomial fitted along z. 0: no regularization.
+    :param smooth: float or sequence: sigma (in voxels) of the Gaussian smoothing applied to both slices
+    :param iterations: int: maximum number of Gauss-Newton iterations
+    :return: translations: (nz, 2) array of (tx, ty) in voxels; is_valid: (nz,) bool array of the slices that could be
+        registered. Slices that could not be registered get the value of the polynomial (0 if poly=0).
+    """
+    data_src = np.asarray(data_src, dtype=np.float64)
+    data_dest = np.asarray(data_dest, dtype=np.float64)
+    nx, ny, nz = data_dest.shape
+    weight = np.ones(data_dest.shape) if mask is None else (np.asarray(mask) > 0).astype(np.float64)
+
+    # smoothing (in-plane only: slices are registered independently)
+    sigma = np.broadcast_to(np.asarray(smooth, dtype=np.float64), (2,))
+    if np.any(sigma > 0):
+        data_src = gaussian_filter(data_src, tuple(sigma) + (0,))
+        data_dest = gaussian_filter(data_dest, tuple(sigma) + (0,))
+    if metric in ['CC', 'MI']:
+        data_src = _standardize_slices(data_src, weight)
+        data_dest = _standardize_slices(data_dest, weight)
+
+    translations = _phase_correlation(data_src * weight, data_dest * weight)
+    translations, is_valid = _refine_translations(data_src, data_dest, weight, translations, iterations)
+
+    if poly > 0 and np.any(is_valid):
+        z = np.arange(nz)
+        deg = min(poly, np.count_nonzero(is_valid) - 1)
+        count = weight.sum(axis=(0, 1))[is_valid]
+        for i in range(2):
+            coeffs = np.polyfit(z[is_valid], translations[is_valid, i], deg, w=np.sqrt(count))
+            translations[:, i] = np.polyval(coeffs, z)
+    else:
+        translations[~is_valid] = 0
+    return translations, is_valid
+
+
+def translate_slices(data, translations, interp='spline'):
+    """
+    Translate each axial slice of a volume (same sampling as spinalcordtoolbox.warping.apply_transforms with a
+    slice-wise constant warping field).
+
+    :param data: 3D array
+    :param translations: (nz, 2) array of (tx, ty) in voxels
+    :param interp: {'nn', 'linear', 'spline'}
+    :return: 3D float32 array
+    """
+    coords = _get_coords(data.shape, translations).reshape(-1, 3)
+    return resample_points(data, coords, interp=interp, inside=_is_inside(coords, data.shape)).reshape(data.shape)
+
+
+class MotionParams(object):
+    """
+    Slice-wise translations of the volumes of a time series, stored as the displacement of each slice in ITK physical
+    space (LPS+, in mm), from a destination point to the corresponding source point, with the header of the fixed
+    image, which defines the grid of the warping fields.
+    """
+    def __init__(self, displacement, header):
+        """
+        :param displacement: (nt, nz, 3) array
+        :param header: nibabel header of the fixed image
+        """
+        self.displacement = np.asarray(displacement, dtype=np.float64)
+        self.header = header if isinstance(header, nibabel.Nifti1Header) else nibabel.Nifti1Header.from_header(header)
+
+    @classmethod
+    def from_translations(cls, translations, im_dest):
+        """
+        :param translations: (nt, nz, 2) array of (tx, ty) in voxels
+        :param im_dest: Image: fixed image
+        :return: MotionParams
+        """
+        translations = np.asarray(translations, dtype=np.float64)
+        # from voxel to physical displacement (RAS+), then to ITK (LPS+)
+        affine = im_dest.hdr.get_best_affine()
+        displacement = np.dot(np.concatenate((translations, np.zeros(translations.shape[:-1] + (1,))), axis=-1),
+                              affine[:3, :3].T)
+        displacement[..., :2] = -displacement[..., :2]
+        return cls(displacement, im_dest.hdr)
+
+    @classmethod
+    def load(cls, fname):
+        """
+        :param fname: str: .npz file written by MotionParams.save
+        :return: MotionParams
+        """
+        with np.load(fname) as npz:
+            return cls(npz['displacement'], nibabel.Nifti1Header(binaryblock=npz['header'].tobytes()))
+
+    def save(self, fname):
+        np.savez(fname, displacement=self.displacement, header=np.frombuffer(self.header.binaryblock, dtype=np.uint8))
+
+    def to_translations(self):
+        """
+        :return: (nt, nz, 2) array of (tx, ty) in voxels
+        """
+        displacement = self.displacement.copy()
+        displacement[..., :2] = -displacement[..., :2]
+        return np.dot(displacement, np.linalg.inv(self.header.get_best_affine()[:3, :3]).T)[..., :2]
+
+    def to_warp(self, it):
+        """
+        Warping field of a volume (ITK convention, as output by isct_antsSliceRegularizedRegistration).
+
+        :param it: int: index of the volume
+        :return: Image of shape (nx, ny, nz, 1, 3)
+        """
+        nx, ny, nz = self.header.get_data_shape()[:3]
+        data_warp = np.zeros((nx, ny, nz, 1, 3), dtype=np.float32)
+        data_warp[...] = self.displacement[it][np.newaxis, np.newaxis, :, np.newaxis, :]
+        im_warp = Image(data_warp, hdr=self.header.copy())
+        im_warp.hdr.set_data_dtype(np.float32)
+        im_warp.hdr.set_intent('vector', (), '')
+        return im_warp
+
+
+def _standardize_slices(data, weight):
+    """Zero mean and unit variance of each slice, within the weights"""
+    count = np.maximum(weight.sum(axis=(0, 1)), 1)
+    mean = (data * weight).sum(axis=(0, 1)) / count
+    std = np.sqrt((((data - mean) ** 2) * weight).sum(axis=(0, 1)) / count)
+    return (data - mean) / np.where(std > 0, std, 1)
+
+
+def _phase_correlation(data_src, data_dest):
+    """
+    Integer translation of each slice maximizing the phase correlation, refined to subvoxel precision with a parabola
+    around the peak.
+
+    :return: (nz, 2) array of (tx, ty) in voxels
+    """
+    nx, ny, nz = data_dest.shape
+    cross_power = np.fft.fft2(data_src, axes=(0, 1)) * np.conj(np.fft.fft2(data_dest, axes=(0, 1)))
+    cross_power /= np.maximum(np.abs(cross_power), 1e-12)
+    correlation = np.real(np.fft.ifft2(cross_power, axes=(0, 1)))
+    peak = correlation.reshape(nx * ny, nz).argmax(axis=0)
+    px, py = np.unravel_index(peak, (nx, ny))
+    z = np.arange(nz)
+    translations = np.zeros((nz, 2))
+    for i, (p, n) in enumerate([(px, nx), (py, ny)]):
+        prev = [(px - 1) % nx, py] if i == 0 else [px, (py - 1) % ny]
+        next = [(px + 1) % nx, py] if i == 0 else [px, (py + 1) % ny]
+        c0, cm, cp = correlation[px, py, z], correlation[prev[0], prev[1], z], correlation[next[0], next[1], z]
+        denom = cm - 2 * c0 + cp
+        offset = np.where(denom < 0, 0.5 * (cm - cp) / np.where(denom < 0, denom, -1), 0)
+        # wrap around: translations are within [-n/2, n/2[
+        translations[:, i] = (p + n // 2) % n - n // 2 + np.clip(offset, -0.5, 0.5)
+    return translations
+
+
+def _get_coords(shape, translations):
+    """Voxel coordinates (nx, ny, nz, 3) of the source points, for slice-wise translations"""
+    x, y, z = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), np.arange(shape[2]), indexing='ij')
+    return np.stack((x + translations[:, 0], y + translations[:, 1], z.astype(np.float64)), axis=-1)
+
+
+def _interp_slices(arrays, translations):
+    """
+    Bilinear interpolation of arrays of shape (k, nx, ny, nz) at (x + tx, y + ty) in each slice, with the coordinates
+    clamped to the slices (as map_coordinates with mode='nearest'). As the translation is constant within a slice, the
+    interpolation weights are shared by all the voxels of the slice, and the neighbours are gathered with one index
+    array per axis.
+    """
+    k, nx, ny, nz = arrays.shape
+    floor = np.floor(translations)
+    frac = translations - floor
+    values = np.empty(arrays.shape)
+    for iz in range(nz):
+        x0 = np.arange(nx) + int(floor[iz, 0])
+        y0 = np.arange(ny) + int(floor[iz, 1])
+        fx, fy = frac[iz]
+        slices = arrays[..., iz]
+        slices = slices.take(x0, axis=1, mode='clip') * (1 - fx) + slices.take(x0 + 1, axis=1, mode='clip') * fx
+        values[..., iz] = slices.take(y0, axis=2, mode='clip') * (1 - fy) + \
+            slices.take(y0 + 1, axis=2, mode='clip') * fy
+    return values
+
+
+def _refine_translations(data_src, data_dest, weight, translations, iterations, tol=1e-3):
+    """
+    Gauss-Newton iterations on the weighted mean squares between the translated source slices and the destination
+    slices, for all slices at once. Source points which fall outside of the slices are ignored.
+
+    :return: translations: (nz, 2) array; is_valid: (nz,) bool array
+    """
+    nx, ny, nz = data_dest.shape
+    arrays = np.stack((data_src,) + tuple(np.gradient(data_src, axis=(0, 1))))
+    translations = translations.copy()
+    for _ in range(iterations):
+        inside_x = (np.arange(nx)[:, np.newaxis] + translations[:, 0] >= 0) & \
+                   (np.arange(nx)[:, np.newaxis] + translations[:, 0] <= nx - 1)
+        inside_y = (np.arange(ny)[:, np.newaxis] + translations[:, 1] >= 0) & \
+                   (np.arange(ny)[:, np.newaxis] + translations[:, 1] <= ny - 1)
+        w = weight * (inside_x[:, np.newaxis, :] & inside_y[np.newaxis, :, :])
+        values, gx, gy = _interp_slices(arrays, translations)
+        residual = values - data_dest
+        # normal equations of each slice
+        jacobian = np.stack((gx, gy))
+        hessian = np.einsum('ixyz,jxyz,xyz->zij', jacobian, jacobian, w)
+        gradient = np.einsum('ixyz,xyz->zi', jacobian, w * residual)
+        det = np.linalg.det(hessian)
+        is_valid = (w.sum(axis=(0, 1)) >= MIN_VOXELS) & \
+                   (det > 1e-12 * np.maximum(hessian.trace(axis1=1, axis2=2), 1e-12) ** 2)
+        if not np.any(is_valid):
+            break
+        step = np.zeros((nz, 2))
+        step[is_valid] = -np.linalg.solve(hessian[is_valid], gradient[is_valid][..., np.newaxis])[..., 0]
+        # a slice may not move by more than one voxel per iteration
+        step = np.clip(step, -1, 1)
+        translations += step
+        if np.abs(step).max() < tol:
+            break
+    return translations, is_valid
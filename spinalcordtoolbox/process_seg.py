@@ -6,7 +6,15 @@ from __future__ import absolute_import
 
 import math
 import platform
+import functools
+import multiprocessing
 import numpy as np
+from scipy import ndimage
+from scipy.spatial import ConvexHull
+try:
+    from scipy.spatial import QhullError
+except ImportError:  # scipy < 1.8
+    from scipy.spatial.qhull import QhullError
 from skimage import measure, transform
 from tqdm import tqdm
 import logging
@@ -18,7 +26,8 @@ from spinalcordtoolbox.centerline.core import ParamCenterline, get_centerline
 from spinalcordtoolbox.resampling import resample_nib
 
 
-def compute_shape(segmentation, angle_correction=True, param_centerline=None, verbose=1):
+def compute_shape(segmentation, angle_correction=True, param_centerline=None, verbose=1, n_jobs=1,
+                  engine='regionprops'):
     """
     Compute morphometric measures of the spinal cord in the transverse (axial) plane from the segmentation.
     The segmentation could be binary or weighted for partial volume [0,1].
@@ -26,6 +35,11 @@ def compute_shape(segmentation, angle_correction=True, param_centerline=None, ve
     :param angle_correction:
     :param param_centerline: see centerline.core.ParamCenterline()
     :param verbose:
+    :param n_jobs: int: number of processes used to compute the slice-wise properties. 0 or negative: use all available
+    CPUs.
+    :param engine: {'regionprops', 'moments'}: method used to compute the slice-wise properties. 'regionprops': on the
+    slice upsampled 5x (see _properties2d). 'moments': from weighted image moments at native resolution (see
+    _properties2d_moments).
     :return metrics: Dict of class Metric(). If a metric cannot be calculated, its value will be nan.
     :return fit_results: class centerline.core.FitResults()
     """
@@ -60,70 +74,46 @@ def compute_shape(segmentation, angle_correction=True, param_centerline=None, ve
     shape_properties = {key: np.full_like(np.empty(nz), np.nan, dtype=np.double) for key in property_list}
 
     fit_results = None
+    n_slices = max_z_index - min_z_index + 1
 
     if angle_correction:
         # compute the spinal cord centerline based on the spinal cord segmentation
         # here, param_centerline.minmax needs to be False because we need to retrieve the total number of input slices
         _, arr_ctl, arr_ctl_der, fit_results = get_centerline(im_segr, param=param_centerline, verbose=verbose)
+        # Extract tangent vectors to the centerline (i.e. its derivative), for all slices
+        tangent_vect = np.stack([np.asarray(arr_ctl_der[0][:n_slices]) * px,
+                                 np.asarray(arr_ctl_der[1][:n_slices]) * py,
+                                 np.full(n_slices, pz, dtype=np.float64)], axis=1)
+        # Normalize vectors by their L2 norm
+        tangent_vect /= np.linalg.norm(tangent_vect, axis=1)[:, np.newaxis]
+        # Compute the angle about AP axis between the centerline and the normal vector to the slice
+        angle_AP_rad = np.arctan2(tangent_vect[:, 0], tangent_vect[:, 2])
+        # Compute the angle about RL axis between the centerline and the normal vector to the slice
+        angle_RL_rad = np.arctan2(tangent_vect[:, 1], tangent_vect[:, 2])
+        # Apply affine transformation to account for the angle between the centerline and the normal to the patch
+        patches = _crop_and_scale_slices(data_seg[:, :, min_z_index:max_z_index + 1],
+                                         np.stack([np.cos(angle_AP_rad), np.cos(angle_RL_rad)], axis=1))
+    else:
+        angle_AP_rad, angle_RL_rad = np.zeros(n_slices), np.zeros(n_slices)
+        patches = _crop_and_scale_slices(data_seg[:, :, min_z_index:max_z_index + 1])
 
-    # Loop across z and compute shape analysis
-    for iz in tqdm(range(min_z_index, max_z_index + 1), unit='iter', unit_scale=False, desc="Compute shape analysis",
-                   ascii=True, ncols=80):
-        # Extract 2D patch
-        current_patch = im_segr.data[:, :, iz]
-        if angle_correction:
-            # Extract tangent vector to the centerline (i.e. its derivative)
-            tangent_vect = np.array([arr_ctl_der[0][iz - min_z_index] * px,
-                                     arr_ctl_der[1][iz - min_z_index] * py,
-                                     pz])
-            # Normalize vector by its L2 norm
-            tangent_vect = tangent_vect / np.linalg.norm(tangent_vect)
-            # Compute the angle about AP axis between the centerline and the normal vector to the slice
-            v0 = [tangent_vect[0], tangent_vect[2]]
-            v1 = [0, 1]
-            angle_AP_rad = np.math.atan2(np.linalg.det([v0, v1]), np.dot(v0, v1))
-            # Compute the angle about RL axis between the centerline and the normal vector to the slice
-            v0 = [tangent_vect[1], tangent_vect[2]]
-            v1 = [0, 1]
-            angle_RL_rad = np.math.atan2(np.linalg.det([v0, v1]), np.dot(v0, v1))
-            # Apply affine transformation to account for the angle between the centerline and the normal to the patch
-            tform = transform.AffineTransform(scale=(np.cos(angle_RL_rad), np.cos(angle_AP_rad)))
-            # Convert to float64, to avoid problems in image indexation causing issues when applying transform.warp
-            current_patch = current_patch.astype(np.float64)
-            # TODO: make sure pattern does not go extend outside of image border
-            current_patch_scaled = transform.warp(current_patch,
-                                                  tform.inverse,
-                                                  output_shape=current_patch.shape,
-                                                  order=1,
-                                                  )
-        else:
-            current_patch_scaled = current_patch
-            angle_AP_rad, angle_RL_rad = 0.0, 0.0
-        # compute shape properties on 2D patch
-        shape_property = _properties2d(current_patch_scaled, [px, py])
+    # Compute shape properties on each 2D patch
+    properties2d = {'regionprops': _properties2d, 'moments': _properties2d_moments}[engine]
+    list_shape_property = _map_slices(functools.partial(properties2d, dim=[px, py]),
+                                      [patches[:, :, i] for i in range(n_slices)], n_jobs=n_jobs)
+    for i, shape_property in enumerate(list_shape_property):
+        iz = min_z_index + i
         if shape_property is not None:
             # Add custom fields
-            shape_property['angle_AP'] = angle_AP_rad * 180.0 / math.pi
-            shape_property['angle_RL'] = angle_RL_rad * 180.0 / math.pi
-            shape_property['length'] = pz / (np.cos(angle_AP_rad) * np.cos(angle_RL_rad))
+            shape_property['angle_AP'] = angle_AP_rad[i] * 180.0 / math.pi
+            shape_property['angle_RL'] = angle_RL_rad[i] * 180.0 / math.pi
+            shape_property['length'] = pz / (np.cos(angle_AP_rad[i]) * np.cos(angle_RL_rad[i]))
             # Loop across properties and assign values for function output
             for property_name in property_list:
                 shape_properties[property_name][iz] = shape_property[property_name]
         else:
             logging.warning('\nNo properties for slice: {}'.format(iz))
 
-        """ DEBUG
-        from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-        from matplotlib.figure import Figure
-        fig = Figure()
-        FigureCanvas(fig)
-        ax = fig.add_subplot(111)
-        ax.imshow(current_patch_scaled)
-        ax.grid()
-        ax.set_xlabel('y')
-        ax.set_ylabel('x')
-        fig.savefig('tmp_fig.png')
-        """
     metrics = {}
     for key, value in shape_properties.items():
         # Making sure all entries added to metrics have results
@@ -133,6 +123,58 @@ def compute_shape(segmentation, angle_correction=True, param_centerline=None, ve
     return metrics, fit_results
 
 
+def _crop_and_scale_slices(data, scale=None, pad=5):
+    """
+    Crop all axial slices to the bounding box of the segmentation and, if scale factors are provided, stretch each
+    slice. This gives, for all slices at once, the same values as
+    transform.warp(slice, transform.AffineTransform(scale=(scale[:, 1], scale[:, 0])).inverse, order=1) in the
+    cropped region.
+    :param data: 3D array (x, y, z) of axial slices
+    :param scale: (nz, 2) array of scale factors (<= 1) along x and y for each slice. If None, slices are only cropped.
+    :param pad: number of voxels kept around the bounding box
+    :return: 3D array of cropped slices
+    """
+    nx, ny, nz = data.shape
+    X, Y = np.nonzero(np.any(data, axis=2))
+    if not len(X):
+        return data
+    if scale is None:
+        return data[max(X.min() - pad, 0):min(X.max() + 1 + pad, nx),
+                    max(Y.min() - pad, 0):min(Y.max() + 1 + pad, ny)]
+
+    # Output grid: the object is shrunk towards the origin of the slice, so the lower bound depends on the scale
+    x_out = np.arange(max(int(np.floor(X.min() * scale[:, 0].min())) - pad, 0), min(X.max() + 1 + pad, nx))
+    y_out = np.arange(max(int(np.floor(Y.min() * scale[:, 1].min())) - pad, 0), min(Y.max() + 1 + pad, ny))
+    # Coordinates in the input slice of each output voxel
+    coords = np.broadcast_arrays(x_out[:, np.newaxis, np.newaxis] * (1.0 / scale[:, 0]),
+                                 y_out[np.newaxis, :, np.newaxis] * (1.0 / scale[:, 1]),
+                                 np.arange(nz)[np.newaxis, np.newaxis, :])
+    return ndimage.map_coordinates(data.astype(np.float64), coords, order=1, mode='constant', cval=0.0)
+
+
+def _map_slices(func, slices, n_jobs=1):
+    """
+    Apply a function to each slice, serially or with a pool of processes, and return the results in order.
+    :param func: picklable function
+    :param slices: list of 2D arrays
+    :param n_jobs: int: number of processes. 0 or negative: use all available CPUs.
+    :return: list
+    """
+    if n_jobs <= 0:
+        n_jobs = multiprocessing.cpu_count()
+    n_jobs = min(n_jobs, len(slices))
+    kwargs = dict(total=len(slices), unit='iter', unit_scale=False, desc="Compute shape analysis", ascii=True,
+                  ncols=80)
+    if n_jobs <= 1:
+        return [func(s) for s in tqdm(slices, **kwargs)]
+    pool = multiprocessing.Pool(n_jobs)
+    try:
+        return list(tqdm(pool.imap(func, slices, chunksize=max(1, len(slices) // (4 * n_jobs))), **kwargs))
+    finally:
+        pool.close()
+        pool.join()
+
+
 def _properties2d(image, dim):
     """
     Compute shape property of the input 2D image. Accounts for partial volume information.
@@ -198,6 +240,75 @@ def _properties2d(image, dim):
     return properties
 
 
+def _properties2d_moments(image, dim):
+    """
+    Compute shape property of the input 2D image, from the image moments of the partial volume mask at native resolution
+    (no upsampling). Same outputs as _properties2d:
+    - area: sum of the partial volume mask
+    - diameters, eccentricity and orientation: from the ellipse having the same second-order moments as the object.
+      Moments are computed on the partial volume mask, and corrected by the variance of a uniform pixel (1/12) to
+      approximate the moments of the continuous shape.
+    - solidity: area of the sub-pixel contour at 0.5 divided by the area of its convex hull.
+    :param image: 2D input image in uint8 or float (weighted for partial volume) that has a single object.
+    :param dim: [px, py]: Physical dimension of the image (in mm). X,Y respectively correspond to AP,RL.
+    :return:
+    """
+    # Check if slice is empty
+    if not image.any():
+        logging.debug('The slice is empty.')
+        return None
+    # Normalize between 0 and 1
+    image_norm = (image - image.min()) / (image.max() - image.min())
+    image_norm = image_norm.astype(np.float64)
+    # Check number of regions on the binarized image (normally there is only one)
+    _, n_regions = ndimage.label(image_norm > 0.5)
+    if n_regions > 1:
+        logging.debug('There is more than one object on this slice.')
+        return None
+    # Raw and central moments, weighted by partial volume
+    m00 = image_norm.sum()
+    rows, cols = np.indices(image_norm.shape, dtype=np.float64)
+    centroid = (np.sum(rows * image_norm) / m00, np.sum(cols * image_norm) / m00)
+    d_rows, d_cols = rows - centroid[0], cols - centroid[1]
+    cov_rr = np.sum(d_rows ** 2 * image_norm) / m00 + 1 / 12.
+    cov_cc = np.sum(d_cols ** 2 * image_norm) / m00 + 1 / 12.
+    cov_rc = np.sum(d_rows * d_cols * image_norm) / m00
+    # Eigenvalues of the covariance matrix, and orientation of the major axis with respect to the rows axis (same
+    # convention as measure.regionprops)
+    delta = np.sqrt(((cov_rr - cov_cc) / 2) ** 2 + cov_rc ** 2)
+    eigval_max = (cov_rr + cov_cc) / 2 + delta
+    eigval_min = max((cov_rr + cov_cc) / 2 - delta, 0)
+    if cov_rr - cov_cc == 0:
+        orientation = -math.pi / 4. if cov_rc <= 0 else math.pi / 4.
+    else:
+        orientation = 0.5 * math.atan2(2 * cov_rc, cov_rr - cov_cc)
+    orientation = fix_orientation(orientation)
+    [diameter_AP, diameter_RL] = \
+        _find_AP_and_RL_diameter(4 * np.sqrt(eigval_max), 4 * np.sqrt(eigval_min), orientation, dim)
+    # Solidity from the sub-pixel contour (image padded to close the contour)
+    contours = measure.find_contours(np.pad(image_norm, 1, mode='constant'), 0.5)
+    solidity = np.nan
+    if contours:
+        contour = max(contours, key=len)
+        area_contour = 0.5 * np.abs(np.dot(contour[:, 0], np.roll(contour[:, 1], 1)) -
+                                    np.dot(contour[:, 1], np.roll(contour[:, 0], 1)))
+        try:
+            solidity = area_contour / ConvexHull(contour).volume
+        except QhullError:
+            logging.debug('Could not compute the convex hull of the contour.')
+    # Fill up dictionary
+    properties = {'area': m00 * dim[0] * dim[1],
+                  'diameter_AP': diameter_AP,
+                  'diameter_RL': diameter_RL,
+                  'centroid': centroid,
+                  'eccentricity': np.sqrt(1 - eigval_min / eigval_max),
+                  'orientation': orientation,
+                  'solidity': solidity  # convexity measure
+    }
+
+    return properties
+
+
 def fix_orientation(orientation):
     """Re-map orientation from skimage.regionprops from [-pi/2,pi/2] to [0,90] and rotate by 90deg because image axis
     are inverted"""
@@ -11,9 +11,16 @@ import logging
 import warnings
 import datetime
 import io
-from string import Template
+import subprocess
+import multiprocessing
 from shutil import copyfile
 
+try:
+    import fcntl
+except ImportError:
+    # no file locking (Windows)
+    fcntl = None
+
 warnings.filterwarnings("ignore")
 
 import numpy as np
@@ -29,10 +36,23 @@ import matplotlib.colors as color
 import sct_utils as sct
 from spinalcordtoolbox.image import Image
 import spinalcordtoolbox.reports.slice as qcslice
+from spinalcordtoolbox.reports import raster
 from spinalcordtoolbox import __sct_dir__
 
 logger = logging.getLogger(__name__)
 
+# Modes of generate_qc (default: environment variable SCT_QC_MODE, or 'sync'):
+# - 'sync': the entry is rendered by the calling command
+# - 'queue': the entry is only queued in the QC folder, and rendered later with render_queue() ("sct_qc -render-queue")
+# - 'background': the entry is queued, and the queue is rendered by a detached process
+QC_MODES = ('sync', 'queue', 'background')
+# Sub-folder of the QC folder containing the queued entries
+QUEUE_FOLDER = '_queue'
+# Index of the entries of the QC folder, loaded by index.html. It is only appended to: each line adds the description of
+# one entry, formatted with INDEX_LINE (a script rather than a JSON file, so that browsers load it from a local folder).
+INDEX_FILE = os.path.join('_json', 'index.js')
+INDEX_LINE = 'sct_data.push({});\n'
+
 
 class QcImage(object):
     """
@@ -68,9 +88,10 @@ class QcImage(object):
                      "#7d0434", "#fb1849", "#14aab4",
                      "#a22abd", "#d58240", "#ac2aff"]
     # _seg_colormap = plt.cm.autumn
+    _color_atlas = [(1, 1, 1, 0), (0, 0, 1, 0.7), (0, 1, 1, 0.8)]
 
     def __init__(self, qc_report, interpolation, action_list, stretch_contrast=True,
-                 stretch_contrast_method='contrast_stretching', angle_line=None):
+                 stretch_contrast_method='contrast_stretching', angle_line=None, backend='raster'):
         """
 
         Parameters
@@ -84,6 +105,8 @@ class QcImage(object):
         stretch_contrast : adjust image so as to improve contrast
         stretch_contrast_method: {'contrast_stretching', 'equalized'}: Method for stretching contrast
         angle_line: [float]: See generate_qc()
+        backend: {'raster', 'matplotlib'}: With 'raster', the images are drawn with NumPy (see reports.raster) if all
+            the actions have a raster version (see _raster_actions), and with matplotlib otherwise.
         """
         self.qc_report = qc_report
         self.interpolation = interpolation
@@ -92,6 +115,7 @@ class QcImage(object):
         self._stretch_contrast_method = stretch_contrast_method
         self._angle_line = angle_line
         self._centermass = None  # center of mass returned by slice.Axial.get_center()
+        self._backend = backend
     """
     action_list contain the list of images that has to be generated.
     It can be seen as "figures" of matplotlib to be shown
@@ -222,6 +246,32 @@ class QcImage(object):
         ax.get_xaxis().set_visible(False)
         ax.get_yaxis().set_visible(False)
 
+    def raster_listed_seg(self, mask, canvas):
+        """Raster version of listed_seg"""
+        canvas.draw_array(raster.apply_lut(np.rint(mask), raster.lut_from_colors(self._color_bin_red, 2), vmin=0,
+                                           vmax=1, visible=mask >= 1))
+
+    def raster_template(self, mask, canvas):
+        """Raster version of template"""
+        values = mask
+        values[values < 0.5] = 0
+        canvas.draw_array(raster.apply_lut(values, raster.lut_from_colors(self._color_atlas)))
+
+    def raster_no_seg_seg(self, mask, canvas):
+        """Raster version of no_seg_seg"""
+        canvas.draw_array(raster.apply_lut(mask, raster.LUT_GRAY))
+        self._raster_orientation_label(canvas)
+
+    def raster_vertical_line(self, mask, canvas):
+        """Raster version of vertical_line"""
+        canvas.draw_vline(mask.shape[1] / 2.0, 2 * self.qc_report.qc_params.dpi / 72, '#ff0000')
+
+    # raster version of each action, by name. Actions without a raster version (annotations) need matplotlib.
+    _raster_actions = {'listed_seg': raster_listed_seg,
+                       'template': raster_template,
+                       'no_seg_seg': raster_no_seg_seg,
+                       'vertical_line': raster_vertical_line}
+
     # def colorbar(self):
     #     fig = plt.figure(figsize=(9, 1.5))
     #     ax = fig.add_axes([0.05, 0.80, 0.9, 0.15])
@@ -301,13 +351,31 @@ class QcImage(object):
 
                 img = func_stretch_contrast[self._stretch_contrast_method](img)
 
-            fig = Figure()
             # if axial mosaic restrict width
             if sct_slice.get_name() == 'Axial':
                 size_fig = [5, 5 * img.shape[0] / img.shape[1]]  # with dpi=300, will give 1500pix width
             # if sagittal orientation restrict height
             elif sct_slice.get_name() == 'Sagittal':
                 size_fig = [5 * img.shape[1] / img.shape[0], 5]
+
+            if self._backend == 'raster' and all(action.__name__ in self._raster_actions
+                                                 for action in self.action_list):
+                dpi = self.qc_report.qc_params.dpi
+                size = (int(size_fig[0] * dpi), int(size_fig[1] * dpi))
+                canvas = raster.Canvas(img.shape, float(aspect_img), size)
+                canvas.draw_array(raster.apply_lut(img, raster.LUT_GRAY))
+                self._raster_orientation_label(canvas)
+                canvas.save(self.qc_report.qc_params.abs_bkg_img_path())
+                for action in self.action_list:
+                    if self._stretch_contrast and action.__name__ in ("no_seg_seg",):
+                        mask = func_stretch_contrast[self._stretch_contrast_method](mask)
+                    canvas = raster.Canvas(mask.shape, float(self.aspect_mask), size)
+                    self._raster_actions[action.__name__](self, mask, canvas)
+                    canvas.save(self.qc_report.qc_params.abs_overlay_img_path())
+                self.qc_report.update_description_file(img.shape)
+                return
+
+            fig = Figure()
             fig.set_size_inches(size_fig[0], size_fig[1], forward=True)
             FigureCanvas(fig)
             ax = fig.add_axes((0, 0, 1, 1))
@@ -346,6 +414,13 @@ class QcImage(object):
             ax.text(0, 18, 'L', color='yellow', size=4)
             ax.text(24, 18, 'R', color='yellow', size=4)
 
+    def _raster_orientation_label(self, canvas):
+        """Raster version of _add_orientation_label"""
+        if self.qc_report.qc_params.orientation == 'Axial':
+            height = 4 * raster.CAP_HEIGHT * self.qc_report.qc_params.dpi / 72
+            for text, x, y in [('A', 12, 6), ('P', 12, 28), ('L', 0, 18), ('R', 24, 18)]:
+                canvas.draw_text(text, x, y, height, '#ffff00')
+
     def _save(self, fig, img_path, format='png', bbox_inches='tight', pad_inches=0.00, dpi=300):
         """
         Save the current figure into an image.
@@ -421,11 +496,12 @@ class QcReport(object):
     It will also setup the folder structure so the report generator only needs to fetch the appropriate files.
     """
 
-    def __init__(self, qc_params, usage):
+    def __init__(self, qc_params, usage, update_html=True):
         """
         Parameters
         :param qc_params: arguments of the "-param-qc" option in Terminal
         :param usage: str: description of the process
+        :param update_html: bool: rebuild index.html once the description file is written
         """
         self.tool_name = qc_params.command
         self.slice_name = qc_params.orientation
@@ -434,6 +510,7 @@ class QcReport(object):
         self.assets_folder = os.path.join(__sct_dir__, 'assets')
         self.img_base_name = 'bkg_img'
         self.description_base_name = "qc_results"
+        self.update_html = update_html
 
     def make_content_path(self):
         """Creates the whole directory to contain the QC report
@@ -477,30 +554,73 @@ class QcReport(object):
         path_json, _ = os.path.split(self.qc_params.qc_results)
         if not os.path.exists(path_json):
             os.makedirs(path_json)
-        # Create json file
-        with open(self.qc_params.qc_results, 'w+') as qc_file:
-            json.dump(output, qc_file, indent=1)
-        self._update_html_assets(get_json_data_from_path(path_json))
-
-    def _update_html_assets(self, json_data):
-        """Update the html file and assets"""
-        assets_path = os.path.join(os.path.dirname(__file__), 'assets')
-        dest_path = self.qc_params.root_folder
-
-        with io.open(os.path.join(assets_path, 'index.html')) as template_index:
-            template = Template(template_index.read())
-            output = template.substitute(sct_json_data=json.dumps(json_data))
-            io.open(os.path.join(dest_path, 'index.html'), 'w').write(output)
-
-        for path in ['css', 'js', 'imgs', 'fonts']:
-            src_path = os.path.join(assets_path, '_assets', path)
-            dest_full_path = os.path.join(dest_path, '_assets', path)
-            if not os.path.exists(dest_full_path):
-                os.makedirs(dest_full_path)
-            for file_ in os.listdir(src_path):
-                if not os.path.isfile(os.path.join(dest_full_path, file_)):
-                    sct.copy(os.path.join(src_path, file_),
-                             dest_full_path)
+        # Create json file, and add it to the index
+        with open(os.path.join(self.qc_params.root_folder, INDEX_FILE), 'a') as f_index:
+            _lock(f_index)
+            try:
+                with open(self.qc_params.qc_results, 'w+') as qc_file:
+                    json.dump(output, qc_file, indent=1)
+                if os.fstat(f_index.fileno()).st_size == 0:
+                    # new index: also list the entries of QC folders created before the index existed
+                    json_data = get_json_data_from_path(path_json)
+                else:
+                    json_data = [output]
+                f_index.write(''.join(INDEX_LINE.format(json.dumps(entry)) for entry in json_data))
+                f_index.flush()
+            finally:
+                _unlock(f_index)
+        if self.update_html:
+            update_html_index(self.qc_params.root_folder)
+
+
+def _lock(f):
+    """Wait for an exclusive lock on an open file"""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def read_index(path_qc):
+    """
+    Read the index of a QC folder (see INDEX_FILE).
+
+    :param path_qc: str: QC folder
+    :return: list of dict: description of the entries, in the order they were added
+    """
+    prefix, suffix = INDEX_LINE.split('{}')
+    with io.open(os.path.join(path_qc, INDEX_FILE)) as f_index:
+        return [json.loads(line[len(prefix):-len(suffix)]) for line in f_index if line.endswith(suffix)]
+
+
+def update_html_index(path_qc):
+    """
+    Copy index.html and the html assets to the QC folder, if they are missing or outdated. The entries are not written
+    in index.html, which loads them from the index.
+    """
+    assets_path = os.path.join(os.path.dirname(__file__), 'assets')
+
+    with io.open(os.path.join(assets_path, 'index.html')) as template_index:
+        template = template_index.read()
+    fname_html = os.path.join(path_qc, 'index.html')
+    if not os.path.isfile(fname_html) or io.open(fname_html).read() != template:
+        # other processes may read index.html meanwhile: replace it at once
+        fname_tmp = '{}.{}.tmp'.format(fname_html, os.getpid())
+        io.open(fname_tmp, 'w').write(template)
+        os.rename(fname_tmp, fname_html)
+
+    for path in ['css', 'js', 'imgs', 'fonts']:
+        src_path = os.path.join(assets_path, '_assets', path)
+        dest_full_path = os.path.join(path_qc, '_assets', path)
+        if not os.path.exists(dest_full_path):
+            os.makedirs(dest_full_path)
+        for file_ in os.listdir(src_path):
+            if not os.path.isfile(os.path.join(dest_full_path, file_)):
+                sct.copy(os.path.join(src_path, file_),
+                         dest_full_path)
 
 
 def add_entry(src, process, args, path_qc, plane, path_img=None, path_img_overlay=None,
@@ -511,7 +631,9 @@ def add_entry(src, process, args, path_qc, plane, path_img=None, path_img_overla
               stretch_contrast_method='contrast_stretching',
               angle_line=None,
               dataset=None,
-              subject=None):
+              subject=None,
+              update_html=True,
+              backend='raster'):
     """
     Create QC report.
 
@@ -530,15 +652,17 @@ def add_entry(src, process, args, path_qc, plane, path_img=None, path_img_overla
     :param angle_line: [float]: See generate_qc()
     :param dataset: str: Dataset name
     :param subject: str: Subject name
+    :param update_html: bool: rebuild index.html of the QC folder, and display how to open it
+    :param backend: {'raster', 'matplotlib'}: See QcImage
     :return:
     """
 
     qc_param = Params(src, process, args, plane, path_qc, dpi, dataset, subject)
-    report = QcReport(qc_param, '')
+    report = QcReport(qc_param, '', update_html=update_html)
 
     if qcslice is not None:
         @QcImage(report, 'none', qcslice_operations, stretch_contrast_method=stretch_contrast_method,
-                 angle_line=angle_line)
+                 angle_line=angle_line, backend=backend)
         def layout(qslice):
             return qcslice_layout(qslice)
 
@@ -557,6 +681,12 @@ def add_entry(src, process, args, path_qc, plane, path_img=None, path_img_overla
             copyfile(path_img, qc_param.abs_overlay_img_path())
 
     sct.printv('Successfully generated the QC results in %s' % qc_param.qc_results)
+    if update_html:
+        display_open_syntax(path_qc)
+
+
+def display_open_syntax(path_qc):
+    """Display the command to open the QC report in a browser"""
     sct.printv('Use the following command to see the results in a browser:')
     try:
         from sys import platform as _platform
@@ -580,11 +710,14 @@ def add_entry(src, process, args, path_qc, plane, path_img=None, path_img_overla
 
 
 def generate_qc(fname_in1, fname_in2=None, fname_seg=None, angle_line=None, args=None, path_qc=None, dataset=None,
-                subject=None, path_img=None, process=None):
+                subject=None, path_img=None, process=None, mode=None):
     """
     Generate a QC entry allowing to quickly review results. This function is the entry point and is called by SCT
     scripts (e.g. sct_propseg).
 
+    With mode='queue' or 'background', the entry is written in the queue of the QC folder and the function returns
+    without rendering it (see QC_MODES). Input files are then read when the entry is rendered, so they must still exist.
+
     :param fname_in1: str: File name of input image #1 (mandatory)
     :param fname_in2: str: File name of input image #2
     :param fname_seg: str: File name of input segmentation
@@ -596,8 +729,27 @@ def generate_qc(fname_in1, fname_in2=None, fname_seg=None, angle_line=None, args
     :param subject: str: Subject name
     :param path_img: dict: Path to image to display (e.g., a graph), instead of computing the image from MRI.
     :param process: str: Name of SCT function. e.g., sct_propseg
+    :param mode: {'sync', 'queue', 'background'}: See QC_MODES. Default: environment variable SCT_QC_MODE, or 'sync'.
     :return: None
     """
+    if mode is None:
+        mode = os.environ.get('SCT_QC_MODE', 'sync')
+    if mode not in QC_MODES:
+        raise ValueError("Unrecognized QC mode: {}".format(mode))
+    entry = dict(fname_in1=fname_in1, fname_in2=fname_in2, fname_seg=fname_seg, angle_line=angle_line, args=args,
+                 path_qc=path_qc, dataset=dataset, subject=subject, path_img=path_img, process=process)
+    if mode == 'sync':
+        _render_qc(**entry)
+        return
+    fname_entry = queue_entry(entry)
+    sct.printv('QC entry queued in %s' % fname_entry)
+    if mode == 'background':
+        render_queue_in_background(path_qc)
+
+
+def _render_qc(fname_in1, fname_in2=None, fname_seg=None, angle_line=None, args=None, path_qc=None, dataset=None,
+               subject=None, path_img=None, process=None, update_html=True):
+    """Render a QC entry (see generate_qc)"""
     logger.info('\n*** Generate Quality Control (QC) html report ***')
     dpi = 300
     plane = None
@@ -670,10 +822,121 @@ def generate_qc(fname_in1, fname_in2=None, fname_seg=None, angle_line=None, args
         qcslice_operations=qcslice_operations,
         qcslice_layout=qcslice_layout,
         stretch_contrast_method='equalized',
-        angle_line=angle_line
+        angle_line=angle_line,
+        update_html=update_html
     )
 
 
+def queue_entry(entry):
+    """
+    Write a QC entry in the queue of its QC folder, to be rendered later by render_queue(). Paths are made absolute, and
+    the current directory is stored.
+
+    :param entry: dict: arguments of generate_qc
+    :return: str: file name of the queued entry
+    """
+    entry = dict(entry)
+    for key in ['fname_in1', 'fname_in2', 'fname_seg', 'path_img', 'path_qc']:
+        if entry[key] is not None:
+            entry[key] = os.path.abspath(entry[key])
+    if entry['angle_line'] is not None:
+        entry['angle_line'] = [float(angle) for angle in entry['angle_line']]
+    # arguments are stored as displayed in the report
+    if isinstance(entry['args'], list):
+        entry['args'] = sct.list2cmdline(entry['args'])
+    elif entry['args'] is not None:
+        entry['args'] = str(entry['args'])
+    entry['cwd'] = os.getcwd()
+    path_queue = os.path.join(entry['path_qc'], QUEUE_FOLDER)
+    if not os.path.isdir(path_queue):
+        os.makedirs(path_queue)
+    fname_entry = os.path.join(path_queue, 'qc_{}_{}.json'.format(
+        datetime.datetime.now().strftime('%Y_%m_%d_%H%M%S.%f'), os.getpid()))
+    # renderers only read complete entries
+    with open(fname_entry + '.tmp', 'w') as f:
+        json.dump(entry, f, indent=1)
+    os.rename(fname_entry + '.tmp', fname_entry)
+    return fname_entry
+
+
+def render_queue_in_background(path_qc):
+    """
+    Render the queue of a QC folder in a detached process ("sct_qc -render-queue"), which outlives the calling command.
+    Its output is appended to render.log in the queue folder.
+    """
+    path_queue = os.path.join(path_qc, QUEUE_FOLDER)
+    cmd = [sys.executable, os.path.join(__sct_dir__, 'scripts', 'sct_qc.py'), '-qc', os.path.abspath(path_qc),
+           '-render-queue']
+    with open(os.path.join(path_queue, 'render.log'), 'a') as log:
+        subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, close_fds=True,
+                         preexec_fn=getattr(os, 'setsid', None))
+
+
+def render_queue(path_qc, n_jobs=1):
+    """
+    Render the queued entries of a QC folder, serially or with a pool of processes, then rebuild index.html once.
+
+    Each entry is claimed (renamed) before it is rendered, so that several renderers can run on the same queue. Entries
+    which cannot be rendered are renamed with the suffix ".failed".
+
+    :param path_qc: str: QC folder
+    :param n_jobs: int: number of processes. 0 or negative: use all available CPUs.
+    :return: (number of rendered entries, number of failed entries)
+    """
+    fnames = sorted(glob.glob(os.path.join(path_qc, QUEUE_FOLDER, '*.json')))
+    nb_rendered, nb_failed = 0, 0
+    if n_jobs <= 0:
+        n_jobs = multiprocessing.cpu_count()
+    n_jobs = min(n_jobs, len(fnames))
+    if n_jobs <= 1:
+        results = [_render_queued_entry(fname) for fname in fnames]
+    else:
+        pool = multiprocessing.Pool(n_jobs)
+        try:
+            results = list(pool.imap_unordered(_render_queued_entry, fnames))
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    for status in results:
+        nb_rendered += status is True
+        nb_failed += status is False
+    if nb_rendered:
+        update_html_index(path_qc)
+    return nb_rendered, nb_failed
+
+
+def _render_queued_entry(fname):
+    """
+    Render a queued entry, from the directory it was queued from.
+
+    :return: True if rendered, False if failed, None if claimed by another renderer
+    """
+    fname_claimed = fname + '.rendering'
+    try:
+        os.rename(fname, fname_claimed)
+    except OSError:
+        return None
+    with open(fname_claimed) as f:
+        entry = json.load(f)
+    curdir = os.getcwd()
+    try:
+        if os.path.isdir(entry['cwd']):
+            os.chdir(entry['cwd'])
+        del entry['cwd']
+        _render_qc(update_html=False, **entry)
+    except Exception:
+        logger.exception('Could not render QC entry %s', fname)
+        os.rename(fname_claimed, fname + '.failed')
+        return False
+    finally:
+        os.chdir(curdir)
+    os.remove(fname_claimed)
+    return True
+
+
 def get_json_data_from_path(path_json):
     """Read all json files present in the given path, and output an aggregated json structure"""
     results = []
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+#########################################################################################
+#
+# Rasterization of QC images with NumPy, without matplotlib.
+#
+# The mosaics of reports.slice are drawn as matplotlib's imshow(interpolation='none') would draw them in axes filling
+# the figure: resampled (nearest neighbour) into the largest box centered in the image which keeps the aspect ratio of
+# the voxels, and colored with lookup tables. Orientation labels are drawn with a small bitmap font.
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+from __future__ import division, absolute_import
+
+import numpy as np
+import skimage.io
+
+# Number of colors of the lookup tables (as matplotlib's colormaps)
+N_COLORS = 256
+
+# Bitmaps (7 rows of 5 columns) of the characters of the orientation labels
+_GLYPHS = {
+    'A': ['.###.', '#...#', '#...#', '#####', '#...#', '#...#', '#...#'],
+    'P': ['####.', '#...#', '#...#', '####.', '#....', '#....', '#....'],
+    'L': ['#....', '#....', '#....', '#....', '#....', '#....', '#####'],
+    'R': ['####.', '#...#', '#...#', '####.', '#.#..', '#..#.', '#...#'],
+}
+# Height of capital letters, relative to the font size (DejaVu Sans, the default font of matplotlib)
+CAP_HEIGHT = 0.73
+
+
+def to_rgba(color):
+    """
+    :param color: str '#rrggbb' or tuple of 3 or 4 floats in [0, 1]
+    :return: tuple of 4 floats in [0, 1]
+    """
+    if isinstance(color, str):
+        color = tuple(int(color[i:i + 2], 16) / 255 for i in (1, 3, 5))
+    return tuple(color) + (1.,) * (4 - len(color))
+
+
+def lut_from_colors(colors, n=N_COLORS):
+    """
+    Lookup table interpolating linearly between colors evenly spaced in [0, 1] (as
+    matplotlib.colors.LinearSegmentedColormap.from_list).
+
+    :param colors: list of colors (see to_rgba)
+    :param n: int: number of entries
+    :return: (n, 4) uint8 array
+    """
+    colors = np.array([to_rgba(color) for color in colors])
+    if len(colors) == n:
+        lut = colors
+    else:
+        x = np.linspace(0, 1, n)
+        lut = np.stack([np.interp(x, np.linspace(0, 1, len(colors)), colors[:, i]) for i in range(4)], axis=1)
+    return (lut * 255).astype(np.uint8)
+
+
+LUT_GRAY = lut_from_colors(['#000000', '#ffffff'])
+
+
+def apply_lut(data, lut, vmin=None, vmax=None, visible=None):
+    """
+    Color an array with a lookup table, after normalizing it to [vmin, vmax] (as matplotlib.colors.Normalize).
+
+    :param data: 2D array
+    :param lut: (n, 4) uint8 array
+    :param vmin, vmax: float: range of data mapped to the lookup table. Default: range of data.
+    :param visible: 2D bool array or None: points which are not transparent
+    :return: (rows, cols, 4) uint8 array
+    """
+    data = np.asarray(data, dtype=np.float64)
+    vmin = data.min() if vmin is None else vmin
+    vmax = data.max() if vmax is None else vmax
+    if vmax > vmin:
+        index = np.clip(((data - vmin) / (vmax - vmin) * len(lut)), 0, len(lut) - 1).astype(int)
+    else:
+        index = np.zeros(data.shape, dtype=int)
+    rgba = lut[index]
+    if visible is not None:
+        rgba[~visible] = 0
+    return rgba
+
+
+def get_layout(shape, aspect, size):
+    """
+    Box where an array is drawn in an image: the largest box centered in the image with the aspect ratio of the array.
+
+    :param shape: (rows, cols) of the array
+    :param aspect: float: height / width of a pixel of the array
+    :param size: (width, height) of the image, in pixels
+    :return: (x0, y0, width, height) of the box, in pixels
+    """
+    rows, cols = shape[:2]
+    width, height = size
+    ratio = rows * aspect / cols
+    if ratio > height / width:
+        box_width, box_height = max(1, int(round(height / ratio))), height
+    else:
+        box_width, box_height = width, max(1, int(round(width * ratio)))
+    return (width - box_width) // 2, (height - box_height) // 2, box_width, box_height
+
+
+class Canvas(object):
+    """
+    Transparent RGBA image of a figure, with the box where arrays of a given shape are drawn (see get_layout).
+    Coordinates of the arrays are those of matplotlib's imshow: (x, y) = (column, row) at the center of the pixels.
+    """
+    def __init__(self, shape, aspect, size):
+        """
+        :param shape: (rows, cols) of the arrays
+        :param aspect: float: height / width of a pixel of the arrays
+        :param size: (width, height) of the image, in pixels
+        """
+        self.shape = tuple(shape[:2])
+        self.image = np.zeros((size[1], size[0], 4), dtype=np.uint8)
+        self.box = get_layout(shape, aspect, size)
+
+    def draw_array(self, rgba):
+        """Draw an RGBA array in the box, resampled with nearest neighbour"""
+        rows, cols = self.shape
+        x0, y0, width, height = self.box
+        ix = ((np.arange(width) + 0.5) * cols / width).astype(int)
+        iy = ((np.arange(height) + 0.5) * rows / height).astype(int)
+        self.image[y0:y0 + height, x0:x0 + width] = rgba[iy[:, np.newaxis], ix[np.newaxis, :]]
+
+    def data_to_pixel(self, x, y):
+        """Pixel of the image at the coordinates (x, y) of the arrays"""
+        rows, cols = self.shape
+        x0, y0, width, height = self.box
+        return int(round(x0 + (x + 0.5) * width / cols)), int(round(y0 + (y + 0.5) * height / rows))
+
+    def draw_vline(self, x, linewidth, color):
+        """Vertical line across the box, at the coordinate x of the arrays, linewidth in pixels"""
+        x0, y0, width, height = self.box
+        xc, _ = self.data_to_pixel(x, 0)
+        start = max(x0, xc - int(round(linewidth / 2)))
+        stop = min(x0 + width, start + max(1, int(round(linewidth))))
+        self.image[y0:y0 + height, start:stop] = np.array(to_rgba(color)) * 255
+
+    def draw_text(self, text, x, y, height, color):
+        """
+        Draw text with the bitmap font, clipped to the box.
+
+        :param text: str: characters of _GLYPHS
+        :param x, y: float: left end of the baseline, in coordinates of the arrays
+        :param height: float: height of capital letters, in pixels
+        :param color: see to_rgba
+        """
+        scale = max(1, int(round(height / 7)))
+        px, py = self.data_to_pixel(x, y)
+        layer = np.zeros(self.image.shape[:2], dtype=bool)
+        for char in text:
+            glyph = np.kron(np.array([[c == '#' for c in row] for row in _GLYPHS[char]]),
+                            np.ones((scale, scale), dtype=bool))
+            top, left = py - glyph.shape[0], px
+            # clip the glyph to the image
+            top_clip, left_clip = max(top, 0), max(left, 0)
+            bottom_clip = min(top + glyph.shape[0], layer.shape[0])
+            right_clip = min(left + glyph.shape[1], layer.shape[1])
+            if bottom_clip > top_clip and right_clip > left_clip:
+                layer[top_clip:bottom_clip, left_clip:right_clip] |= \
+                    glyph[top_clip - top:bottom_clip - top, left_clip - left:right_clip - left]
+            px += 6 * scale
+        x0, y0, width, height = self.box
+        inside = np.zeros_like(layer)
+        inside[y0:y0 + height, x0:x0 + width] = True
+        self.image[layer & inside] = np.array(to_rgba(color)) * 255
+
+    def save(self, fname):
+        """Write the image as PNG"""
+        skimage.io.imsave(fname, self.image, check_contrast=False)
@@ -8,7 +8,7 @@
 
 from __future__ import absolute_import
 
-import os, time, logging, inspect
+import os, time, logging, inspect, multiprocessing
 import bisect
 import numpy as np
 from tqdm import tqdm
@@ -18,6 +18,7 @@ from spinalcordtoolbox.types import Centerline
 import spinalcordtoolbox.image as msct_image
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.centerline.core import ParamCenterline, get_centerline
+from spinalcordtoolbox.warping import apply_transforms
 
 import sct_utils as sct
 from sct_image import pad_image
@@ -25,11 +26,17 @@ from sct_image import pad_image
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of voxels processed at once when computing the warping fields (bounds the memory usage)
+SLAB_MAX_VOXELS = 2 ** 18
+
+# Arguments of the slab functions, shared with worker processes (see _init_slab_worker)
+_slab_args = None
+
 
 class SpinalCordStraightener(object):
     def __init__(self, input_filename, centerline_filename, debug=0, param_centerline=ParamCenterline(),
                  interpolation_warp='spline', rm_tmp_files=1, verbose=1, precision=2.0, threshold_distance=10,
-                 output_filename=''):
+                 output_filename='', n_jobs=1, engine='ants'):
         self.input_filename = input_filename
         self.centerline_filename = centerline_filename
         self.output_filename = output_filename
@@ -47,6 +54,8 @@ class SpinalCordStraightener(object):
         self.speed_factor = 1.0  # Speed parameter
         self.xy_size = 70  # in mm
         self.param_centerline = param_centerline
+        self.n_jobs = n_jobs  # number of processes used to compute the warping fields (0: all available CPUs)
+        self.engine = engine  # engine used to apply the warping fields: 'ants' or 'native' (see warping.py)
 
         # QC metrics
         self.accuracy_results = 0
@@ -427,70 +436,27 @@ class SpinalCordStraightener(object):
         lookup_straight2curved = np.array(lookup_straight2curved)
 
         # Create volumes containing curved and straight warping fields
-        data_warp_curved2straight = np.zeros((nx_s, ny_s, nz_s, 1, 3))
-        data_warp_straight2curved = np.zeros((nx, ny, nz, 1, 3))
+        data_warp_curved2straight = np.zeros((nx_s, ny_s, nz_s, 1, 3), dtype=np.float32)
+        data_warp_straight2curved = np.zeros((nx, ny, nz, 1, 3), dtype=np.float32)
 
         # 5. compute transformations
         # Curved and straight images and the same dimensions, so we compute both warping fields at the same time.
         # b. determine which plane of spinal cord centreline it is included
-        # sct.printv(nx * ny * nz, nx_s * ny_s * nz_s)
-
+        # Voxels are processed by slabs of several z-slices to limit the Python overhead while bounding memory usage.
+        # Slabs are independent, so slabs of both warping fields can be dispatched to a pool of processes.
+        data_warp = {'curved2straight': data_warp_curved2straight, 'straight2curved': data_warp_straight2curved}
+        slab_args = {}
         if self.curved2straight:
-            for u in tqdm(range(nz_s)):
-                x_s, y_s, z_s = np.mgrid[0:nx_s, 0:ny_s, u:u + 1]
-                indexes_straight = np.array(list(zip(x_s.ravel(), y_s.ravel(), z_s.ravel())))
-                physical_coordinates_straight = image_centerline_straight.transfo_pix2phys(indexes_straight)
-                nearest_indexes_straight = centerline_straight.find_nearest_indexes(physical_coordinates_straight)
-                distances_straight = centerline_straight.get_distances_from_planes(physical_coordinates_straight,
-                                                                                   nearest_indexes_straight)
-                lookup = lookup_straight2curved[nearest_indexes_straight]
-                indexes_out_distance_straight = np.logical_or(
-                    np.logical_or(distances_straight > self.threshold_distance,
-                                  distances_straight < -self.threshold_distance), lookup == 0)
-                projected_points_straight = centerline_straight.get_projected_coordinates_on_planes(
-                    physical_coordinates_straight, nearest_indexes_straight)
-                coord_in_planes_straight = centerline_straight.get_in_plans_coordinates(projected_points_straight,
-                                                                                        nearest_indexes_straight)
-
-                coord_straight2curved = centerline.get_inverse_plans_coordinates(coord_in_planes_straight, lookup)
-                displacements_straight = coord_straight2curved - physical_coordinates_straight
-                # Invert Z coordinate as ITK & ANTs physical coordinate system is LPS- (RAI+)
-                # while ours is LPI-
-                # Refs: https://sourceforge.net/p/advants/discussion/840261/thread/2a1e9307/#fb5a
-                #  https://www.slicer.org/wiki/Coordinate_systems
-                displacements_straight[:, 2] = -displacements_straight[:, 2]
-                displacements_straight[indexes_out_distance_straight] = [100000.0, 100000.0, 100000.0]
-
-                data_warp_curved2straight[indexes_straight[:, 0], indexes_straight[:, 1], indexes_straight[:, 2], 0, :]\
-                    = -displacements_straight
-
+            slab_args['curved2straight'] = (_compute_curved2straight_slab, (
+                image_centerline_straight, centerline_straight, centerline, lookup_straight2curved,
+                self.threshold_distance))
         if self.straight2curved:
-            for u in tqdm(range(nz)):
-                x, y, z = np.mgrid[0:nx, 0:ny, u:u + 1]
-                indexes = np.array(list(zip(x.ravel(), y.ravel(), z.ravel())))
-                physical_coordinates = image_centerline_pad.transfo_pix2phys(indexes)
-                nearest_indexes_curved = centerline.find_nearest_indexes(physical_coordinates)
-                distances_curved = centerline.get_distances_from_planes(physical_coordinates,
-                                                                        nearest_indexes_curved)
-                lookup = lookup_curved2straight[nearest_indexes_curved]
-                indexes_out_distance_curved = np.logical_or(
-                    np.logical_or(distances_curved > self.threshold_distance,
-                                  distances_curved < -self.threshold_distance), lookup == 0)
-                projected_points_curved = centerline.get_projected_coordinates_on_planes(physical_coordinates,
-                                                                                         nearest_indexes_curved)
-                coord_in_planes_curved = centerline.get_in_plans_coordinates(projected_points_curved,
-                                                                             nearest_indexes_curved)
-
-                coord_curved2straight = centerline_straight.points[lookup]
-                coord_curved2straight[:, 0:2] += coord_in_planes_curved[:, 0:2]
-                coord_curved2straight[:, 2] += distances_curved
-
-                displacements_curved = coord_curved2straight - physical_coordinates
-
-                displacements_curved[:, 2] = -displacements_curved[:, 2]
-                displacements_curved[indexes_out_distance_curved] = [100000.0, 100000.0, 100000.0]
-
-                data_warp_straight2curved[indexes[:, 0], indexes[:, 1], indexes[:, 2], 0, :] = -displacements_curved
+            slab_args['straight2curved'] = (_compute_straight2curved_slab, (
+                image_centerline_pad, centerline, centerline_straight, lookup_curved2straight,
+                self.threshold_distance))
+        tasks = [(key, z_start, z_end) for key in slab_args for z_start, z_end in _get_slabs(*data_warp[key].shape[:3])]
+        for key, z_start, z_end, warp in _map_slabs(slab_args, tasks, n_jobs=self.n_jobs):
+            data_warp[key][:, :, z_start:z_end, 0, :] = warp
 
         # Creation of the safe zone based on pre-calculated safe boundaries
         coord_bound_curved_inf, coord_bound_curved_sup = image_centerline_pad.transfo_phys2pix(
@@ -522,15 +488,8 @@ class SpinalCordStraightener(object):
         image_centerline_straight.save(fname_ref)
         if self.curved2straight:
             logger.info('Apply transformation to input image...')
-            sct.run(['isct_antsApplyTransforms',
-                     '-d', '3',
-                     '-r', fname_ref,
-                     '-i', 'data.nii',
-                     '-o', 'tmp.anat_rigid_warp.nii.gz',
-                     '-t', 'tmp.curve2straight.nii.gz',
-                     '-n', 'BSpline[3]'],
-                    is_sct_binary=True,
-                    verbose=verbose)
+            self._apply_warp('data.nii', fname_ref, 'tmp.curve2straight.nii.gz', 'tmp.anat_rigid_warp.nii.gz',
+                             'spline')
 
         if self.accuracy_results:
             time_accuracy_results = time.time()
@@ -538,15 +497,8 @@ class SpinalCordStraightener(object):
             # Ideally, the error should be zero.
             # Apply deformation to input image
             logger.info('Apply transformation to centerline image...')
-            sct.run(['isct_antsApplyTransforms',
-                     '-d', '3',
-                     '-r', fname_ref,
-                     '-i', 'centerline.nii.gz',
-                     '-o', 'tmp.centerline_straight.nii.gz',
-                     '-t', 'tmp.curve2straight.nii.gz',
-                     '-n', 'NearestNeighbor'],
-                    is_sct_binary=True,
-                    verbose=verbose)
+            self._apply_warp('centerline.nii.gz', fname_ref, 'tmp.curve2straight.nii.gz',
+                             'tmp.centerline_straight.nii.gz', 'nn')
             file_centerline_straight = Image('tmp.centerline_straight.nii.gz', verbose=verbose)
             nx, ny, nz, nt, px, py, pz, pt = file_centerline_straight.dim
             coordinates_centerline = file_centerline_straight.getNonZeroCoordinates(sorting='z')
@@ -619,6 +571,160 @@ class SpinalCordStraightener(object):
 
         return fname_straight
 
+    def _apply_warp(self, fname_src, fname_dest, fname_warp, fname_out, interp):
+        """
+        Apply a warping field with the selected engine (isct_antsApplyTransforms or in-process).
+
+        :param interp: {'nn', 'linear', 'spline'}
+        """
+        if self.engine == 'native':
+            apply_transforms(Image(fname_src), Image(fname_dest), [fname_warp], interp=interp).save(fname_out)
+        else:
+            sct.run(['isct_antsApplyTransforms',
+                     '-d', '3',
+                     '-r', fname_dest,
+                     '-i', fname_src,
+                     '-o', fname_out,
+                     '-t', fname_warp] + sct.get_interpolation('isct_antsApplyTransforms', interp),
+                    is_sct_binary=True,
+                    verbose=self.verbose)
+
+
+def _init_slab_worker(slab_args):
+    """
+    Share the arguments of the slab functions (images, centerlines and their KD-trees, look-up tables) with the
+    current process. With the fork start method, worker processes inherit them without copy.
+    """
+    global _slab_args
+    _slab_args = slab_args
+
+
+def _compute_slab(task):
+    key, z_start, z_end = task
+    fn, args = _slab_args[key]
+    return key, z_start, z_end, fn(*args, z_start=z_start, z_end=z_end)
+
+
+def _map_slabs(slab_args, tasks, n_jobs=1):
+    """
+    Compute the warping field of each slab, serially or with a pool of processes.
+
+    :param slab_args: dict {key: (slab function, arguments)}
+    :param tasks: list of (key, z_start, z_end)
+    :param n_jobs: int: number of processes. 0 or negative: use all available CPUs.
+    :return: generator of (key, z_start, z_end, warping field of the slab), in order of completion
+    """
+    if n_jobs <= 0:
+        n_jobs = multiprocessing.cpu_count()
+    n_jobs = min(n_jobs, len(tasks))
+    if n_jobs <= 1:
+        _init_slab_worker(slab_args)
+        try:
+            for task in tqdm(tasks):
+                yield _compute_slab(task)
+        finally:
+            _init_slab_worker(None)
+        return
+
+    logger.info('Computing warping fields with {} processes'.format(n_jobs))
+    pool = multiprocessing.Pool(n_jobs, initializer=_init_slab_worker, initargs=(slab_args,))
+    try:
+        for result in tqdm(pool.imap_unordered(_compute_slab, tasks), total=len(tasks)):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _get_slabs(nx, ny, nz, max_voxels=SLAB_MAX_VOXELS):
+    """
+    Split the z-axis of a volume into slabs of consecutive slices containing at most max_voxels voxels (at least one
+    slice per slab).
+
+    :return: list of (z_start, z_end) tuples
+    """
+    slab_size = max(1, max_voxels // (nx * ny))
+    return [(z, min(z + slab_size, nz)) for z in range(0, nz, slab_size)]
+
+
+def _get_slab_indexes(nx, ny, z_start, z_end):
+    """
+    Return the voxel indexes of slices z_start to z_end (excluded) as a (nx * ny * (z_end - z_start), 3) array, with
+    the same ordering as np.mgrid.
+    """
+    x, y, z = np.mgrid[0:nx, 0:ny, z_start:z_end]
+    return np.stack((x.ravel(), y.ravel(), z.ravel()), axis=1)
+
+
+def _compute_curved2straight_slab(image_straight, centerline_straight, centerline_curved, lookup_straight2curved,
+                                  threshold_distance, z_start, z_end):
+    """
+    Compute the curved-to-straight warping field on a slab of the straight space.
+
+    :return: float32 array (nx_s, ny_s, z_end - z_start, 3) of the warping field (ITK convention)
+    """
+    nx_s, ny_s = image_straight.data.shape[:2]
+    indexes_straight = _get_slab_indexes(nx_s, ny_s, z_start, z_end)
+    physical_coordinates_straight = image_straight.transfo_pix2phys(indexes_straight)
+    nearest_indexes_straight = centerline_straight.find_nearest_indexes(physical_coordinates_straight)
+    distances_straight = centerline_straight.get_distances_from_planes(physical_coordinates_straight,
+                                                                       nearest_indexes_straight)
+    lookup = lookup_straight2curved[nearest_indexes_straight]
+    indexes_out_distance_straight = np.logical_or(
+        np.logical_or(distances_straight > threshold_distance,
+                      distances_straight < -threshold_distance), lookup == 0)
+    projected_points_straight = centerline_straight.get_projected_coordinates_on_planes(
+        physical_coordinates_straight, nearest_indexes_straight)
+    coord_in_planes_straight = centerline_straight.get_in_plans_coordinates(projected_points_straight,
+                                                                            nearest_indexes_straight)
+
+    coord_straight2curved = centerline_curved.get_inverse_plans_coordinates(coord_in_planes_straight, lookup)
+    displacements_straight = coord_straight2curved - physical_coordinates_straight
+    # Invert Z coordinate as ITK & ANTs physical coordinate system is LPS- (RAI+)
+    # while ours is LPI-
+    # Refs: https://sourceforge.net/p/advants/discussion/840261/thread/2a1e9307/#fb5a
+    #  https://www.slicer.org/wiki/Coordinate_systems
+    displacements_straight[:, 2] = -displacements_straight[:, 2]
+    displacements_straight[indexes_out_distance_straight] = [100000.0, 100000.0, 100000.0]
+
+    return (-displacements_straight).astype(np.float32).reshape(nx_s, ny_s, z_end - z_start, 3)
+
+
+def _compute_straight2curved_slab(image_curved, centerline_curved, centerline_straight, lookup_curved2straight,
+                                  threshold_distance, z_start, z_end):
+    """
+    Compute the straight-to-curved warping field on a slab of the curved space.
+
+    :return: float32 array (nx, ny, z_end - z_start, 3) of the warping field (ITK convention)
+    """
+    nx, ny = image_curved.data.shape[:2]
+    indexes = _get_slab_indexes(nx, ny, z_start, z_end)
+    physical_coordinates = image_curved.transfo_pix2phys(indexes)
+    nearest_indexes_curved = centerline_curved.find_nearest_indexes(physical_coordinates)
+    distances_curved = centerline_curved.get_distances_from_planes(physical_coordinates, nearest_indexes_curved)
+    lookup = lookup_curved2straight[nearest_indexes_curved]
+    indexes_out_distance_curved = np.logical_or(
+        np.logical_or(distances_curved > threshold_distance,
+                      distances_curved < -threshold_distance), lookup == 0)
+    projected_points_curved = centerline_curved.get_projected_coordinates_on_planes(physical_coordinates,
+                                                                                    nearest_indexes_curved)
+    coord_in_planes_curved = centerline_curved.get_in_plans_coordinates(projected_points_curved,
+                                                                        nearest_indexes_curved)
+
+    coord_curved2straight = centerline_straight.points[lookup]
+    coord_curved2straight[:, 0:2] += coord_in_planes_curved[:, 0:2]
+    coord_curved2straight[:, 2] += distances_curved
+
+    displacements_curved = coord_curved2straight - physical_coordinates
+
+    displacements_curved[:, 2] = -displacements_curved[:, 2]
+    displacements_curved[indexes_out_distance_curved] = [100000.0, 100000.0, 100000.0]
+
+    return (-displacements_curved).astype(np.float32).reshape(nx, ny, z_end - z_start, 3)
+
 
 def _get_centerline(img, param_centerline, verbose):
     nx, ny, nz, nt, px, py, pz, pt = img.dim
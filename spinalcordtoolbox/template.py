@@ -10,48 +10,75 @@ import numpy as np
 logger = logging.getLogger(__name__)
 
 
+class VertLevelIndex(object):
+    """
+    Index of the vertebral level of each slice, built once from an image of vertebral labeling, to find the slices of
+    a level, or the level of a slice, without scanning the image again.
+    The level of a slice is the average of its non-null and finite values, rounded to the closest integer.
+    Important: This class assumes that the 3rd dimension is Z.
+    """
+    def __init__(self, im_vertlevel):
+        """
+        :param im_vertlevel: image object of vertebral labeling (e.g., label/template/PAM50_levels.nii.gz)
+        """
+        data_vertlevel = np.asarray(im_vertlevel.data, dtype=np.float64)
+        nz = data_vertlevel.shape[2]
+        # (nvoxels, nz), in case the image is 4D (e.g. labeled segmentation with a trailing dimension)
+        data_vertlevel = np.moveaxis(data_vertlevel, 2, -1).reshape(-1, nz)
+        is_level = (data_vertlevel != 0) & np.isfinite(data_vertlevel)
+        nb_voxels = is_level.sum(axis=0)
+        sum_levels = np.where(is_level, data_vertlevel, 0).sum(axis=0)
+        #: list of int: vertebral level of each slice (None for slices without level)
+        self.levels = [int(np.round(sum_levels[iz] / nb_voxels[iz])) if nb_voxels[iz] else None for iz in range(nz)]
+        self._slices = {}
+        for iz, level in enumerate(self.levels):
+            if level is not None:
+                self._slices.setdefault(level, []).append(iz)
+
+    def __len__(self):
+        return len(self.levels)
+
+    def get_slices(self, level):
+        """
+        :param level: int: vertebral level
+        :return: list of int: slices of this level (empty if the level is not in the image)
+        """
+        return list(self._slices.get(level, []))
+
+    def get_level(self, idx_slice):
+        """
+        :param idx_slice: int: slice (z)
+        :return: int: vertebral level. If no level is found (only zeros on this slice), return None.
+        """
+        return self.levels[idx_slice]
+
+
 def get_slices_from_vertebral_levels(im_vertlevel, level):
     """
     Find the slices of the corresponding vertebral level.
     Important: This function assumes that the 3rd dimension is Z.
-    :param im_vertlevel: image object of vertebral labeling (e.g., label/template/PAM50_levels.nii.gz)
+    :param im_vertlevel: image object of vertebral labeling (e.g., label/template/PAM50_levels.nii.gz), or
+    VertLevelIndex built from it (faster if called several times)
     :param level: int: vertebral level
     :return: list of int: slices
     """
-    data_vertlevel = im_vertlevel.data
-    slices = []
-    # loop across z
-    for iz in range(data_vertlevel.shape[-1]):
-        # fetch non-null and finite values
-        data_vertlevel_nonzero = data_vertlevel[..., iz].flatten()[np.nonzero(data_vertlevel[..., iz].flatten())]
-        data_vertlevel_nonzero_finite = [i for i in data_vertlevel_nonzero if np.isfinite(i)]
-        # avoid empty slice
-        if not data_vertlevel_nonzero_finite == []:
-            # average non-null values and round to closest
-            average_value = int(np.round(np.mean(data_vertlevel_nonzero_finite)))
-            # if that matches the desired level, append it to slice list
-            if average_value == level:
-                slices.append(iz)
-    return slices
+    if not isinstance(im_vertlevel, VertLevelIndex):
+        im_vertlevel = VertLevelIndex(im_vertlevel)
+    return im_vertlevel.get_slices(level)
 
 
 def get_vertebral_level_from_slice(im_vertlevel, idx_slice):
     """
     Find the vertebral level of the corresponding slice.
     Important: This function assumes that the 3rd dimension is Z.
-    :param im_vertlevel: image object of vertebral labeling (e.g., label/template/PAM50_levels.nii.gz)
+    :param im_vertlevel: image object of vertebral labeling (e.g., label/template/PAM50_levels.nii.gz), or
+    VertLevelIndex built from it (faster if called several times)
     :param idx_slice: int: slice (z)
     :return: int: vertebral level. If no level is found (only zeros on this slice), return None.
     """
-    data_vertlevel = im_vertlevel.data
-    # average non-null values and round to closest
-    try:
-        # find indices of non-null values
-        indx, indy = np.where(data_vertlevel[:, :, idx_slice])
-        vert_level = int(np.round(np.mean(data_vertlevel[indx, indy, idx_slice])))
-    except ValueError as e:
-        # slice is empty (no indx found). Do nothing.
-        logger.debug('Empty slice: z=%s (%s)', idx_slice, e)
-        vert_level = None
+    if not isinstance(im_vertlevel, VertLevelIndex):
+        im_vertlevel = VertLevelIndex(im_vertlevel)
+    vert_level = im_vertlevel.get_level(idx_slice)
+    if vert_level is None:
+        logger.debug('Empty slice: z=%s', idx_slice)
     return vert_level
-
@@ -160,11 +160,14 @@ class CoordinateValue(Coordinate):
         return hash(self.value)
 
 
-class Centerline:
+class Centerline(object):
     """
     This class represents a centerline in an image. Its coordinates can be in voxel space as well as in physical space.
     A centerline is defined by its points and the derivatives of each point.
     When initialized, the lenght of the centerline is computed as well as the coordinate reference system of each plane.
+    Geometry is stored in arrays indexed by point: the derivatives (normalized, i.e. the z axis of each plane), the
+    plane parameters (n, 4), the base matrices (n, 3, 3) whose columns are the x, y and z axes of each plane, and their
+    inverses.
     # TODO: Check if the description above is correct. I've tried to input voxel space coordinates, and it broke the
     #  code. For example, the method extract_perpendicular_square() is (i think) expecting physical coordinates.
     """
@@ -211,6 +214,12 @@ class Centerline:
     potential_list_labels = [50, 49, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22,
                              23, 24, 25, 26, 27, 28, 29, 30]
 
+    __slots__ = ('length', 'progressive_length', 'progressive_length_inverse', 'incremental_length',
+                 'incremental_length_inverse', 'first_label', 'last_label', 'disks_levels', 'label_reference',
+                 'compute_init_distribution', 'points', 'derivatives', 'number_of_points', 'plans_parameters',
+                 'matrices', 'inverse_matrices', 'offset_plans', 'tree_points', 'l_points', 'dist_points',
+                 'dist_points_rel', 'index_disk', 'distance_from_C1label')
+
     def __init__(self, points_x=None, points_y=None, points_z=None, deriv_x=None, deriv_y=None, deriv_z=None,
                  fname=None):
         # initialization of variables
@@ -245,19 +254,14 @@ class Centerline:
             # Load centerline data from points and derivatives in parameters
             if points_x is None or points_y is None or points_z is None or deriv_x is None or deriv_y is None or deriv_z is None:
                 raise ValueError('Data must be provided to centerline to be initialized')
-            self.points = np.array(list(zip(points_x, points_y, points_z)))
-            self.derivatives = array(list(zip(deriv_x, deriv_y, deriv_z)))
+            self.points = np.column_stack((points_x, points_y, points_z)).astype(np.float64)
+            self.derivatives = np.column_stack((deriv_x, deriv_y, deriv_z)).astype(np.float64)
 
         self.number_of_points = len(self.points)
 
         # computation of centerline features, based on points and derivatives
         self.compute_length()
-        self.coordinate_system = [self.compute_coordinate_system(index) for index in range(0, self.number_of_points)]
-        self.plans_parameters = [self.get_plan_parameters(index) for index in range(0, self.number_of_points)]
-
-        self.matrices = stack([item[4] for item in self.coordinate_system])
-        self.inverse_matrices = stack([item[5] for item in self.coordinate_system])
-        self.offset_plans = array([item[3] for item in self.plans_parameters])
+        self.compute_coordinate_systems()
 
         # initialization of KDTree for enabling computation of nearest points in centerline
         self.tree_points = cKDTree(self.points)
@@ -266,19 +270,32 @@ class Centerline:
             self.compute_vertebral_distribution(disks_levels=self.disks_levels, label_reference=self.label_reference)
 
     def compute_length(self):
-        for i in range(0, self.number_of_points - 1):
-            distance = np.sqrt((self.points[i][0] - self.points[i + 1][0]) ** 2 +
-                            (self.points[i][1] - self.points[i + 1][1]) ** 2 +
-                            (self.points[i][2] - self.points[i + 1][2]) ** 2)
-            self.length += distance
-            self.progressive_length.append(distance)
-            self.incremental_length.append(self.incremental_length[-1] + distance)
-        for i in range(self.number_of_points - 1, 0, -1):
-            distance = np.sqrt((self.points[i][0] - self.points[i - 1][0]) ** 2 +
-                            (self.points[i][1] - self.points[i - 1][1]) ** 2 +
-                            (self.points[i][2] - self.points[i - 1][2]) ** 2)
-            self.progressive_length_inverse.append(distance)
-            self.incremental_length_inverse.append(self.incremental_length_inverse[-1] + distance)
+        distances = np.sqrt(np.sum(np.diff(self.points, axis=0) ** 2, axis=1))
+        incremental_length = np.cumsum(distances)
+        self.length = float(incremental_length[-1]) if len(distances) else 0.0
+        self.progressive_length = [0.0] + distances.tolist()
+        self.incremental_length = [0.0] + incremental_length.tolist()
+        self.progressive_length_inverse = [0.0] + distances[::-1].tolist()
+        self.incremental_length_inverse = [0.0] + np.cumsum(distances[::-1]).tolist()
+
+    def compute_coordinate_systems(self):
+        """
+        This function computes the coordinate reference system (X, Y, and Z axes) and the plane parameters of all
+        points of the centerline. The derivatives are normalized in place.
+        """
+        z_prime_axis = self.derivatives
+        z_prime_axis /= norm(z_prime_axis, axis=1)[:, np.newaxis]
+        # y axis [0, 1, 0], orthogonalized with respect to z'
+        y_prime_axis = -z_prime_axis[:, 1:2] * z_prime_axis
+        y_prime_axis[:, 1] += 1
+        y_prime_axis /= norm(y_prime_axis, axis=1)[:, np.newaxis]
+        x_prime_axis = cross(y_prime_axis, z_prime_axis)
+        x_prime_axis /= norm(x_prime_axis, axis=1)[:, np.newaxis]
+
+        self.matrices = stack((x_prime_axis, y_prime_axis, z_prime_axis), axis=2)
+        self.inverse_matrices = inv(self.matrices)
+        self.offset_plans = - einsum('ij,ij->i', self.derivatives, self.points)
+        self.plans_parameters = np.column_stack((self.derivatives, self.offset_plans))
 
     def find_nearest_index(self, coord):
         """
@@ -314,16 +331,11 @@ class Centerline:
         :param index: int
         :return: List of parameters [a, b, c, d], corresponding to plane parametric equation a*x + b*y + c*z + d = 0
         """
-        if 0 <= index < self.number_of_points:
-            a = self.derivatives[index][0]
-            b = self.derivatives[index][1]
-            c = self.derivatives[index][2]
-            d = - (a * self.points[index][0] + b * self.points[index][1] + c * self.points[index][2])
-        else:
+        if not 0 <= index < self.number_of_points:
             raise IndexError('ERROR in types.Centerline.get_plan_parameters: index (' + str(index) + ') should be '
                              'within [' + str(0) + ', ' + str(self.number_of_points) + '[.')
 
-        return [a, b, c, d]
+        return self.plans_parameters[index].tolist()
 
     def get_distance_from_plane(self, coord, index, plane_params=None):
         """
@@ -335,7 +347,7 @@ class Centerline:
         from index.
         :return:
         """
-        if plane_params:
+        if plane_params is not None:
             [a, b, c, d] = plane_params
         else:
             [a, b, c, d] = self.plans_parameters[index]
@@ -365,30 +377,17 @@ class Centerline:
 
     def compute_coordinate_system(self, index):
         """
-        This function computes the cordinate reference system (X, Y, and Z axes) for a given index of centerline.
+        This function returns the cordinate reference system (X, Y, and Z axes) for a given index of centerline.
         :param index: int
-        :return:
+        :return: origin, x_prime_axis, y_prime_axis, z_prime_axis, matrix_base, inverse_matrix
         """
-        if 0 <= index < self.number_of_points:
-            origin = self.points[index]
-            z_prime_axis = self.derivatives[index]
-            z_prime_axis /= norm(z_prime_axis)
-            y_axis = array([0, 1, 0])
-            y_prime_axis = (y_axis - dot(y_axis, z_prime_axis) * z_prime_axis)
-            y_prime_axis /= norm(y_prime_axis)
-            x_prime_axis = cross(y_prime_axis, z_prime_axis)
-            x_prime_axis /= norm(x_prime_axis)
-
-            matrix_base = array([[x_prime_axis[0], y_prime_axis[0], z_prime_axis[0]],
-                                 [x_prime_axis[1], y_prime_axis[1], z_prime_axis[1]],
-                                 [x_prime_axis[2], y_prime_axis[2], z_prime_axis[2]]])
-
-            inverse_matrix = inv(matrix_base)
-        else:
+        if not 0 <= index < self.number_of_points:
             raise IndexError('ERROR in types.Centerline.compute_coordinate_system: index (' + str(index) + ') '
                              'should be within [' + str(0) + ', ' + str(self.number_of_points) + '[.')
 
-        return origin, x_prime_axis, y_prime_axis, z_prime_axis, matrix_base, inverse_matrix
+        matrix_base = self.matrices[index]
+        return self.points[index], matrix_base[:, 0], matrix_base[:, 1], matrix_base[:, 2], matrix_base, \
+            self.inverse_matrices[index]
 
     def get_projected_coordinates_on_plane(self, coord, index, plane_params=None):
         """
@@ -398,7 +397,7 @@ class Centerline:
         :param plane_params:
         :return:
         """
-        if plane_params:
+        if plane_params is not None:
             [a, b, c, d] = plane_params
         else:
             [a, b, c, d] = self.plans_parameters[index]
@@ -418,8 +417,7 @@ class Centerline:
         :return:
         """
         if 0 <= index < self.number_of_points:
-            origin, x_prime_axis, y_prime_axis, z_prime_axis, matrix_base, inverse_matrix = self.coordinate_system[index]
-            return inverse_matrix.dot(coord - origin)
+            return self.inverse_matrices[index].dot(coord - self.points[index])
         else:
             raise IndexError('ERROR in types.Centerline.compute_coordinate_system: index (' + str(index) + ') '
                              'should be within [' + str(0) + ', ' + str(self.number_of_points) + '[.')
@@ -64,6 +64,20 @@ class Metavar(Enum):
         return self.value
 
 
+def type_float_range(min_value, max_value, include_max=True):
+    """
+    Type of argparse arguments: float within [min_value, max_value], or [min_value, max_value[ if not include_max.
+    Values out of the range are rejected when the arguments are parsed.
+    """
+    def type_float(value):
+        value = float(value)
+        if not (min_value <= value <= max_value if include_max else min_value <= value < max_value):
+            raise argparse.ArgumentTypeError("{} is not within [{}, {}{}".format(
+                value, min_value, max_value, ']' if include_max else '['))
+        return value
+    return type_float
+
+
 class SmartFormatter(argparse.HelpFormatter):
     """
     Custom formatter that inherits from HelpFormatter, which adjusts the default width to the current Terminal size,
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Apply ITK/ANTs transformations (warping fields and affine matrices) in-process, with NumPy/SciPy.
+#
+# Conventions (same as isct_antsApplyTransforms):
+# - Warping fields are NIfTI files with vector intent, of shape (nx, ny, nz, 1, 3), defined on the grid of the
+#   destination space. Each vector is the displacement, in ITK physical space (LPS+), from a destination point to the
+#   corresponding source point.
+# - Affine matrices are ITK transform files (.mat or .txt) mapping destination points to source points, in LPS+.
+# - Transformations are listed in the order they are applied to the source image (as in sct_apply_transfo), so
+#   destination points go through them in reverse order.
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+from __future__ import division, absolute_import
+
+import os
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+
+import numpy as np
+from scipy.io import loadmat
+from scipy.ndimage import map_coordinates, spline_filter
+
+from spinalcordtoolbox.image import Image
+
+logger = logging.getLogger(__name__)
+
+# Conversion between ITK (LPS+) and NIfTI (RAS+) physical coordinates. This matrix is its own inverse.
+LPS_TO_RAS = np.diag([-1., -1., 1., 1.])
+
+# Spline order and boundary mode of scipy.ndimage used for each interpolation method
+INTERPOLATION = {
+    'nn': (0, 'nearest'),
+    'linear': (1, 'nearest'),
+    'spline': (3, 'mirror'),
+}
+
+# Maximum number of composed sampling grids kept in memory (see get_sampling_points)
+CACHE_SIZE = 2
+_cache_sampling_points = OrderedDict()
+
+
+class AffineTransform(object):
+    """
+    Affine transformation, stored as a 4x4 matrix mapping destination to source points in RAS+ physical space.
+    """
+    def __init__(self, matrix):
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+
+    def inverse(self):
+        return AffineTransform(np.linalg.inv(self.matrix))
+
+    def transform_points(self, points):
+        """
+        :param points: (n, 3) array of physical coordinates (RAS+)
+        :return: (n, 3) array of transformed physical coordinates (RAS+)
+        """
+        return np.dot(points, self.matrix[:3, :3].T) + self.matrix[:3, 3]
+
+
+class DisplacementField(object):
+    """
+    Dense displacement field transformation (ITK DisplacementFieldTransform).
+
+    The displacement is linearly interpolated, and is null outside of the field (as in ITK).
+    """
+    def __init__(self, image):
+        """
+        :param image: Image of the warping field, of shape (nx, ny, nz, 1, ndim)
+        """
+        data = np.asarray(image.data)
+        self.shape = data.shape[:3]
+        data = data.reshape(self.shape + (data.shape[-1],))
+        self.components = [np.asarray(data[..., i], dtype=np.float64) for i in range(data.shape[-1])]
+        self.image = image
+
+    def transform_points(self, points):
+        """
+        :param points: (n, 3) array of physical coordinates (RAS+)
+        :return: (n, 3) array of transformed physical coordinates (RAS+)
+        """
+        coords = self.image.transfo_phys2pix(points, real=False)
+        inside = _is_inside(coords, self.shape)
+        displacement = np.zeros_like(points, dtype=np.float64)
+        for i, component in enumerate(self.components):
+            displacement[:, i] = map_coordinates(component, coords.T, order=1, mode='nearest')
+        displacement[~inside] = 0
+        # From ITK (LPS+) to RAS+
+        displacement[:, :2] = -displacement[:, :2]
+        return points + displacement
+
+
+def read_itk_affine(fname):
+    """
+    Read an ITK affine transformation file (binary .mat or text .txt) written by ANTs.
+
+    ITK maps a point x with: A * (x - c) + t + c, where c is the center of rotation ("fixed" parameters), in LPS+
+    coordinates. 2D transformations are extended to 3D with the identity along z.
+
+    :param fname: str: path to the transformation file
+    :return: AffineTransform
+    """
+    if fname.endswith('.mat'):
+        matfile = loadmat(fname)
+        name = [key for key in matfile if not key.startswith('__') and key != 'fixed'][0]
+        parameters = matfile[name].ravel()
+        fixed = matfile['fixed'].ravel()
+    else:
+        with open(fname) as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line and not line.startswith('#'))
+        name = fields['Transform'].strip()
+        parameters = np.array(fields['Parameters'].split(), dtype=np.float64)
+        fixed = np.array(fields['FixedParameters'].split(), dtype=np.float64)
+
+    if not name.startswith(('AffineTransform', 'MatrixOffsetTransformBase')):
+        raise ValueError("Transformation {} in {} is not supported. Only affine transformations can be applied "
+                         "in-process.".format(name, fname))
+
+    ndim = len(fixed)
+    matrix_itk = np.eye(4)
+    matrix_itk[:ndim, :ndim] = parameters[:ndim * ndim].reshape(ndim, ndim)
+    translation = parameters[ndim * ndim:ndim * ndim + ndim]
+    matrix_itk[:ndim, 3] = translation + fixed - np.dot(matrix_itk[:ndim, :ndim], fixed)
+    return AffineTransform(np.dot(LPS_TO_RAS, np.dot(matrix_itk, LPS_TO_RAS)))
+
+
+def read_transform(fname, inverse=False):
+    """
+    Read a warping field (.nii, .nii.gz) or an affine transformation (.mat, .txt).
+
+    :param fname: str: path to the transformation
+    :param inverse: bool: invert the transformation (only possible with affine transformations)
+    :return: DisplacementField or AffineTransform
+    """
+    if fname.endswith(('.nii', '.nii.gz')):
+        if inverse:
+            raise ValueError("Warping field {} cannot be inverted. Use the inverse warping field "
+                             "instead.".format(fname))
+        return DisplacementField(Image(fname))
+    transform = read_itk_affine(fname)
+    if inverse:
+        transform = transform.inverse()
+    return transform
+
+
+def get_sampling_points(im_dest, list_warp, list_warpinv=()):
+    """
+    Compose transformations to get, for each voxel of the destination image, the physical coordinates (RAS+) of the
+    corresponding point in the source space.
+
+    The result only depends on the destination grid and on the transformations, so it is cached (keyed by the
+    destination grid and by the path, modification time and inversion of each transformation) and can be reused to
+    warp several images to the same destination.
+
+    :param im_dest: Image: destination image
+    :param list_warp: list of str: transformations, in the order they are applied to the source image
+    :param list_warpinv: list of str: affine transformations of list_warp which should be inverted
+    :return: (nx * ny * nz, 3) array of physical coordinates
+    """
+    shape_dest = _shape_3d(im_dest.data.shape)
+    key = (tuple((os.path.abspath(fname), os.path.getmtime(fname), fname in list_warpinv) for fname in list_warp),
+           shape_dest, im_dest.hdr.get_best_affine().tobytes())
+    if key in _cache_sampling_points:
+        # move to the end (most recently used)
+        points = _cache_sampling_points[key] = _cache_sampling_points.pop(key)
+        return points
+
+    x, y, z = np.mgrid[0:shape_dest[0], 0:shape_dest[1], 0:shape_dest[2]]
+    points = im_dest.transfo_pix2phys(np.stack((x.ravel(), y.ravel(), z.ravel()), axis=1))
+    for fname in reversed(list_warp):
+        points = read_transform(fname, inverse=fname in list_warpinv).transform_points(points)
+
+    _cache_sampling_points[key] = points
+    while len(_cache_sampling_points) > CACHE_SIZE:
+        _cache_sampling_points.popitem(last=False)
+    return points
+
+
+def clear_cache():
+    """
+    Empty the cache of composed transformations.
+    """
+    _cache_sampling_points.clear()
+
+
+def resample_points(data, coords, interp='spline', inside=None):
+    """
+    Interpolate a 3D array at continuous voxel coordinates. Points outside of the array are set to 0.
+
+    :param data: 3D array (2D arrays are handled as 3D arrays with one slice)
+    :param coords: (n, 3) array of voxel coordinates
+    :param interp: {'nn', 'linear', 'spline'}
+    :param inside: (n,) bool array: points inside of the array, if already known
+    :return: (n,) float32 array of interpolated values
+    """
+    order, mode = INTERPOLATION[interp]
+    data = np.asarray(data, dtype=np.float64)
+    data = data.reshape(_shape_3d(data.shape))
+    coords = _coords_3d(coords)
+    if order > 1:
+        data = spline_filter(data, order=order, mode=mode)
+    values = map_coordinates(data, coords.T, order=order, mode=mode, prefilter=False, output=np.float32)
+    if inside is None:
+        inside = _is_inside(coords, data.shape)
+    values[~inside] = 0
+    return values
+
+
+def apply_transforms(im_src, im_dest, list_warp, list_warpinv=(), interp='spline', n_jobs=1):
+    """
+    Warp an image to a destination space, as isct_antsApplyTransforms does.
+
+    For 4D images, the sampling points are computed once and all the volumes are warped in memory, optionally with
+    several threads (one volume per task).
+
+    :param im_src: Image: source (moving) image, 2D, 3D or 4D
+    :param im_dest: Image: destination (fixed) image, whose grid is used for the output
+    :param list_warp: list of str: transformations, in the order they are applied to the source image
+    :param list_warpinv: list of str: affine transformations of list_warp which should be inverted
+    :param interp: {'nn', 'linear', 'spline'}
+    :param n_jobs: int: number of threads used to warp the volumes of 4D images. 0 or negative: use all available CPUs.
+    :return: Image: warped image (float32), in the destination space
+    """
+    shape_dest = im_dest.data.shape[:3]
+    points = get_sampling_points(im_dest, list_warp, list_warpinv)
+    coords = im_src.transfo_phys2pix(points, real=False)
+    data = np.asarray(im_src.data)
+    is_4d = data.ndim > 3 and data.shape[3] > 1
+    data = data.reshape(_shape_3d(data.shape) + (-1,))
+    nt = data.shape[3]
+    inside = _is_inside(coords, data.shape[:3])
+
+    data_out = np.empty((nt, len(coords)), dtype=np.float32)
+
+    def warp_volume(it):
+        data_out[it] = resample_points(data[..., it], coords, interp=interp, inside=inside)
+
+    if n_jobs <= 0:
+        n_jobs = multiprocessing.cpu_count()
+    n_jobs = min(n_jobs, nt)
+    if n_jobs <= 1:
+        for it in range(nt):
+            warp_volume(it)
+    else:
+        pool = ThreadPool(n_jobs)
+        try:
+            pool.map(warp_volume, range(nt))
+        finally:
+            pool.close()
+            pool.join()
+
+    if is_4d:
+        data_out = np.moveaxis(data_out.reshape((nt,) + shape_dest), 0, -1)
+    else:
+        data_out = data_out.reshape(shape_dest)
+    im_out = Image(data_out, hdr=im_dest.hdr.copy())
+    im_out.hdr.set_data_dtype(np.float32)
+    if is_4d:
+        im_out.hdr['pixdim'][4] = im_src.hdr['pixdim'][4]
+    return im_out
+
+
+def _is_inside(coords, shape):
+    """
+    Whether continuous voxel coordinates are within the image buffer, i.e. within [-0.5, n - 0.5[ along each axis
+    (same convention as ITK's IsInsideBuffer).
+    """
+    coords = _coords_3d(coords)
+    return np.all((coords >= -0.5) & (coords < np.asarray(_shape_3d(shape)) - 0.5), axis=1)
+
+
+def _shape_3d(shape):
+    """Spatial shape of an array, the missing axes of 2D arrays being of size 1"""
+    shape = tuple(shape[:3])
+    return shape + (1,) * (3 - len(shape))
+
+
+def _coords_3d(coords):
+    """(n, 3) voxel coordinates, the missing axes of 2D coordinates being 0"""
+    coords = np.asarray(coords)
+    if coords.shape[1] < 3:
+        coords = np.hstack((coords, np.zeros((len(coords), 3 - coords.shape[1]))))
+    return coords
@@ -19,6 +19,7 @@ sys.path.append(os.path.join(__sct_dir__, 'scripts'))
 from spinalcordtoolbox import aggregate_slicewise
 from spinalcordtoolbox.process_seg import Metric
 from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.template import VertLevelIndex
 
 
 @pytest.fixture(scope="session")
@@ -148,6 +149,18 @@ def test_aggregate_per_level(dummy_metrics, dummy_vert_level):
     assert agg_metric[(2, 3)] == {'VertLevel': (3,), 'WA()': 40.0}
 
 
+# noinspection 801,PyShadowingNames
+@pytest.mark.parametrize('perslice,perlevel', [(False, False), (True, False), (False, True)])
+def test_aggregate_with_vert_level_index(dummy_metrics, dummy_vert_level, perslice, perlevel):
+    """Test that a VertLevelIndex can be used instead of the image of vertebral labeling"""
+    kwargs = dict(levels=[2, 3, 4], perslice=perslice, perlevel=perlevel,
+                  group_funcs=(('WA', aggregate_slicewise.func_wa),))
+    agg_metric = aggregate_slicewise.aggregate_per_slice_or_level(dummy_metrics['with float'],
+                                                                  vert_level=VertLevelIndex(dummy_vert_level), **kwargs)
+    assert agg_metric == aggregate_slicewise.aggregate_per_slice_or_level(dummy_metrics['with float'],
+                                                                          vert_level=dummy_vert_level, **kwargs)
+
+
 # noinspection 801,PyShadowingNames
 def test_extract_metric(dummy_data_and_labels):
     """Test different estimation methods."""
@@ -201,6 +214,58 @@ def test_extract_metric_2d(dummy_data_and_labels_2d):
     assert agg_metric[list(agg_metric)[0]]['WA()'] == 5.0
 
 
+# noinspection 801,PyShadowingNames
+@pytest.mark.parametrize('method', ['wa', 'bin', 'ml', 'map', 'max'])
+@pytest.mark.parametrize('perslice', [True, False])
+def test_extract_metric_all_labels(dummy_data_and_labels, method, perslice):
+    """Test that extracting all labels at once gives the same output as extracting each label separately."""
+    rs = np.random.RandomState(0)
+    data = rs.normal(40, 5, size=(6, 7, 5))
+    data[0, 0, 1] = np.nan
+    labels = rs.uniform(size=(6, 7, 5, 3)) * (rs.uniform(size=(6, 7, 5, 3)) > 0.4)
+    labels[..., 2, 0] = 0  # empty label in one slice
+    label_struc = dummy_data_and_labels[2]
+    ids_label = [0, 1, 2, 99]
+    kwargs = dict(slices=[0, 1, 2, 4], perslice=perslice, method=method, label_struc=label_struc,
+                  indiv_labels_ids=[0, 1, 2])
+    agg_metrics = aggregate_slicewise.extract_metric_all_labels(Metric(data=data.copy()), labels=labels,
+                                                               ids_label=ids_label, **kwargs)
+    assert list(agg_metrics) == ids_label
+    for id_label in ids_label:
+        agg_metric = aggregate_slicewise.extract_metric(Metric(data=data.copy()), labels=labels, id_label=id_label,
+                                                        **kwargs)
+        assert list(agg_metrics[id_label]) == list(agg_metric)
+        for slicegroup in agg_metric:
+            assert agg_metrics[id_label][slicegroup].keys() == agg_metric[slicegroup].keys()
+            for key, value in agg_metric[slicegroup].items():
+                if isinstance(value, float):
+                    assert agg_metrics[id_label][slicegroup][key] == pytest.approx(value, rel=1e-8)
+                else:
+                    assert agg_metrics[id_label][slicegroup][key] == value
+
+
+# noinspection 801,PyShadowingNames
+@pytest.mark.parametrize('method', ['wa', 'bin', 'ml', 'map', 'max'])
+def test_extract_metric_all_labels_missing_level(dummy_data_and_labels, dummy_vert_level, method):
+    """Test extracting all labels per level, with a level missing from the vertebral labeling."""
+    rs = np.random.RandomState(0)
+    data = rs.normal(40, 5, size=(6, 7, 9))
+    labels = rs.uniform(size=(6, 7, 9, 3))
+    label_struc = dummy_data_and_labels[2]
+    kwargs = dict(levels=[4, 5, 7], perlevel=True, vert_level=dummy_vert_level, method=method,
+                  label_struc=label_struc, indiv_labels_ids=[0, 1, 2])
+    agg_metrics = aggregate_slicewise.extract_metric_all_labels(Metric(data=data.copy()), labels=labels,
+                                                               ids_label=[0, 99], **kwargs)
+    for id_label in [0, 99]:
+        agg_metric = aggregate_slicewise.extract_metric(Metric(data=data.copy()), labels=labels, id_label=id_label,
+                                                        **kwargs)
+        assert list(agg_metrics[id_label]) == list(agg_metric) == [(4, 5), (6, 7), ()]
+        assert agg_metrics[id_label][()]['Size [vox]'] == 0
+        for key, value in agg_metric[()].items():
+            assert agg_metrics[id_label][()][key] == value
+        assert all(value is None for key, value in agg_metrics[id_label][()].items() if key.endswith('()'))
+
+
 # noinspection 801,PyShadowingNames
 def test_save_as_csv(dummy_metrics):
     """Test writing of output metric csv file"""
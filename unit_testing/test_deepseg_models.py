@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.deepseg_models
+
+
+from __future__ import absolute_import
+
+import os
+import time
+import threading
+
+import pytest
+import numpy as np
+
+from spinalcordtoolbox import deepseg_models
+
+
+class ScaleModel(object):
+    """Model multiplying its input, built by the registry"""
+    n_built = 0
+
+    def __init__(self, factor):
+        ScaleModel.n_built += 1
+        self.factor = factor
+
+    def predict(self, x, batch_size):
+        return x * self.factor
+
+
+def get_spec(factor):
+    return deepseg_models.ModelSpec('{}:ScaleModel'.format(__name__), dict(factor=factor), None)
+
+
+@pytest.fixture()
+def registry(monkeypatch):
+    """Empty registry of 2 models, without server"""
+    monkeypatch.setattr(deepseg_models, '_registry', deepseg_models._registry.__class__())
+    monkeypatch.setattr(deepseg_models, 'CACHE_SIZE', 2)
+    monkeypatch.setattr(deepseg_models, '_server_available', None)
+    ScaleModel.n_built = 0
+
+
+def test_get_local_model(registry):
+    """Test that the models are built once, and that the least recently used one is evicted"""
+    model_1 = deepseg_models.get_local_model(('test', 't2', '2d', (4, 4)), get_spec(1))
+    deepseg_models.get_local_model(('test', 't2', '2d', (8, 8)), get_spec(2))
+    assert deepseg_models.get_local_model(('test', 't2', '2d', (4, 4)), get_spec(1)) is model_1
+    deepseg_models.get_local_model(('test', 't1', '2d', (4, 4)), get_spec(3))
+    assert ScaleModel.n_built == 3
+    assert [key[:4] for key in deepseg_models._registry] == [('test', 't2', '2d', (4, 4)), ('test', 't1', '2d', (4, 4))]
+    # a model of the same name with other weights is another entry
+    assert deepseg_models.get_local_model(('test', 't1', '2d', (4, 4)), get_spec(4)).factor == 4
+    assert ScaleModel.n_built == 4
+
+
+def start_server():
+    """Run the inference server in a thread, until its socket is created"""
+    thread = threading.Thread(target=deepseg_models.serve)
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(deepseg_models.get_address()):
+            break
+        time.sleep(0.05)
+    return thread
+
+
+def test_server(registry, tmpdir, monkeypatch):
+    """Test the predictions of the inference server, and the fallback to the registry when it is not running"""
+    monkeypatch.setenv('SCT_DEEPSEG_SOCKET', str(tmpdir.join('server', 'server.sock')))
+    thread = start_server()
+    try:
+        for path in ['server', os.path.join('server', 'server.sock'), os.path.join('server', 'server.sock.key')]:
+            assert not os.stat(str(tmpdir.join(path))).st_mode & 0o077
+        model = deepseg_models.get_model(('test', 't2', '2d', (4, 4)), get_spec(2))
+        assert isinstance(model, deepseg_models.RemoteModel)
+        x = np.random.rand(3, 4, 4, 1)
+        assert np.allclose(model.predict(x, batch_size=2), x * 2)
+        assert [key[:4] for key in deepseg_models.request('status')['models']] == [('test', 't2', '2d', (4, 4))]
+        # errors of the server are raised by the client
+        with pytest.raises(RuntimeError):
+            deepseg_models.request('unknown')
+    finally:
+        deepseg_models.request('stop')
+        thread.join()
+    assert not os.listdir(str(tmpdir.join('server')))
+
+    monkeypatch.setattr(deepseg_models, '_server_available', None)
+    model = deepseg_models.get_model(('test', 't2', '2d', (4, 4)), get_spec(2))
+    assert isinstance(model, ScaleModel)
+
+
+def test_server_not_private(registry, tmpdir, monkeypatch):
+    """Test that the server is not used if its folder is accessible by other users, and that it refuses to run in it"""
+    monkeypatch.setenv('SCT_DEEPSEG_SOCKET', str(tmpdir.join('server', 'server.sock')))
+    thread = start_server()
+    try:
+        os.chmod(str(tmpdir.join('server')), 0o755)
+        model = deepseg_models.get_model(('test', 't2', '2d', (4, 4)), get_spec(2))
+        assert isinstance(model, ScaleModel)
+        with pytest.raises(IOError):
+            deepseg_models.request('ping')
+    finally:
+        os.chmod(str(tmpdir.join('server')), 0o700)
+        deepseg_models.request('stop')
+        thread.join()
+
+    os.chmod(str(tmpdir.join('server')), 0o755)
+    with pytest.raises(RuntimeError):
+        deepseg_models.serve()
+    assert not os.listdir(str(tmpdir.join('server')))
@@ -3,6 +3,7 @@ from __future__ import absolute_import
 import os
 import sys
 
+import pytest
 import numpy as np
 import nibabel as nib
 
@@ -92,6 +93,11 @@ def test_segment_2d():
     seg_im.data = (seg > 0.5).astype(np.uint8)
     assert msct_image.compute_dice(seg_im, gt) > 0.80
 
+    # the prediction does not depend on the number of slices per batch
+    seg_1 = deepseg_sc.segment_2d(model_fname=model_path, contrast_type=contrast_test, input_size=(64, 64), im_in=img,
+                                  batch_size=1)
+    assert np.allclose(seg_1, seg, atol=1e-5)
+
 
 def test_segment_3d():
     from keras import backend as K
@@ -177,3 +183,113 @@ def test_uncrop_image():
                                         z_rand],
                         data_crop[:, :, z_rand])
 
+
+def test_heatmap():
+    """Test the tracking of the cord on a synthetic image, with a model which thresholds the blocks"""
+    class ThresholdModel(object):
+        def __init__(self):
+            self.n_calls = 0
+
+        def predict(self, x, batch_size):
+            self.n_calls += 1
+            return (x > 200).astype(np.float32)
+
+    nx, ny, nz, nz_cord = 200, 200, 150, 120
+    x, y = np.mgrid[:nx, :ny]
+    data = np.random.RandomState(0).rand(nx, ny, nz).astype(np.float32) * 5
+    for zz in range(nz_cord):
+        # the cord moves along y by more than the tracking margin, then the brain starts
+        data[:, :, zz] += 2000 * np.exp(-((x - 60 - zz * 0.3) ** 2 + (y - 100 - 40 * np.sin(zz / 40.)) ** 2) / 50.)
+    nii = nib.nifti1.Nifti1Image(data, np.eye(4))
+    img = Image(data, hdr=nii.header, dim=nii.header.get_data_shape())
+
+    model = ThresholdModel()
+    im_heatmap, z_max = deepseg_sc.heatmap(img, model, (80, 80), 0, 1, brain_bool=True, tracking_margin=0.25)
+    assert z_max == nz_cord - 1
+    assert np.all(np.any(im_heatmap.data[:, :, :nz_cord], axis=(0, 1)))
+    # the cord is tracked on batches of slices, rather than on one slice at a time
+    assert model.n_calls < nz_cord / 4
+
+
+def test_heatmap_recentering(monkeypatch):
+    """Test that by default the tracking block is re-centered at every slice, as when predicting one slice at a time"""
+    class OffCenterModel(object):
+        """Model whose prediction depends on the position of the cord in the block"""
+        def predict(self, x, batch_size):
+            pred = (x > 200).astype(np.float32)
+            pred[:, :, :30] = 0
+            return pred
+
+    nx, ny, nz = 200, 200, 60
+    x, y = np.mgrid[:nx, :ny]
+    data = np.random.RandomState(0).rand(nx, ny, nz).astype(np.float32) * 5
+    for zz in range(nz):
+        data[:, :, zz] += 2000 * np.exp(-((x - 60 - zz * 0.3) ** 2 + (y - 100 - zz * 0.5) ** 2) / 200.)
+    nii = nib.nifti1.Nifti1Image(data, np.eye(4))
+    img = Image(data, hdr=nii.header, dim=nii.header.get_data_shape())
+
+    im_heatmap = deepseg_sc.heatmap(img.copy(), OffCenterModel(), (80, 80), 0, 1, brain_bool=False)[0]
+    monkeypatch.setattr(deepseg_sc, 'BATCH_SIZE_CTR', 1)
+    im_heatmap_per_slice = deepseg_sc.heatmap(img.copy(), OffCenterModel(), (80, 80), 0, 1, brain_bool=False)[0]
+    assert np.array_equal(im_heatmap.data, im_heatmap_per_slice.data)
+
+
+def test_predict_sliding_window():
+    """Test the blending of overlapping patches, and the skipping of empty patches"""
+    class SigmoidModel(object):
+        def __init__(self):
+            self.n_patches = 0
+
+        def predict(self, x, batch_size):
+            assert len(x) <= batch_size
+            self.n_patches += len(x)
+            return 1 / (1 + np.exp(-x))
+
+    data = np.random.RandomState(0).rand(64, 64, 200).astype(np.float32) * 100
+    data[:, :, 100:] = 0  # e.g. after a brain detection
+    expected = 1 / (1 + np.exp(-(data - 50) / 20.))
+    for overlap, n_patches in [(0.0, 3), (0.5, 5)]:
+        model = SigmoidModel()
+        pred = deepseg_sc.predict_sliding_window(model, data, (64, 64, 48), 50., 20., overlap=overlap, batch_size=2)
+        assert pred.shape == data.shape
+        assert model.n_patches == n_patches
+        # a voxel-wise model gives the same prediction whatever the blending of the patches
+        assert np.allclose(pred[:, :, :100], expected[:, :, :100], atol=1e-5)
+        assert not np.any(pred[:, :, 144:])
+    # overlaps out of [0, 1[ would leave gaps between the patches, or use patches shifted by one voxel
+    for overlap in [-0.5, 1.0]:
+        with pytest.raises(ValueError):
+            deepseg_sc.predict_sliding_window(SigmoidModel(), data, (64, 64, 48), 50., 20., overlap=overlap)
+
+
+def test_post_processing_slice_wise():
+    """Test that the post-processing of the stack is the same as fill_holes_2d and keep_largest_object per slice"""
+    from scipy.ndimage import gaussian_filter, center_of_mass
+    from spinalcordtoolbox.deepseg_sc.postprocessing import post_processing_slice_wise, fill_holes_2d, \
+        keep_largest_object
+
+    rs = np.random.RandomState(0)
+    x, y = np.mgrid[:64, :64]
+    data = gaussian_filter(rs.rand(64, 64, 100), (2, 2, 1))
+    data = (data - data.min()) / (data.max() - data.min())
+    for zz in range(100):
+        # cord with a hole, moving along x; on some slices, a larger object away from the cord
+        data[:, :, zz] += np.exp(-((x - 20 - zz * 0.2) ** 2 + (y - 32) ** 2) / 40.) * ((x - 20 - zz * 0.2) ** 2 > 1)
+        if zz % 10 == 5:
+            data[40:60, 5:25, zz] = 1
+    data[:, :, 50:53] = 0
+
+    data_expected = np.zeros_like(data)
+    x_cOm, y_cOm = None, None
+    for zz in range(data.shape[2]):
+        pred_seg_pp = keep_largest_object(fill_holes_2d((data[:, :, zz] > 0.6).astype(int)), x_cOm, y_cOm)
+        if 1 in pred_seg_pp:
+            x_cOm, y_cOm = center_of_mass(pred_seg_pp)
+            x_cOm, y_cOm = np.round(x_cOm), np.round(y_cOm)
+        data_expected[:, :, zz] = pred_seg_pp
+
+    data_out = post_processing_slice_wise(data, 0.6)
+    assert data_out.dtype == data.dtype
+    assert np.array_equal(data_out, data_expected)
+    # the cord is kept rather than the larger object
+    assert not np.any(data_out[40:60, 5:25, 15])
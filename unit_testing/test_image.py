@@ -673,3 +673,38 @@ def test_sequences(fake_3dimage_sct):
      .save(path_b, mutable=True)
     assert img.absolutepath is not None
     assert img.absolutepath == os.path.abspath(path_b)
+
+
+def test_transfo_pix2phys_phys2pix():
+    """
+    Test that batched coordinate transforms match a per-point matrix product
+    """
+    affine = np.array([[0.5, 0.02, -0.01, -12.3],
+                       [-0.03, 0.8, 0.1, 45.6],
+                       [0.01, -0.2, 1.2, -78.9],
+                       [0, 0, 0, 1]])
+    img = msct_image.Image(np.zeros((4, 5, 6)), hdr=nibabel.nifti1.Nifti1Image(np.zeros((4, 5, 6)), affine).header)
+    m_p2f = img.hdr.get_best_affine()
+    m_f2p = np.linalg.inv(m_p2f)
+
+    coordi = np.random.RandomState(0).uniform(-50, 50, size=(1000, 3))
+
+    ref_phys = np.array([np.matmul(m_p2f, np.append(c, 1))[:3] for c in coordi])
+    ref_pix = np.array([np.matmul(m_f2p, np.append(c, 1))[:3] for c in coordi])
+
+    assert (img.transfo_pix2phys(coordi) == ref_phys).all()
+    assert (img.transfo_phys2pix(coordi, real=False) == ref_pix).all()
+    assert (img.transfo_phys2pix(coordi) == np.int32(np.round(ref_pix))).all()
+
+    # list input and single point
+    assert (img.transfo_pix2phys([[1, 2, 3]]) == np.matmul(m_p2f, [1, 2, 3, 1])[:3]).all()
+
+    # float32 path
+    phys32 = img.transfo_pix2phys(coordi, dtype=np.float32)
+    assert phys32.dtype == np.float32
+    assert np.allclose(phys32, ref_phys, atol=1e-3)
+
+    # inverse affine follows header changes
+    img.hdr.set_sform(np.eye(4))
+    img.hdr.set_qform(np.eye(4))
+    assert np.allclose(img.transfo_phys2pix(coordi, real=False), coordi)
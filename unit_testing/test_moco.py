@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for msct_moco
+
+from __future__ import absolute_import
+
+import sys
+import os
+
+import pytest
+import numpy as np
+import nibabel
+import scipy.io
+from scipy.ndimage import gaussian_filter
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+
+import msct_moco
+import sct_dmri_moco
+import sct_fmri_moco
+from spinalcordtoolbox.image import Image
+
+
+def write_warp(img_ref, displacement, path):
+    """Write a constant warping field on the grid of img_ref"""
+    data = np.zeros(img_ref.data.shape[:3] + (1, 3))
+    data[..., 0, :] = displacement
+    img_warp = Image(data, hdr=img_ref.hdr.copy())
+    img_warp.header.set_intent('vector', (), '')
+    img_warp.save(path)
+
+
+def test_map_register_volumes(tmpdir, monkeypatch):
+    """Test that the volumes are moved by the same transformations, serially or with a pool of processes"""
+    monkeypatch.chdir(str(tmpdir))
+    nt = 5
+    x, y, z = np.mgrid[0:12, 0:14, 0:6]
+    nii = nibabel.Nifti1Image(x * 10.0 + y, np.eye(4))
+    Image(x * 10.0 + y, hdr=nii.header).save('target.nii')
+    tasks = []
+    for it in range(nt):
+        Image((x + it) * 10.0 + y, hdr=nii.header.copy()).save('data_T{}.nii'.format(it))
+        write_warp(Image('target.nii'), [it, 0, 0], 'mat_T{}Warp.nii.gz'.format(it))
+        tasks.append((it, 'data_T{}.nii'.format(it), 'target.nii', 'mat_T{}'.format(it),
+                      'data_T{}_moco.nii'.format(it)))
+
+    param = sct_fmri_moco.Param()
+    param.todo = 'apply'
+    param.interp = 'linear'
+    param.engine = 'native'
+    data_moco = []
+    for n_jobs in [1, 3]:
+        results = sorted(msct_moco._map_register_volumes(param, None, tasks, n_jobs=n_jobs))
+        assert results == [(it, 0) for it in range(nt)]
+        data_moco.append(np.stack([Image('data_T{}_moco.nii'.format(it)).data for it in range(nt)], axis=-1))
+    assert not np.allclose(data_moco[0][..., 0], data_moco[0][..., 1])
+    assert np.array_equal(data_moco[0], data_moco[1])
+
+
+def moving_volumes(nt=4, shape=(40, 44, 8)):
+    """Smooth 3D volume and copies translated slice-wise (polynomial along z), with the translations"""
+    rs = np.random.RandomState(0)
+    x, y = np.mgrid[0:shape[0], 0:shape[1]]
+    blob = np.exp(-((x - 18.) ** 2 + (y - 23.) ** 2) / 50.)[..., np.newaxis]
+    data = gaussian_filter(rs.rand(*shape), (2, 2, 0)) * 100 + blob * 200
+    z = np.arange(shape[2])
+    translations = [np.stack([0.4 * it + 0.1 * z, -0.3 * it + 0.02 * z ** 2], axis=1) for it in range(nt)]
+    data_moving = np.stack([msct_moco.sct_moco.translate_slices(data, -t, interp='spline') for t in translations],
+                           axis=-1)
+    return data, data_moving, translations
+
+
+@pytest.mark.parametrize('metric', ['MeanSquares', 'MI'])
+def test_estimate_translations(metric):
+    """Test that the slice-wise translations are recovered, inside of a mask"""
+    data, data_moving, translations = moving_volumes()
+    mask = np.zeros(data.shape)
+    mask[5:35, 5:38] = 1
+    for it in range(data_moving.shape[-1]):
+        translations_est, is_valid = msct_moco.sct_moco.estimate_translations(
+            data_moving[..., it] * 1.2, data * 1.2, mask=mask, metric=metric, poly=2, smooth=1)
+        assert is_valid.all()
+        assert np.abs(translations_est - translations[it]).max() < 0.05
+
+
+def test_moco_native(tmpdir, monkeypatch):
+    """Test that the warping fields of the native estimator move the volumes as the estimator does"""
+    monkeypatch.chdir(str(tmpdir))
+    data, data_moving, translations = moving_volumes()
+    nii = nibabel.Nifti1Image(data_moving, np.diag([0.8, 0.8, 3, 1]))
+    Image(data_moving, hdr=nii.header, dim=nii.header.get_data_shape()).save('fmri.nii')
+    Image(data, hdr=nii.header.copy()).save('target.nii')
+
+    param = sct_fmri_moco.Param()
+    param.file_data = 'fmri.nii'
+    param.file_target = 'target.nii'
+    param.mat_moco = 'mat'
+    param.todo = 'estimate_and_apply'
+    param.estimator = 'native'
+    param.smooth = '1'
+    param.interp = 'linear'
+    param.engine = 'native'
+    param.verbose = 0
+    msct_moco.moco(param)
+    data_moco = Image('fmri_moco.nii').data.copy()
+    assert np.abs(data_moco - data[..., np.newaxis])[5:-5, 5:-5].max() < 0.05 * data.max()
+
+    param.todo = 'apply'
+    msct_moco.moco(param)
+    assert np.allclose(Image('fmri_moco.nii').data, data_moco, atol=1e-3)
+    # the translations are only stored in the file of motion parameters
+    assert os.listdir('mat') == [msct_moco.FILE_PARAMS]
+    motion_params = msct_moco.sct_moco.MotionParams.load(os.path.join('mat', msct_moco.FILE_PARAMS))
+    assert motion_params.displacement.shape == (4, 8, 3)
+    assert np.allclose(motion_params.displacement[..., 2], 0)
+
+
+def test_motion_params(tmpdir):
+    """Test the file of motion parameters, and that its warping fields move points as the translations do"""
+    data, data_moving, translations = moving_volumes()
+    nii = nibabel.Nifti1Image(data, np.diag([0.8, 0.7, 3, 1]))
+    im_dest = Image(data, hdr=nii.header)
+    motion_params = msct_moco.sct_moco.MotionParams.from_translations(translations, im_dest)
+    fname = str(tmpdir.join('params.npz'))
+    motion_params.save(fname)
+    motion_params = msct_moco.sct_moco.MotionParams.load(fname)
+    assert motion_params.displacement.shape == (4, 8, 3)
+    assert np.allclose(motion_params.to_translations(), translations)
+
+    im_warp = motion_params.to_warp(2)
+    assert im_warp.data.shape == data.shape + (1, 3)
+    points = im_dest.transfo_pix2phys([[10, 12, 5]])
+    coords = im_dest.transfo_phys2pix(msct_moco.DisplacementField(im_warp).transform_points(points), real=False)
+    assert np.allclose(coords[0], [10 + translations[2][5, 0], 12 + translations[2][5, 1], 5])
+
+
+def test_spline(tmpdir):
+    """Test that the regularization along T smooths the translations of each slice"""
+    rs = np.random.RandomState(0)
+    t = np.arange(30)
+    displacement = np.zeros((30, 3, 3))
+    displacement[..., 0] = np.sin(t / 5.)[:, np.newaxis] + rs.normal(0, 0.3, (30, 3))
+    nii = nibabel.Nifti1Image(np.zeros((4, 4, 3)), np.eye(4))
+    msct_moco.sct_moco.MotionParams(displacement, nii.header).save(str(tmpdir.join(msct_moco.FILE_PARAMS)))
+    msct_moco.spline(str(tmpdir), 0)
+    displacement_smooth = msct_moco.sct_moco.MotionParams.load(str(tmpdir.join(msct_moco.FILE_PARAMS))).displacement
+    assert np.abs(displacement_smooth[..., 0] - np.sin(t / 5.)[:, np.newaxis]).mean() < \
+        np.abs(displacement[..., 0] - np.sin(t / 5.)[:, np.newaxis]).mean()
+    assert np.allclose(displacement_smooth[..., 2], 0)
+    assert np.array_equal(
+        msct_moco.sct_moco.MotionParams.load(str(tmpdir.join('old', msct_moco.FILE_PARAMS))).displacement, displacement)
+
+
+def test_fmri_moco_sagittal(tmpdir, monkeypatch):
+    """Test that the motion parameters of sagittal data are output, from the 2D affine transformations of ANTs"""
+    monkeypatch.chdir(str(tmpdir))
+    nt, nz = 3, 4
+
+    def register(param, file_src, file_dest, file_mat, file_out, im_mask=None):
+        # transformation of ANTs, with a translation depending on the slice and the volume
+        iz, it = int(file_mat[-9:-5]), int(file_mat[-4:])
+        affine = np.array([[1., 0., 0., 1., 0.5 * it, iz]]).T
+        scipy.io.savemat(file_mat + '0GenericAffine.mat', {'AffineTransform_double_2_2': affine,
+                                                           'fixed': np.zeros((2, 1))}, format='4')
+        Image(file_src).save(file_out, verbose=0)
+        return 0
+    monkeypatch.setattr(msct_moco, 'register', register)
+
+    data = np.random.RandomState(0).rand(8, 10, nz, nt)
+    nii = nibabel.Nifti1Image(data, np.array([[0, 0, 1, 0], [1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1.]]))
+    Image(data, hdr=nii.header, dim=nii.header.get_data_shape()).save('fmri.nii')
+    assert Image('fmri.nii').orientation[2] in 'LR'
+
+    param = sct_fmri_moco.Param()
+    param.fname_data = 'fmri.nii'
+    param.n_jobs = 1
+    param.verbose = 0
+    sct_fmri_moco.fmri_moco(param)
+
+    assert param.is_sagittal
+    for i, name in enumerate(['X', 'Y']):
+        im_param = Image('fmri_moco_params_{}.nii'.format(name))
+        assert im_param.data.shape == (1, 1, nz, nt)
+        expected = 0.5 * np.arange(nt)[np.newaxis] if name == 'X' else np.arange(nz)[:, np.newaxis]
+        assert np.allclose(im_param.data[0, 0], expected * np.ones((nz, nt)))
+    moco_param = np.loadtxt('fmri_moco_params.tsv', skiprows=1)
+    assert np.allclose(moco_param, np.stack([0.5 * np.arange(nt), np.full(nt, (nz - 1) / 2.)], axis=1))
+
+
+def test_dmri_moco_native(tmpdir, monkeypatch):
+    """Test dMRI moco with the native estimator and engine: groups are built in memory, without per-volume files"""
+    monkeypatch.chdir(str(tmpdir))
+    data, data_moving, translations = moving_volumes(nt=7)
+    # the targets of b=0 and DWI registration (first b=0 and first DWI) do not move
+    data_moving[..., :2] = data[..., np.newaxis]
+    scale = np.array([3, 1, 1, 1, 3, 1, 1.])
+    data_moving = (data_moving * scale).astype(np.float32)
+    nii = nibabel.Nifti1Image(data_moving, np.diag([0.8, 0.8, 3, 1]))
+    Image(data_moving, hdr=nii.header, dim=nii.header.get_data_shape()).save('dmri.nii')
+    np.savetxt('bvecs.txt', np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1], [0, 0, 0], [1, 1, 0], [0, 1, 1]]).T)
+
+    param = sct_dmri_moco.Param()
+    param.estimator = 'native'
+    param.engine = 'native'
+    param.interp = 'linear'
+    param.group_size = 1
+    param.verbose = 0
+    fname_moco = sct_dmri_moco.dmri_moco(param)
+
+    data_moco = Image(fname_moco).data
+    assert data_moco.shape == data_moving.shape
+    assert np.abs(data_moco - data[..., np.newaxis] * scale)[5:-5, 5:-5].max() < 0.05 * 3 * data.max()
+    assert not [fname for fname in os.listdir('.') if fname.startswith('dmri_T') and fname != 'dmri_T0000.nii.gz']
+    # the motion parameters of each volume are the ones of its b=0 image or of its DWI group
+    displacement = {folder: msct_moco.sct_moco.MotionParams.load(os.path.join(folder, msct_moco.FILE_PARAMS))
+                    .displacement for folder in ['mat_final', 'mat_b0groups', 'mat_dwigroups']}
+    assert np.array_equal(displacement['mat_final'][[0, 4]], displacement['mat_b0groups'])
+    assert np.array_equal(displacement['mat_final'][[1, 2, 3, 5, 6]], displacement['mat_dwigroups'])
+    assert os.listdir('mat_final') == [msct_moco.FILE_PARAMS]
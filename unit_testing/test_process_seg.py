@@ -111,12 +111,14 @@ im_segs = [
     ]
 
 # noinspection 801,PyShadowingNames
+@pytest.mark.parametrize('engine', ['regionprops', 'moments'])
 @pytest.mark.parametrize('im_seg,expected,params', im_segs)
-def test_compute_shape(im_seg, expected, params):
+def test_compute_shape(im_seg, expected, params, engine):
     metrics, fit_results = process_seg.compute_shape(im_seg,
                                                      angle_correction=params['angle_corr'],
                                                      param_centerline=ParamCenterline(),
-                                                     verbose=VERBOSE)
+                                                     verbose=VERBOSE,
+                                                     engine=engine)
     for key in expected.keys():
         # fetch obtained_value
         if 'slice' in params:
@@ -135,3 +137,43 @@ def test_compute_shape(im_seg, expected, params):
         else:
             expected_value = pytest.approx(expected[key], rel=0.05)
         assert obtained_value == expected_value
+
+
+def test_crop_and_scale_slices():
+    """Test that slices are scaled as with skimage.transform.warp, in the cropped region"""
+    from skimage import transform
+    im_seg = dummy_segmentation(size_arr=(64, 64, 10), shape='ellipse', radius_RL=13.0, radius_AP=5.0, debug=DEBUG)
+    data = im_seg.data.astype(np.float64)
+    scale = np.stack([np.linspace(0.7, 1, 10), np.linspace(1, 0.8, 10)], axis=1)
+    patches = process_seg._crop_and_scale_slices(data, scale)
+    for iz in range(data.shape[2]):
+        tform = transform.AffineTransform(scale=(scale[iz, 1], scale[iz, 0]))
+        slice_warped = transform.warp(data[:, :, iz], tform.inverse, output_shape=data.shape[:2], order=1)
+        assert patches[:, :, iz].sum() == pytest.approx(slice_warped.sum())
+        assert np.allclose(np.sort(patches[:, :, iz][patches[:, :, iz] > 0]), np.sort(slice_warped[slice_warped > 0]))
+
+
+def test_compute_shape_parallel():
+    """Test that slice-wise properties computed with a pool of processes are identical to the serial ones"""
+    im_seg = dummy_segmentation(size_arr=(64, 64, 20), shape='ellipse', radius_RL=13.0, radius_AP=5.0, angle_RL=-30.0,
+                                debug=DEBUG)
+    metrics_serial, _ = process_seg.compute_shape(im_seg, param_centerline=ParamCenterline(), verbose=VERBOSE)
+    metrics_parallel, _ = process_seg.compute_shape(im_seg, param_centerline=ParamCenterline(), verbose=VERBOSE,
+                                                    n_jobs=2)
+    for key in metrics_serial:
+        assert np.array_equal(metrics_serial[key].data, metrics_parallel[key].data, equal_nan=True)
+
+
+# noinspection 801,PyShadowingNames
+@pytest.mark.parametrize('im_seg,expected,params', im_segs)
+def test_compute_shape_moments_vs_regionprops(im_seg, expected, params):
+    """Test that moment-based properties are consistent with the ones computed on the upsampled slices"""
+    metrics = {}
+    for engine in ['regionprops', 'moments']:
+        metrics[engine], _ = process_seg.compute_shape(im_seg, angle_correction=params['angle_corr'],
+                                                       param_centerline=ParamCenterline(), verbose=VERBOSE,
+                                                       engine=engine)
+    for key, rel in [('area', 0.001), ('diameter_AP', 0.07), ('diameter_RL', 0.03), ('eccentricity', 0.05),
+                     ('solidity', 0.05)]:
+        assert np.nanmean(metrics['moments'][key].data) == \
+            pytest.approx(np.nanmean(metrics['regionprops'][key].data), rel=rel)
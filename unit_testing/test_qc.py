@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.reports.qc
+
+
+from __future__ import absolute_import
+
+import sys
+import os
+import json
+import glob
+import time
+
+import pytest
+import numpy as np
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+
+from spinalcordtoolbox.reports import qc
+from spinalcordtoolbox.testing.create_test_data import dummy_segmentation
+
+
+@pytest.fixture()
+def images(tmpdir, monkeypatch):
+    """Image and segmentation of the cord, in the current directory"""
+    monkeypatch.chdir(str(tmpdir))
+    im_seg = dummy_segmentation(size_arr=(40, 40, 10), shape='ellipse', radius_RL=6.0, radius_AP=4.0)
+    im_seg.save('seg.nii.gz')
+    im = im_seg.copy()
+    im.data = im_seg.data * 100 + np.random.RandomState(0).rand(*im_seg.data.shape) * 50
+    im.save('im.nii.gz')
+    return 'im.nii.gz', 'seg.nii.gz'
+
+
+def test_render_queue(images):
+    """Test that queued entries are only rendered by render_queue, serially or in parallel"""
+    for i in range(3):
+        qc.generate_qc(images[0], fname_seg=images[1], args=['-i', images[0]], path_qc='qc',
+                       process='sct_deepseg_sc', subject='sub-{}'.format(i), mode='queue')
+    # a queued entry whose input does not exist any more
+    qc.generate_qc('missing.nii.gz', fname_seg=images[1], path_qc='qc', process='sct_deepseg_sc', mode='queue')
+    assert len(glob.glob(os.path.join('qc', qc.QUEUE_FOLDER, '*.json'))) == 4
+    assert not os.path.exists(os.path.join('qc', 'index.html'))
+
+    assert qc.render_queue('qc', n_jobs=2) == (3, 1)
+    assert len(glob.glob(os.path.join('qc', '_json', '*.json'))) == 3
+    assert len(glob.glob(os.path.join('qc', '*', 'sub-*', '*', 'sct_deepseg_sc', '*', 'overlay_img.png'))) == 3
+    assert os.path.isfile(os.path.join('qc', 'index.html'))
+    assert sorted(entry['subject'] for entry in qc.read_index('qc')) == ['sub-0', 'sub-1', 'sub-2']
+    # the entry which could not be rendered is kept aside
+    assert [fname.endswith('.json.failed') for fname in os.listdir(os.path.join('qc', qc.QUEUE_FOLDER))] == [True]
+    # nothing left to render
+    assert qc.render_queue('qc') == (0, 0)
+
+
+def test_index(images):
+    """Test that the index is appended to, and built from the description files of former QC folders"""
+    path_json = os.path.join('qc', '_json')
+    os.makedirs(path_json)
+    for i in range(2):
+        with open(os.path.join(path_json, 'qc_{}.json'.format(i)), 'w') as f:
+            json.dump({'subject': 'former-{}'.format(i)}, f)
+    for subject in ['sub-0', 'sub-1']:
+        qc.generate_qc(images[0], fname_seg=images[1], path_qc='qc', process='sct_deepseg_sc', subject=subject,
+                       mode='sync')
+    assert sorted(entry['subject'] for entry in qc.read_index('qc')) == ['former-0', 'former-1', 'sub-0', 'sub-1']
+    assert qc.read_index('qc')[-1]['subject'] == 'sub-1'
+    # index.html does not depend on the entries
+    with open(os.path.join('qc', 'index.html')) as f:
+        assert 'sub-1' not in f.read()
+
+
+def test_generate_qc_background(images, monkeypatch):
+    """Test that the entry is rendered by a detached process"""
+    monkeypatch.setenv('SCT_QC_MODE', 'background')
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join([__sct_dir__, os.environ.get('PYTHONPATH', '')]))
+    qc.generate_qc(images[0], fname_seg=images[1], path_qc='qc', process='sct_deepseg_sc')
+    for _ in range(120):
+        if os.path.isfile(os.path.join('qc', 'index.html')):
+            break
+        time.sleep(0.5)
+    assert len(glob.glob(os.path.join('qc', '_json', '*.json'))) == 1
+    assert not glob.glob(os.path.join('qc', qc.QUEUE_FOLDER, '*.json*'))
+
+
+@pytest.mark.parametrize('backend', ['raster', 'matplotlib'])
+def test_add_entry_backend(images, backend):
+    """Test that both backends draw the mosaic of the segmentation with the same layout"""
+    import skimage.io
+    import spinalcordtoolbox.reports.slice as qcslice
+    from spinalcordtoolbox.image import Image
+    qc.add_entry(src=images[0], process='sct_deepseg_sc', args=[], path_qc='qc', plane='Axial',
+                 qcslice=qcslice.Axial([Image(images[0]), Image(images[1])]),
+                 qcslice_operations=[qc.QcImage.listed_seg], qcslice_layout=lambda x: x.mosaic(), backend=backend)
+    bkg = skimage.io.imread(glob.glob(os.path.join('qc', '**', 'bkg_img.png'), recursive=True)[0])
+    overlay = skimage.io.imread(glob.glob(os.path.join('qc', '**', 'overlay_img.png'), recursive=True)[0])
+    assert bkg.shape == overlay.shape == (75, 1500, 4)
+    # the cord is red, in the bright part of the background (away from the frame drawn by matplotlib)
+    bkg, overlay = bkg[5:-5, 5:-5], overlay[5:-5, 5:-5]
+    red = overlay[..., 3] == 255
+    assert red.sum() > 0.1 * red.size
+    assert (overlay[red][:, :3] == [255, 0, 0]).all()
+    assert bkg[red][:, 0].mean() > 2 * bkg[~red][:, 0].mean()
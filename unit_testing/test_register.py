@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for msct_register
+
+
+from __future__ import absolute_import
+
+import sys
+import os
+
+import pytest
+import numpy as np
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+
+import msct_register
+from spinalcordtoolbox.testing.create_test_data import dummy_segmentation
+
+
+@pytest.fixture(scope="module")
+def im_seg():
+    """Oblique segmentation, with an empty slice and a slice with one voxel"""
+    im = dummy_segmentation(size_arr=(48, 48, 12), shape='ellipse', radius_RL=10.0, radius_AP=5.0, angle_IS=20)
+    im.data[..., 3] = 0
+    im.data[..., 4] = 0
+    im.data[20, 20, 4] = 1
+    return im
+
+
+def test_compute_pca_slices(im_seg):
+    """Test that the batched PCA gives the same center of mass, orientation and eigenratio as compute_pca()"""
+    centermass, eigenv, eigenratio, is_valid = msct_register.compute_pca_slices(im_seg.data)
+    assert list(np.where(~is_valid)[0]) == [3, 4]
+    for iz in np.where(is_valid)[0]:
+        _, pca, centermass_slice = msct_register.compute_pca(im_seg.data[:, :, iz])
+        assert np.allclose(centermass[iz], centermass_slice)
+        assert abs(np.dot(eigenv[iz], pca.components_[0])) == pytest.approx(1)
+        assert eigenratio[iz] == pytest.approx(pca.explained_variance_ratio_[0] / pca.explained_variance_ratio_[1])
+
+
+@pytest.mark.parametrize('angle_range', [0.7, 30])
+def test_find_angle_hog_slices(im_seg, angle_range):
+    """Test that the batched HOG angles are the same as find_angle_hog() for each slice"""
+    data = im_seg.data + np.random.RandomState(0).rand(*im_seg.data.shape)
+    centermass = msct_register.compute_pca_slices(im_seg.data)[0]
+    angles = msct_register.find_angle_hog_slices(data, centermass, 1., 1., angle_range=angle_range)
+    for iz in range(data.shape[2]):
+        angle, _ = msct_register.find_angle_hog(data[:, :, iz], centermass[iz], 1., 1., angle_range=angle_range)
+        assert angles[iz] == pytest.approx(angle)
+
+
+def test_compute_centermassrot_displacements(im_seg):
+    """Test that the forward displacement maps the center of mass of dest onto the one of src, and the inverse"""
+    centermass_src = np.array([[20., 25.], [30., 21.]])
+    centermass_dest = np.array([[24., 24.], [24., 24.]])
+    displacement, displacement_inv = msct_register.compute_centermassrot_displacements(
+        im_seg, (48, 48), [2, 7], centermass_src, centermass_dest, np.array([0.3, -0.2]))
+    assert displacement.shape == displacement_inv.shape == (48, 48, 2, 2)
+    for i in range(2):
+        phy_src = im_seg.transfo_pix2phys([list(centermass_src[i]) + [0]])[0]
+        phy_dest = im_seg.transfo_pix2phys([list(centermass_dest[i]) + [0]])[0]
+        assert np.allclose(displacement[24, 24, i], (phy_src - phy_dest)[:2])
+        x, y = centermass_src[i].astype(int)
+        assert np.allclose(displacement_inv[x, y, i], (phy_dest - phy_src)[:2])
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_map_register2d_slices_failure(tmpdir, n_jobs):
+    """Test that failed slice registrations are reported by slice index and that their inputs are removed"""
+    tasks = []
+    for i in range(4):
+        fnames = [str(tmpdir.join('{}_Z{}.nii'.format(name, i))) for name in ['src', 'dest']]
+        for fname in fnames:
+            open(fname, 'w').close()
+        tasks.append((i, 'Translation', ['isct_antsRegistration', '--dimensionality', '4'],
+                      str(tmpdir.join('warp2d_{}'.format(i))), fnames[0], fnames[1],
+                      str(tmpdir.join('src_Z{}_reg.nii'.format(i))), None, None, 0))
+    results = sorted(msct_register._map_register2d_slices(iter(tasks), len(tasks), n_jobs=n_jobs))
+    assert [i for i, _, _ in results] == [0, 1, 2, 3]
+    assert all(transfo is None and error is not None for _, transfo, error in results)
+    assert tmpdir.listdir() == []
@@ -26,3 +26,74 @@ def test_straighten():
     sc_straight.straighten()
     assert sc_straight.mse_straightening < 0.8
     assert sc_straight.max_distance_straightening < 1.2
+
+
+def _dummy_straightening_setup():
+    """Build a curved centerline, a straight centerline and their images in physical space"""
+    import numpy as np
+    import nibabel
+    from spinalcordtoolbox.image import Image
+    from spinalcordtoolbox.types import Centerline
+
+    nx, ny, nz = 20, 22, 30
+    affine = np.diag([0.8, 0.8, 1.0, 1.0])
+    affine[:3, 3] = [-8, -9, -15]
+    img = Image(np.zeros((nx, ny, nz)), hdr=nibabel.Nifti1Image(np.zeros((nx, ny, nz)), affine).header)
+
+    z = np.linspace(-14, 14, 200)
+    x, y = 2 * np.sin(z / 10.), 0.05 * z ** 2 / 10.
+    centerline = Centerline(x, y, z, np.gradient(x, z), np.gradient(y, z), np.ones_like(z))
+    centerline_straight = Centerline(np.zeros_like(z), np.zeros_like(z), z,
+                                     np.zeros_like(z), np.zeros_like(z), np.ones_like(z))
+    lookup = np.arange(len(z))
+    lookup[0] = lookup[-1] = 0
+    return img, centerline, centerline_straight, lookup
+
+
+def test_warping_field_slabs():
+    """Test that the warping fields do not depend on the slab decomposition"""
+    import numpy as np
+    from spinalcordtoolbox.straightening import _get_slabs, _compute_curved2straight_slab, \
+        _compute_straight2curved_slab
+
+    img, centerline, centerline_straight, lookup = _dummy_straightening_setup()
+    nx, ny, nz = img.data.shape
+
+    assert _get_slabs(nx, ny, nz, max_voxels=1) == [(z, z + 1) for z in range(nz)]
+    assert _get_slabs(nx, ny, nz, max_voxels=nx * ny * 7)[-1] == (28, 30)
+
+    for fn, ctl_src, ctl_dest in [(_compute_curved2straight_slab, centerline_straight, centerline),
+                                  (_compute_straight2curved_slab, centerline, centerline_straight)]:
+        warp_slice = np.concatenate([fn(img, ctl_src, ctl_dest, lookup, 10, z_start, z_end)
+                                     for z_start, z_end in _get_slabs(nx, ny, nz, max_voxels=1)], axis=2)
+        warp_volume = np.concatenate([fn(img, ctl_src, ctl_dest, lookup, 10, z_start, z_end)
+                                      for z_start, z_end in _get_slabs(nx, ny, nz, max_voxels=nx * ny * 7)], axis=2)
+        assert warp_slice.dtype == np.float32
+        assert warp_slice.shape == (nx, ny, nz, 3)
+        assert (warp_slice == warp_volume).all()
+
+
+def test_map_slabs_parallel():
+    """Test that warping fields computed with a pool of processes are identical to the serial ones"""
+    import numpy as np
+    from spinalcordtoolbox.straightening import _get_slabs, _map_slabs, _compute_curved2straight_slab, \
+        _compute_straight2curved_slab
+
+    img, centerline, centerline_straight, lookup = _dummy_straightening_setup()
+    nx, ny, nz = img.data.shape
+    slab_args = {
+        'curved2straight': (_compute_curved2straight_slab, (img, centerline_straight, centerline, lookup, 10)),
+        'straight2curved': (_compute_straight2curved_slab, (img, centerline, centerline_straight, lookup, 10)),
+    }
+    tasks = [(key, z_start, z_end) for key in slab_args
+             for z_start, z_end in _get_slabs(nx, ny, nz, max_voxels=nx * ny * 4)]
+
+    def compute(n_jobs):
+        data_warp = {key: np.zeros((nx, ny, nz, 3), dtype=np.float32) for key in slab_args}
+        for key, z_start, z_end, warp in _map_slabs(slab_args, tasks, n_jobs=n_jobs):
+            data_warp[key][:, :, z_start:z_end] = warp
+        return data_warp
+
+    warp_serial, warp_parallel = compute(1), compute(2)
+    for key in slab_args:
+        assert (warp_serial[key] == warp_parallel[key]).all()
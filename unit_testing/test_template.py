@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.template
+
+
+from __future__ import absolute_import
+
+import pytest
+
+import numpy as np
+import nibabel as nib
+
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.template import VertLevelIndex, get_slices_from_vertebral_levels, \
+    get_vertebral_level_from_slice
+
+
+@pytest.fixture(scope="module")
+def im_vert_level():
+    """Vertebral labeling with partial volume, non-finite values and empty slices"""
+    data = np.zeros((5, 5, 8))
+    data[2, 2, :] = [0, 2, 2, 3, 3, 4, 0, 5]
+    data[1, 2, :] = [0, 2, 3, 3, 4, 4, 0, np.nan]  # slice 2 averages to 2.5, rounded to 2
+    nii = nib.nifti1.Nifti1Image(data, np.eye(4))
+    return Image(data, hdr=nii.header, orientation='RPI', dim=nii.header.get_data_shape())
+
+
+def test_vert_level_index(im_vert_level):
+    """Test levels of each slice, and slices of each level"""
+    index = VertLevelIndex(im_vert_level)
+    assert len(index) == 8
+    assert index.levels == [None, 2, 2, 3, 4, 4, None, 5]
+    assert index.get_slices(2) == [1, 2]
+    assert index.get_slices(4) == [4, 5]
+    assert index.get_slices(7) == []
+    assert index.get_level(0) is None
+    assert index.get_level(7) == 5
+    with pytest.raises(IndexError):
+        index.get_level(8)
+
+
+def test_get_slices_and_level(im_vert_level):
+    """Test that the functions give the same output from the image or from the index"""
+    index = VertLevelIndex(im_vert_level)
+    for level in range(1, 7):
+        assert get_slices_from_vertebral_levels(im_vert_level, level) == \
+            get_slices_from_vertebral_levels(index, level) == index.get_slices(level)
+    for iz in range(6):
+        assert get_vertebral_level_from_slice(im_vert_level, iz) == get_vertebral_level_from_slice(index, iz)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.types
+
+
+from __future__ import print_function, absolute_import
+
+import pytest
+import numpy as np
+
+from spinalcordtoolbox.types import Centerline
+
+
+@pytest.fixture(scope='module')
+def centerline():
+    z = np.linspace(-100, 0, 201)
+    x = 10 * np.sin(z / 30.)
+    y = 5 * np.cos(z / 40.)
+    return Centerline(x, y, z, np.gradient(x, z), np.gradient(y, z), np.ones_like(z))
+
+
+def test_centerline_length(centerline):
+    """Test lengths of the centerline against the per-segment distances"""
+    distances = np.linalg.norm(np.diff(centerline.points, axis=0), axis=1)
+    assert centerline.length == pytest.approx(distances.sum())
+    assert centerline.progressive_length == pytest.approx([0.0] + list(distances))
+    assert centerline.incremental_length[-1] == pytest.approx(centerline.length)
+    assert centerline.progressive_length_inverse == pytest.approx([0.0] + list(distances[::-1]))
+    assert centerline.incremental_length_inverse[-1] == pytest.approx(centerline.length)
+
+
+def test_centerline_coordinate_systems(centerline):
+    """Test that each plane has an orthonormal base, with z' along the derivative and x' orthogonal to y"""
+    n = centerline.number_of_points
+    assert np.allclose(np.linalg.norm(centerline.derivatives, axis=1), 1)
+    assert np.allclose(np.einsum('nji,njk->nik', centerline.matrices, centerline.matrices),
+                       np.tile(np.eye(3), (n, 1, 1)))
+    assert np.allclose(centerline.matrices[:, :, 2], centerline.derivatives)
+    assert np.allclose(centerline.matrices[:, 1, 0], 0)
+    assert np.allclose(np.einsum('nij,njk->nik', centerline.inverse_matrices, centerline.matrices),
+                       np.tile(np.eye(3), (n, 1, 1)))
+
+    index = 50
+    origin, x_prime_axis, y_prime_axis, z_prime_axis, matrix_base, inverse_matrix = \
+        centerline.compute_coordinate_system(index)
+    assert np.allclose(origin, centerline.points[index])
+    assert np.allclose(np.cross(x_prime_axis, y_prime_axis), z_prime_axis)
+    coord = origin + 2 * x_prime_axis - 3 * y_prime_axis
+    assert np.allclose(centerline.get_in_plane_coordinates(coord, index), [2, -3, 0])
+
+
+def test_centerline_plans_parameters(centerline):
+    """Test that each centerline point lies on its plane, and distances to planes"""
+    a, b, c, d = centerline.get_plan_parameters(10)
+    assert a * centerline.points[10][0] + b * centerline.points[10][1] + c * centerline.points[10][2] + d == \
+        pytest.approx(0, abs=1e-10)
+    coords = centerline.points + 2 * centerline.derivatives
+    indexes = np.arange(centerline.number_of_points)
+    assert np.allclose(centerline.get_distances_from_planes(coords, indexes), 2)
+    index, plane_params, distance = centerline.get_nearest_plane(centerline.points[20], index=20)
+    assert distance == pytest.approx(0, abs=1e-10)
+    with pytest.raises(IndexError):
+        centerline.get_plan_parameters(centerline.number_of_points)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.warping
+
+from __future__ import print_function, absolute_import, division
+
+import os
+
+import pytest
+
+import numpy as np
+import nibabel
+from scipy.io import savemat
+
+import spinalcordtoolbox.image as msct_image
+from spinalcordtoolbox import warping
+
+
+def fake_3dimage_sct():
+    """
+    :return: an Image (3D) in RAS+ (aka SCT LPI) space, with recognizable values
+    """
+    shape = (10, 20, 30)
+    x, y, z = np.mgrid[0:shape[0], 0:shape[1], 0:shape[2]]
+    data = ((1 + x) * 1 + (1 + y) * 100 + (1 + z) * 10000).astype(np.float32)
+    nii = nibabel.nifti1.Nifti1Image(data, np.eye(4))
+    return msct_image.Image(data, hdr=nii.header, dim=nii.header.get_data_shape())
+
+
+def write_warp(img_ref, displacement, path):
+    """Write a constant warping field on the grid of img_ref"""
+    data = np.zeros(img_ref.data.shape + (1, 3))
+    data[..., 0, :] = displacement
+    img_warp = msct_image.Image(data, hdr=img_ref.hdr.copy())
+    img_warp.header.set_intent('vector', (), '')
+    img_warp.save(path)
+    return path
+
+
+@pytest.fixture()
+def tmp_path_warp(tmpdir):
+    warping.clear_cache()
+    yield str(tmpdir)
+    warping.clear_cache()
+
+
+@pytest.mark.parametrize('orientation', ['LPI', 'RPI', 'ASR', 'SAL', 'PIR'])
+def test_apply_transforms_warp(tmp_path_warp, orientation):
+    """Test that a constant warping field shifts the image in the physical space, with ITK conventions"""
+    img_src = fake_3dimage_sct().change_orientation(orientation)
+    shift_wanted = np.array([1, 2, 3])
+    shift = shift_wanted.copy()
+    shift[2] *= -1  # ANTs / ITK reference frame is LPS, ours is LPI
+    path_warp = write_warp(img_src, shift, os.path.join(tmp_path_warp, 'warp.nii.gz'))
+
+    img_dst = warping.apply_transforms(img_src, img_src, [path_warp], interp='nn')
+    assert img_dst.data.shape == img_src.data.shape
+    assert img_dst.data.dtype == np.float32
+
+    value = 50505
+    pt_src = np.argwhere(img_src.data == value)[0]
+    pt_dst = np.argwhere(img_dst.data == value)[0]
+    pos_src = img_src.transfo_pix2phys([pt_src])[0]
+    pos_dst = img_dst.transfo_pix2phys([pt_dst])[0]
+    assert np.allclose(pos_dst - pos_src, shift_wanted)
+
+
+def test_apply_transforms_null(tmp_path_warp):
+    """Test that a null warping field does not change the image, and that points outside the source are zeroed"""
+    img_src = fake_3dimage_sct()
+    path_warp = write_warp(img_src, [0, 0, 0], os.path.join(tmp_path_warp, 'warp0.nii.gz'))
+    for interp in ['nn', 'linear', 'spline']:
+        img_dst = warping.apply_transforms(img_src, img_src, [path_warp], interp=interp)
+        assert np.allclose(img_dst.data, img_src.data, rtol=1e-5)
+
+    # shift by 2 voxels along x: the first two slices fall outside of the source image
+    path_warp = write_warp(img_src, [2, 0, 0], os.path.join(tmp_path_warp, 'warp2.nii.gz'))
+    img_dst = warping.apply_transforms(img_src, img_src, [path_warp], interp='linear')
+    assert (img_dst.data[:2] == 0).all()
+    assert np.allclose(img_dst.data[2:], img_src.data[:-2])
+
+
+def test_apply_transforms_2d(tmp_path_warp):
+    """Test that 2D images are warped as 3D images with one slice"""
+    x, y = np.mgrid[0:20, 0:30]
+    data = ((1 + x) + (1 + y) * 100).astype(np.float32)
+    nii = nibabel.nifti1.Nifti1Image(data, np.eye(4))
+    img_src = msct_image.Image(data, hdr=nii.header, dim=nii.header.get_data_shape())
+    path_warp = os.path.join(tmp_path_warp, 'warp2d.nii.gz')
+    img_warp = msct_image.Image(np.zeros((20, 30, 1, 1, 2)), hdr=nii.header.copy())
+    img_warp.header.set_intent('vector', (), '')
+    img_warp.save(path_warp)
+    img_dst = warping.apply_transforms(img_src, img_src, [path_warp], interp='linear')
+    assert img_dst.data.shape == (20, 30)
+    assert np.allclose(img_dst.data, data, rtol=1e-5)
+
+    # shift by 2 voxels along x (ITK LPS+ frame)
+    img_warp.data[..., 0] = 2
+    img_warp.save(path_warp)
+    warping.clear_cache()
+    img_dst = warping.apply_transforms(img_src, img_src, [path_warp], interp='nn')
+    assert (img_dst.data[:2] == 0).all()
+    assert np.allclose(img_dst.data[2:], data[:-2])
+
+
+def test_read_itk_affine(tmp_path_warp):
+    """Test reading ITK affine files (.mat and .txt) with a center of rotation"""
+    angle = 0.3
+    matrix = np.array([[np.cos(angle), -np.sin(angle), 0],
+                       [np.sin(angle), np.cos(angle), 0],
+                       [0, 0, 1.2]])
+    translation = np.array([1., -2., 3.])
+    center = np.array([4., 5., -6.])
+    parameters = np.concatenate((matrix.ravel(), translation))
+
+    path_mat = os.path.join(tmp_path_warp, 'affine.mat')
+    savemat(path_mat, {'AffineTransform_double_3_3': parameters.reshape(-1, 1), 'fixed': center.reshape(-1, 1)})
+    path_txt = os.path.join(tmp_path_warp, 'affine.txt')
+    with open(path_txt, 'w') as f:
+        f.write("#Insight Transform File V1.0\n#Transform 0\nTransform: AffineTransform_double_3_3\n"
+                "Parameters: {}\nFixedParameters: {}\n".format(" ".join(map(str, parameters)),
+                                                               " ".join(map(str, center))))
+
+    points = np.random.RandomState(0).uniform(-20, 20, size=(50, 3))
+    points_lps = points * [-1, -1, 1]
+    expected = (np.dot(points_lps - center, matrix.T) + translation + center) * [-1, -1, 1]
+    for path in [path_mat, path_txt]:
+        transform = warping.read_transform(path)
+        assert np.allclose(transform.transform_points(points), expected)
+        assert np.allclose(warping.read_transform(path, inverse=True).transform_points(expected), points)
+
+    with pytest.raises(ValueError):
+        warping.read_transform(write_warp(fake_3dimage_sct(), [0, 0, 0], os.path.join(tmp_path_warp, 'w.nii')),
+                               inverse=True)
+
+
+def test_get_sampling_points(tmp_path_warp):
+    """Test composition of transformations and caching"""
+    img = fake_3dimage_sct()
+    path_warp1 = write_warp(img, [1, 0, 0], os.path.join(tmp_path_warp, 'warp1.nii.gz'))
+    path_warp2 = write_warp(img, [0, 0, -2], os.path.join(tmp_path_warp, 'warp2.nii.gz'))
+    path_affine = os.path.join(tmp_path_warp, 'affine.txt')
+    with open(path_affine, 'w') as f:
+        f.write("#Insight Transform File V1.0\n#Transform 0\nTransform: AffineTransform_double_3_3\n"
+                "Parameters: 1 0 0 0 1 0 0 0 1 0 3 0\nFixedParameters: 0 0 0\n")
+
+    points = warping.get_sampling_points(img, [path_warp1, path_affine, path_warp2])
+    x, y, z = np.mgrid[0:10, 0:20, 0:30]
+    points_dest = np.stack((x.ravel(), y.ravel(), z.ravel()), axis=1).astype(np.float64)
+    # affine and inverted affine cancel each other
+    path_affine_inv = os.path.join(tmp_path_warp, 'affine_inv.txt')
+    with open(path_affine, 'r') as f_in, open(path_affine_inv, 'w') as f_out:
+        f_out.write(f_in.read())
+    points_identity = warping.get_sampling_points(img, [path_affine, path_affine_inv], list_warpinv=[path_affine_inv])
+    assert np.allclose(points_identity, points_dest)
+
+    # destination points go through warp2, then the affine, then warp1 (only applied to points inside its grid)
+    expected = points_dest + [0, -3, -2]
+    inside = (expected[:, 1] >= -0.5) & (expected[:, 2] >= -0.5)
+    expected[inside] += [-1, 0, 0]
+    assert np.allclose(points, expected)
+
+    # cache
+    assert warping.get_sampling_points(img, [path_warp1, path_affine, path_warp2]) is points
+
+
+def test_apply_transforms_4d(tmp_path_warp):
+    """Test that 4D images are warped volume by volume, serially or with several threads"""
+    img_3d = fake_3dimage_sct()
+    data = np.stack([img_3d.data * (it + 1) for it in range(4)], axis=3)
+    hdr = img_3d.hdr.copy()
+    hdr['pixdim'][4] = 2.5
+    img_src = msct_image.Image(data, hdr=hdr)
+    path_warp = write_warp(img_3d, [1.5, 0, -0.5], os.path.join(tmp_path_warp, 'warp.nii.gz'))
+
+    img_ref = warping.apply_transforms(img_3d, img_3d, [path_warp], interp='spline')
+    for n_jobs in [1, 3]:
+        img_dst = warping.apply_transforms(img_src, img_3d, [path_warp], interp='spline', n_jobs=n_jobs)
+        assert img_dst.data.shape == data.shape
+        assert img_dst.hdr['pixdim'][4] == 2.5
+        for it in range(4):
+            assert np.allclose(img_dst.data[..., it], img_ref.data * (it + 1), rtol=1e-5)